@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+from starlette.concurrency import run_in_threadpool
+
+from app import rag_model
+from app.cache import embedding_cache, get_cached_response, set_cached_response
+from app.config import BATCH_EMBED_MAX_INPUTS, BATCH_GENERATE_CONCURRENCY, BATCH_RETRIEVE_CONCURRENCY
+from app.deadline import run_step
+from rag_common.canonical import query_keys
+from rag_common.ledger import ledger
+from rag_common.pipeline import deadline
+
+
+async def embed_misses(texts):
+    """
+    Embeddings for `texts`: cached ones first, the rest with one embeddings call per
+    BATCH_EMBED_MAX_INPUTS texts. Returns {text: vector or the exception that failed its chunk}.
+    """
+    vectors = {}
+    missing = []
+    for text in texts:
+        vector = embedding_cache.get(query_keys.key(text, "embedding"))
+        if vector is None:
+            missing.append(text)
+        else:
+            vectors[text] = vector
+
+    async def embed_chunk(chunk):
+        try:
+            results = await run_in_threadpool(rag_model.embedding_batcher.embed_batch, chunk)
+        except Exception as e:
+            results = [e] * len(chunk)
+        for text, vector in zip(chunk, results):
+            vectors[text] = vector
+            if not isinstance(vector, Exception):
+                embedding_cache.put(query_keys.canonical(text), vector)
+
+    chunks = [missing[i:i + BATCH_EMBED_MAX_INPUTS] for i in range(0, len(missing), BATCH_EMBED_MAX_INPUTS)]
+    await asyncio.gather(*(embed_chunk(chunk) for chunk in chunks))
+    return vectors
+
+
+async def stream_batch(queries, deadline_seconds=None):
+    """
+    Answers a list of queries and yields one NDJSON line per input in completion order:
+    {"index", "query", "status": "ok", "response", "source"} or {"index", "query", "status": "error", "error"}.
+
+    Duplicates (up to canonicalization) are answered once, cached answers are yielded first,
+    misses are embedded in bulk, retrieval and generation run concurrently under
+    BATCH_*_CONCURRENCY caps. Every answered query is a ledger request of its own (the bulk
+    embeddings calls only count in the ledger totals) with a deadline of `deadline_seconds` from
+    its retrieval on, degraded like /query/ ("degraded" lists the steps skipped to meet it).
+    Queries still running when the generator is closed (the client disconnected) are cancelled.
+    """
+    # First spelling of each canonical query -> positions of all its spellings
+    positions = {}
+    first = {}
+    for index, query in enumerate(queries):
+        positions.setdefault(first.setdefault(query_keys.canonical(query), query), []).append(index)
+
+    def lines(query, item):
+        return "".join(json.dumps({"index": index, "query": queries[index], **item}) + "\n"
+                       for index in positions[query])
+
+    misses = []
+    for query in positions:
+        response = get_cached_response(query)
+        if response:
+            yield lines(query, {"status": "ok", "response": response, "source": "cache"})
+        else:
+            misses.append(query)
+    if not misses:
+        return
+
+    vectors = await embed_misses(misses)
+    retrieve_slots = asyncio.Semaphore(BATCH_RETRIEVE_CONCURRENCY)
+    generate_slots = asyncio.Semaphore(BATCH_GENERATE_CONCURRENCY)
+
+    async def answer(query):
+        # One task per query, so the ledger request and the deadline stay in its own context
+        try:
+            with ledger.request("batch"):
+                vector = vectors[query]
+                if isinstance(vector, Exception):
+                    raise vector
+                await retrieve_slots.acquire()
+                with deadline(deadline_seconds) as item_deadline:
+                    try:
+                        documents = await run_step(
+                            "retrieve", lambda: run_in_threadpool(rag_model.retrieve_documents, vector))
+                    finally:
+                        retrieve_slots.release()
+                    async with generate_slots:
+                        response = await run_step(
+                            "generate", lambda: run_in_threadpool(rag_model.generate_answer, query, documents),
+                            fallback=(lambda: documents[0]) if documents else None)
+            item = {"status": "ok", "response": response, "source": "RAG"}
+            if item_deadline.degradations:
+                item["degraded"] = item_deadline.degradations
+            else:
+                set_cached_response(query, response)
+            return query, item
+        except Exception as e:
+            return query, {"status": "error", "error": str(e)}
+
+    loop = asyncio.get_running_loop()
+    tasks = [loop.create_task(answer(query)) for query in misses]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            query, item = await finished
+            yield lines(query, item)
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,92 @@
+import asyncio
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import EMBED_BATCH_MAX_IN_FLIGHT, EMBED_BATCH_MAX_SIZE, EMBED_BATCH_MAX_WAIT_MS
+
+
+class EmbeddingBatcher:
+    """
+    Collects texts arriving within a short window and embeds them with one batched call.
+
+    embed_batch is a blocking function mapping a list of texts to a list of vectors; it runs in
+    the thread pool. Each caller awaits a future resolved with its own vector, so N concurrent
+    requests cost about N / max_batch_size embedding round trips. Up to max_in_flight batches are
+    embedded at once; the next batch is collected while they run.
+    """
+
+    def __init__(self, embed_batch, max_batch_size=EMBED_BATCH_MAX_SIZE, max_wait_ms=EMBED_BATCH_MAX_WAIT_MS,
+                 max_in_flight=EMBED_BATCH_MAX_IN_FLIGHT):
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_in_flight = max_in_flight
+        self.queue = None
+        self.worker = None
+        self.slots = None
+        self.in_flight = set()
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_worker(self):
+        # The queue and the worker task belong to the running event loop, create them lazily
+        if self.worker is None or self.worker.done():
+            self.queue = asyncio.Queue()
+            self.slots = asyncio.Semaphore(self.max_in_flight)
+            self.worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def embed(self, text):
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # With max_in_flight calls running, wait here: the queue keeps filling the next batch
+            await self.slots.acquire()
+            task = asyncio.get_running_loop().create_task(self._embed(batch))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def _embed(self, batch):
+        try:
+            # Identical texts in one window are embedded once
+            texts = list(dict.fromkeys(text for text, _ in batch))
+            try:
+                vectors = dict(zip(texts, await run_in_threadpool(self.embed_batch, texts)))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            self.batches += 1
+            self.items += len(batch)
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(vectors[text])
+        finally:
+            self.slots.release()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
@@ -1,22 +1,199 @@
-from datetime import datetime, timedelta
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from app.config import CACHE_BACKEND, CACHE_KEY_PREFIX, CACHE_TTL_SECONDS, EMBEDDING_CACHE_SIZE, REDIS_URL
+from rag_common.canonical import query_keys
+
+CACHE_EXPIRATION = timedelta(seconds=CACHE_TTL_SECONDS)  # Cache expiry time
+
+
+class FakeRedis:
+    """
+    In-process stand-in for a Redis server (GET / SET with EX and NX / DELETE / PING / FLUSHDB).
+    Backs the "memory" cache and keeps tests free of a real Redis.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self.data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None, nx=False):
+        with self.lock:
+            if nx and key in self.data:
+                expires_at = self.data[key][1]
+                if expires_at is None or time.monotonic() < expires_at:
+                    return None
+            self.data[key] = (value.encode("utf-8") if isinstance(value, str) else value,
+                              time.monotonic() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        with self.lock:
+            return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def ping(self):
+        return True
+
+    def flushdb(self):
+        with self.lock:
+            self.data.clear()
+        return True
+
+    def dump(self):
+        """
+        Live entries as (key, value, seconds left or None), for snapshots.
+        """
+        now = time.monotonic()
+        with self.lock:
+            return [(key, value, None if expires_at is None else expires_at - now)
+                    for key, (value, expires_at) in self.data.items()
+                    if expires_at is None or expires_at > now]
+
+    def load(self, entries):
+        now = time.monotonic()
+        with self.lock:
+            for key, value, ttl in entries:
+                if ttl is None or ttl > 0:
+                    self.data[key] = (value, None if ttl is None else now + ttl)
+
+
+def create_redis_client(url=REDIS_URL):
+    try:
+        import redis
+    except ImportError as e:
+        raise ImportError("CACHE_BACKEND=redis needs `pip install redis`") from e
+    return redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+
+class ResponseCache:
+    """
+    Response cache on top of any Redis-protocol client. With a real Redis every uvicorn
+    worker shares the same entries; with FakeRedis the cache is process-local.
+    """
+
+    def __init__(self, client, ttl=CACHE_TTL_SECONDS, prefix=CACHE_KEY_PREFIX):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    @property
+    def shared(self):
+        return not isinstance(self.client, FakeRedis)
+
+    def get(self, query):
+        try:
+            value = self.client.get(self.prefix + query)
+        except Exception as e:
+            # A cache outage degrades to cache misses instead of failing requests
+            print(f"Cache read failed: {e}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    def set(self, query, response):
+        try:
+            self.client.set(self.prefix + query, json.dumps(response), ex=self.ttl)
+        except Exception as e:
+            print(f"Cache write failed: {e}")
+
+    def ping(self):
+        return self.client.ping()
+
+    def claim(self, name, ttl=None):
+        """
+        True for the first caller to claim `name` within `ttl` seconds (default: the response
+        TTL) across every worker sharing the cache (SET NX), for work that must run once.
+        """
+        try:
+            return bool(self.client.set(f"{self.prefix}claim:{name}", str(os.getpid()), ex=ttl or self.ttl, nx=True))
+        except Exception as e:
+            print(f"Cache claim failed: {e}")
+            return False
+
+    def export(self):
+        """
+        [query, response, seconds left] of a process-local cache (a shared Redis persists itself).
+        """
+        if self.shared:
+            return []
+        return [[key[len(self.prefix):], json.loads(value), ttl]
+                for key, value, ttl in self.client.dump() if key.startswith(self.prefix)]
+
+    def restore(self, entries):
+        if self.shared:
+            return 0
+        self.client.load([(self.prefix + query, json.dumps(response).encode("utf-8"), ttl)
+                          for query, response, ttl in entries])
+        return len(entries)
+
+
+def create_cache(backend=CACHE_BACKEND):
+    if backend == "redis":
+        return ResponseCache(create_redis_client())
+    if backend == "memory":
+        return ResponseCache(FakeRedis())
+    raise ValueError(f"Unknown CACHE_BACKEND {backend}, expected 'memory' or 'redis'")
+
+
+cache = create_cache()
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU of query embeddings. Responses expire after CACHE_TTL_SECONDS, embeddings
+    do not, so a repeated query whose response expired skips the embeddings call.
+    """
+
+    def __init__(self, max_size=EMBEDDING_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, text):
+        with self.lock:
+            vector = self.entries.get(text)
+            if vector is not None:
+                self.entries.move_to_end(text)
+            return vector
+
+    def put(self, text, vector):
+        with self.lock:
+            self.entries[text] = vector
+            self.entries.move_to_end(text)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def items(self):
+        with self.lock:
+            return list(self.entries.items())
+
+
+embedding_cache = EmbeddingCache()
 
-# In-memory cache
-cache = {}
-CACHE_EXPIRATION = timedelta(minutes=5)  # Cache expiry time
 
 def get_cached_response(query):
     """
-    Retrieves a cached response if available and not expired.
+    Retrieves a cached response if available and not expired (keyed by the canonical query).
     """
-    cache_entry = cache.get(query)
-    if cache_entry:
-        response, timestamp = cache_entry
-        if datetime.now() - timestamp < CACHE_EXPIRATION:
-            return response
-    return None
+    return cache.get(query_keys.key(query, "response"))
+
 
 def set_cached_response(query, response):
     """
-    Stores the response in cache with the current timestamp.
+    Stores the response in cache, it expires after CACHE_TTL_SECONDS.
     """
-    cache[query] = (response, datetime.now())
+    cache.set(query_keys.canonical(query), response)
@@ -4,3 +4,53 @@ import os
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_ENVIRONMENT = os.getenv("PINECONE_ENVIRONMENT")
+
+# Query Pinecone over gRPC (needs pinecone-client[grpc]) instead of JSON over HTTP
+PINECONE_GRPC = os.getenv("PINECONE_GRPC", "false").lower() == "true"
+
+# Response cache: "memory" (process-local) or "redis" (shared by every worker)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "300"))
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "rag:response:")
+
+# Queries answered once at startup so a fresh deployment starts with a warm cache (separated by "|")
+WARMUP_QUERIES = [q for q in os.getenv("WARMUP_QUERIES", "").split("|") if q.strip()]
+
+# Micro-batching of embedding requests: queries arriving within the wait window share one API call,
+# up to EMBED_BATCH_MAX_IN_FLIGHT calls run at once
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+EMBED_BATCH_MAX_IN_FLIGHT = int(os.getenv("EMBED_BATCH_MAX_IN_FLIGHT", "4"))
+
+# Multi-turn sessions: recent turns are kept verbatim up to a token budget, older ones are summarized;
+# with CACHE_BACKEND=redis they are stored in Redis under SESSION_KEY_PREFIX, else per worker
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "1800"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "600"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "200"))
+SESSION_KEY_PREFIX = os.getenv("SESSION_KEY_PREFIX", "rag:session:")
+
+# Query embeddings kept in memory (they do not expire, unlike cached responses)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+
+# Warm-start snapshot of the embedding and response caches: restored at startup, written every
+# SNAPSHOT_INTERVAL_SECONDS (0 = only at shutdown). Empty SNAPSHOT_PATH disables it.
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "")
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "300"))
+
+# /query/batch: max queries per request, texts per embeddings call, concurrent Pinecone queries
+# and concurrent generations
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "1000"))
+BATCH_EMBED_MAX_INPUTS = int(os.getenv("BATCH_EMBED_MAX_INPUTS", "2048"))
+BATCH_RETRIEVE_CONCURRENCY = int(os.getenv("BATCH_RETRIEVE_CONCURRENCY", "16"))
+BATCH_GENERATE_CONCURRENCY = int(os.getenv("BATCH_GENERATE_CONCURRENCY", "8"))
+
+# Default /query/ deadline in milliseconds (0 = none). Generation is skipped when less time is
+# left than its QUERY_STEP_QUANTILE duration so far, and the top retrieved document returned
+QUERY_DEADLINE_MS = float(os.getenv("QUERY_DEADLINE_MS", "0"))
+QUERY_STEP_QUANTILE = float(os.getenv("QUERY_STEP_QUANTILE", "0.9"))
+
+# Whether /query/ clients may ask for a profile with "profile": true (403 otherwise). The
+# profiler itself (PROFILE_SAMPLE_RATE, PROFILE_DIR, ...) is configured in rag_common/config.py
+PROFILE_REQUESTS_ENABLED = os.getenv("PROFILE_REQUESTS_ENABLED", "false").lower() == "true"
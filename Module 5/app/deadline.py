@@ -0,0 +1,67 @@
+"""
+Deadline-bounded steps of /query/ and /query/batch: the async counterpart of a pipeline stage.
+
+A request opened with rag_common.pipeline.deadline(seconds) bounds every step of get_rag_response run inside it:
+
+- embedding and retrieval are required, a step still running at the deadline raises
+  DeadlineExceeded;
+- generation is optional: when less time is left than it usually takes (the
+  QUERY_STEP_QUANTILE of its recent durations) it is skipped, and a generation still running at
+  the deadline is abandoned, the top retrieved document answers instead.
+
+Skipped and abandoned steps are listed in the request's degradations ("skip:generate",
+"timeout:generate"). The durations of the finished steps are collected by record_steps().
+"""
+import asyncio
+import contextlib
+import contextvars
+import math
+import time
+
+from app.config import QUERY_STEP_QUANTILE
+from rag_common.pipeline import Deadline, DeadlineExceeded, Durations, current_deadline
+
+# Recent durations of each step, shared by all requests
+step_durations = {}
+_timings = contextvars.ContextVar("step_timings", default=None)
+
+
+@contextlib.contextmanager
+def record_steps():
+    """
+    Yields a dict filled with {step: seconds} by the steps run inside the block.
+    """
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+async def run_step(name, make, fallback=None):
+    """
+    Awaits make() within the current request deadline. With a fallback the step is optional:
+    fallback() is returned instead when the step would not finish in time.
+    """
+    request = current_deadline() or Deadline()
+    durations = step_durations.setdefault(name, Durations())
+    if fallback is not None and request.remaining() <= durations.quantile(QUERY_STEP_QUANTILE):
+        request.degrade(f"skip:{name}")
+        return fallback()
+
+    started = time.perf_counter()
+    timeout = max(0.0, request.remaining()) if request.seconds != math.inf else None
+    try:
+        result = await asyncio.wait_for(make(), timeout)
+    except asyncio.TimeoutError:
+        if fallback is None:
+            raise DeadlineExceeded(f"Request deadline of {request.seconds}s reached in step {name}")
+        request.degrade(f"timeout:{name}")
+        return fallback()
+    seconds = time.perf_counter() - started
+    durations.add(seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+    return result
@@ -1,32 +1,183 @@
+import asyncio
 from fastapi import FastAPI, HTTPException, Request
-from app.rag_model import get_rag_response
-from app.cache import get_cached_response, set_cached_response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from app.batch import stream_batch
+from app.config import (
+    BATCH_MAX_QUERIES,
+    PROFILE_REQUESTS_ENABLED,
+    QUERY_DEADLINE_MS,
+    SNAPSHOT_INTERVAL_SECONDS,
+    SNAPSHOT_PATH,
+    WARMUP_QUERIES,
+)
+from app.deadline import record_steps
+from app.rag_model import get_rag_response, summarize_history
+from app.memory import SessionStore
+from app.cache import cache, get_cached_response, set_cached_response
+from rag_common.canonical import query_keys
+from rag_common.ledger import TokenBudgetExceeded, ledger
+from rag_common.pipeline import DeadlineExceeded, current_deadline, deadline
+from rag_common.profiler import profile_async
+from app.snapshot import restore_snapshot, save_snapshot, snapshot_periodically
 
 app = FastAPI()
 
+# Conversation state for requests that carry a session_id, shared by the workers with a shared cache
+session_store = SessionStore(summarize=summarize_history, client=cache.client if cache.shared else None)
+
+@app.on_event("startup")
+async def warm_up():
+    """
+    Runs in every worker: checks the cache backend, restores the warm-start snapshot and
+    pre-answers WARMUP_QUERIES that are not cached yet, so the first real requests hit a warm cache.
+    With a shared cache only the first worker to claim the warm-up generates the answers (once per
+    CACHE_TTL_SECONDS); a process-local cache is warmed by each worker for itself.
+    """
+    await run_in_threadpool(cache.ping)
+    if not cache.shared:
+        print("Using a process-local cache and sessions; set CACHE_BACKEND=redis to share them between workers")
+
+    if SNAPSHOT_PATH:
+        embeddings, responses = await run_in_threadpool(restore_snapshot)
+        print(f"Restored {embeddings} embeddings and {responses} responses from {SNAPSHOT_PATH}")
+        if SNAPSHOT_INTERVAL_SECONDS:
+            asyncio.get_running_loop().create_task(snapshot_periodically())
+
+    if WARMUP_QUERIES and cache.shared and not cache.claim("warmup"):
+        print("Warm-up already claimed by another worker")
+        return
+    for query in WARMUP_QUERIES:
+        if get_cached_response(query) is None:
+            try:
+                response = await get_rag_response(query)
+                set_cached_response(query, response)
+            except Exception as e:
+                print(f"Warm-up failed for '{query}': {e}")
+
+@app.on_event("shutdown")
+async def write_snapshot():
+    if SNAPSHOT_PATH:
+        try:
+            await run_in_threadpool(save_snapshot)
+        except Exception as e:
+            print(f"Snapshot failed: {e}")
+    try:
+        await run_in_threadpool(ledger.flush)
+    except Exception as e:
+        print(f"Ledger flush failed: {e}")
+
 @app.get("/")
 def root():
     return {"message": "RAG API is running"}
 
+@app.get("/cache/stats")
+def cache_stats():
+    """
+    Per cache (response, embedding): lookups and the hit rates of raw vs canonical query keys.
+    """
+    return query_keys.stats()
+
+@app.get("/ledger")
+def ledger_stats(recent: int = 20):
+    """
+    Token and cost totals per pipeline and per model, and the most recent requests.
+    """
+    return {**ledger.totals(), "recent": ledger.recent(recent)}
+
 @app.post("/query/")
 async def query_rag(request: Request):
     """
     Endpoint to handle RAG queries.
     Checks the cache first before generating a response.
+    With a session_id the answer takes the conversation so far into account.
+    "token_budget" overrides REQUEST_TOKEN_BUDGET for this request (429 once it is used up),
+    "include_cost": true adds the request's token and cost summary to the response.
+    "deadline_ms" overrides QUERY_DEADLINE_MS: a generation that would not finish in time is
+    replaced by the top retrieved document and listed in "degraded" (504 if retrieval misses it).
+    "profile": true (only with PROFILE_REQUESTS_ENABLED, 403 otherwise) samples the request's
+    stacks into PROFILE_DIR and adds the profile summary to the response. A PROFILE_SAMPLE_RATE
+    share of requests is profiled too, without the summary.
     """
     data = await request.json()
     query = data.get("query")
+    session_id = data.get("session_id")
+    budget = data.get("token_budget")
+    deadline_ms = data.get("deadline_ms", QUERY_DEADLINE_MS)
     
     if not query:
         raise HTTPException(status_code=400, detail="Query is required")
+    if budget is not None and (isinstance(budget, bool) or not isinstance(budget, int) or budget < 0):
+        raise HTTPException(status_code=400, detail="token_budget must be a non-negative integer")
+    if isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float)) or deadline_ms < 0:
+        raise HTTPException(status_code=400, detail="deadline_ms must be a non-negative number")
+    profile_requested = bool(data.get("profile"))
+    if profile_requested and not PROFILE_REQUESTS_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiling requests is disabled")
+
+    with ledger.request("query", budget) as usage, deadline(deadline_ms / 1000) as request_deadline, \
+            record_steps() as timings:
+        async with profile_async("query", force=profile_requested) as opened:
+            try:
+                result = await answer_query(query, session_id)
+            except TokenBudgetExceeded as e:
+                raise HTTPException(status_code=429, detail=str(e))
+            except DeadlineExceeded as e:
+                raise HTTPException(status_code=504, detail=str(e))
+            finally:
+                if opened is not None:
+                    opened.add_run("query", timings)
+    if request_deadline.degradations:
+        result["degraded"] = request_deadline.degradations
+    if opened is not None and profile_requested:
+        result["profile"] = opened.summary()
+    if data.get("include_cost"):
+        result["usage"] = usage.summary()
+    return result
+
+async def answer_query(query, session_id):
+    request_deadline = current_deadline()
+    session = session_store.get(session_id) if session_id else None
+    if session is not None and session.window:
+        # Follow-up question: the answer depends on the history, so it bypasses the cache
+        response = await get_rag_response(query, history=session.context(),
+                                          retrieval_text=session.retrieval_text(query))
+        session_store.add_turn(session_id, query, response)
+        return {"response": response, "source": "RAG", "session_id": session_id}
 
     # Check cache for the query response
-    cached_response = get_cached_response(query)
-    if cached_response:
-        return {"response": cached_response, "source": "cache"}
+    source = "cache"
+    response = get_cached_response(query)
+    if not response:
+        # Generate RAG response if not cached
+        response = await get_rag_response(query)
+        if not request_deadline.degradations:
+            set_cached_response(query, response)  # Cache the new response, unless degraded
+        source = "RAG"
 
-    # Generate RAG response if not cached
-    response = get_rag_response(query)
-    set_cached_response(query, response)  # Cache the new response
-    
-    return {"response": response, "source": "RAG"}
+    result = {"response": response, "source": source}
+    if session_id:
+        session_store.add_turn(session_id, query, response)
+        result["session_id"] = session_id
+    return result
+
+@app.post("/query/batch")
+async def query_batch(request: Request):
+    """
+    Answers a list of queries in one request, for offline jobs.
+    Results stream back as NDJSON, one line per query in completion order, each with its
+    position in the input and a per-item status.
+    "deadline_ms" (default QUERY_DEADLINE_MS) bounds each query from its retrieval on.
+    """
+    data = await request.json()
+    queries = data.get("queries")
+    deadline_ms = data.get("deadline_ms", QUERY_DEADLINE_MS)
+
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+        raise HTTPException(status_code=400, detail="queries must be a non-empty list of strings")
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUERIES} queries per batch")
+    if isinstance(deadline_ms, bool) or not isinstance(deadline_ms, (int, float)) or deadline_ms < 0:
+        raise HTTPException(status_code=400, detail="deadline_ms must be a non-negative number")
+
+    return StreamingResponse(stream_batch(queries, deadline_ms / 1000), media_type="application/x-ndjson")
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict, deque
+
+from starlette.concurrency import run_in_threadpool
+
+from app.config import HISTORY_TOKEN_BUDGET, MAX_SESSIONS, SESSION_KEY_PREFIX, SESSION_TTL_SECONDS
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English text, good enough for budgeting
+    return len(text) // 4 + 1
+
+
+class Session:
+    """
+    Compact per-session state: a rolling summary, the turns waiting to be folded into it
+    and a window of recent (query, answer) turns that fits the token budget.
+    """
+
+    __slots__ = ("summary", "pending", "window", "window_tokens", "updated_at")
+
+    # Turns waiting for summarization when the summarizer keeps failing are capped
+    MAX_PENDING = 20
+
+    def __init__(self, summary="", pending=(), window=()):
+        self.summary = summary
+        self.pending = deque(pending, maxlen=self.MAX_PENDING)
+        self.window = deque(window)
+        self.window_tokens = sum(estimate_tokens(query) + estimate_tokens(answer) for query, answer in self.window)
+        self.updated_at = time.monotonic()
+
+    def context(self):
+        """
+        History to send with the next query: summary + turns not summarized yet + recent window.
+        """
+        return {
+            "summary": self.summary,
+            "turns": list(self.pending) + list(self.window),
+        }
+
+    def retrieval_text(self, query):
+        """
+        Text embedded for retrieval: the query conditioned on the conversation summary and the
+        last question, so follow-ups like "and for e-books?" still find the right documents.
+        """
+        if not self.window:
+            return query
+        last_query, _ = self.window[-1]
+        return "\n".join(part for part in (self.summary, last_query, query) if part)
+
+    def to_json(self):
+        return json.dumps({"summary": self.summary, "pending": list(self.pending), "window": list(self.window)})
+
+    @classmethod
+    def from_json(cls, value):
+        data = json.loads(value)
+        return cls(data["summary"], map(tuple, data["pending"]), map(tuple, data["window"]))
+
+
+class SessionStore:
+    """
+    Session store. When a session's window exceeds the token budget, the oldest turns move to
+    `pending` and are summarized in a background task with `summarize(summary, turns) -> summary`,
+    a blocking function run in the thread pool.
+
+    With a Redis-protocol `client` (CACHE_BACKEND=redis) sessions are stored as JSON under
+    SESSION_KEY_PREFIX + id with a TTL, so every worker sees the same conversation; concurrent turns
+    of one session on two workers are last-writer-wins. Without one they are kept in a bounded
+    process-local LRU (+ TTL): with several workers a follow-up only sees the turns answered by
+    the same worker.
+    """
+
+    def __init__(self, summarize, client=None, prefix=SESSION_KEY_PREFIX, max_sessions=MAX_SESSIONS,
+                 ttl=SESSION_TTL_SECONDS, token_budget=HISTORY_TOKEN_BUDGET):
+        self.summarize = summarize
+        self.client = client
+        self.prefix = prefix
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.sessions = OrderedDict()
+        self.summarizing = {}  # session id -> summarization task of this worker
+
+    @property
+    def shared(self):
+        return self.client is not None
+
+    def load(self, session_id):
+        """
+        The live session, or None.
+        """
+        if self.shared:
+            try:
+                value = self.client.get(f"{self.prefix}{session_id}")
+            except Exception as e:
+                # A store outage degrades to answering without history
+                print(f"Session read failed: {e}")
+                return None
+            return Session.from_json(value) if value is not None else None
+
+        session = self.sessions.get(session_id)
+        if session is not None and time.monotonic() - session.updated_at > self.ttl:
+            del self.sessions[session_id]
+            session = None
+        if session is not None:
+            self.sessions.move_to_end(session_id)
+        return session
+
+    def save(self, session_id, session):
+        session.updated_at = time.monotonic()
+        if self.shared:
+            try:
+                self.client.set(f"{self.prefix}{session_id}", session.to_json(), ex=self.ttl)
+            except Exception as e:
+                print(f"Session write failed: {e}")
+            return
+        self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        while len(self.sessions) > self.max_sessions:
+            self.sessions.popitem(last=False)
+
+    def get(self, session_id):
+        session = self.load(session_id)
+        if session is None:
+            session = Session()
+            self.save(session_id, session)
+        return session
+
+    def add_turn(self, session_id, query, answer):
+        # Loaded again: other turns of the session may have been added while this one was answered
+        session = self.get(session_id)
+        session.window.append((query, answer))
+        session.window_tokens += estimate_tokens(query) + estimate_tokens(answer)
+
+        # Keep at least the latest turn verbatim, move older ones out of the window
+        while session.window_tokens > self.token_budget and len(session.window) > 1:
+            old_query, old_answer = session.window.popleft()
+            session.window_tokens -= estimate_tokens(old_query) + estimate_tokens(old_answer)
+            session.pending.append((old_query, old_answer))
+        self.save(session_id, session)
+
+        task = self.summarizing.get(session_id)
+        if session.pending and (task is None or task.done()):
+            task = asyncio.get_running_loop().create_task(self._summarize(session_id, session))
+            self.summarizing[session_id] = task
+            task.add_done_callback(lambda _: self.summarizing.pop(session_id, None))
+
+    async def _summarize(self, session_id, session):
+        while session is not None and session.pending:
+            turns = list(session.pending)
+            try:
+                summary = await run_in_threadpool(self.summarize, session.summary, turns)
+            except Exception as e:
+                # Keep the turns pending, the next add_turn retries
+                print(f"Session summarization failed: {e}")
+                return
+            session = self.load(session_id)
+            if session is None:
+                return
+            session.summary = summary
+            # Turns added while summarizing stay pending for the next round
+            pending = list(session.pending)
+            if pending[:len(turns)] == turns:
+                pending = pending[len(turns):]
+            session.pending = deque(pending, maxlen=Session.MAX_PENDING)
+            self.save(session_id, session)
@@ -1,36 +1,129 @@
+import base64
+import sys
+from array import array
+
 import openai
 import pinecone
-from app.config import OPENAI_API_KEY, PINECONE_API_KEY, PINECONE_ENVIRONMENT
+from starlette.concurrency import run_in_threadpool
+from app.batcher import EmbeddingBatcher
+from app.cache import embedding_cache
+from app.config import OPENAI_API_KEY, PINECONE_API_KEY, PINECONE_ENVIRONMENT, PINECONE_GRPC, SUMMARY_MAX_TOKENS
+from app.deadline import run_step
+from app.memory import estimate_tokens
+from rag_common.canonical import query_keys
+from rag_common.ledger import CURRENT, ledger
 
 # Initialize OpenAI and Pinecone clients
 client = openai.OpenAI(api_key=OPENAI_API_KEY)
 pinecone.init(api_key=PINECONE_API_KEY, environment=PINECONE_ENVIRONMENT)
 
-# Define your Pinecone index
+# Define your Pinecone index (gRPC sends vectors as protobuf floats instead of JSON text)
 index_name = "rag-index"
-index = pinecone.Index(index_name)
+index = pinecone.GRPCIndex(index_name) if PINECONE_GRPC else pinecone.Index(index_name)
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+CHAT_MODEL = "gpt-4o-mini"
+
+def decode_embedding(encoded):
+    """
+    float32 array from a base64 embedding (little-endian floats), 4 bytes per dimension
+    instead of one Python float object each.
+    """
+    vector = array("f", base64.b64decode(encoded))
+    if sys.byteorder == "big":
+        vector.byteswap()
+    return vector
+
+def embed_texts(texts):
+    """
+    Embeds a list of texts with one OpenAI call, returned in input order.
+    The vectors travel as base64 float32 and are kept as arrays, not lists of floats.
+    The call serves several requests, so its usage only goes to the ledger totals.
+    """
+    response = client.embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=texts,
+        encoding_format="base64"
+    )
+    ledger.record(EMBEDDING_MODEL, response.usage.prompt_tokens, embeddings=len(texts), usage=None)
+    return [decode_embedding(item.embedding) for item in sorted(response.data, key=lambda item: item.index)]
+
+# Concurrent requests share batched embedding calls
+embedding_batcher = EmbeddingBatcher(embed_texts)
+
+def retrieve_documents(query_embedding, top_k=3):
+    # Cached and fresh embeddings are float32 arrays / views, the client wants a list
+    results = index.query(queries=[query_embedding.tolist()], top_k=top_k, include_metadata=True)
+    return [match["metadata"]["text"] for match in results["matches"]]
+
+def history_messages(history):
+    """
+    Chat messages for a session's history: the rolling summary, then the recent turns verbatim.
+    """
+    if not history:
+        return []
+    messages = []
+    if history["summary"]:
+        messages.append({"role": "system", "content": f"Summary of the conversation so far: {history['summary']}"})
+    for past_query, past_answer in history["turns"]:
+        messages.append({"role": "user", "content": past_query})
+        messages.append({"role": "assistant", "content": past_answer})
+    return messages
+
+def chat(messages, max_tokens, background=False):
+    """
+    One chat completion, recorded in the ledger. Fails once the current request has used its
+    token budget and caps max_tokens to what is left; background work is charged to no request.
+    """
+    remaining = None if background else ledger.check_budget()
+    response = client.chat.completions.create(
+        model=CHAT_MODEL,
+        messages=messages,
+        max_tokens=max_tokens if remaining is None else min(max_tokens, remaining)
+    )
+    ledger.record(CHAT_MODEL, response.usage.prompt_tokens, response.usage.completion_tokens,
+                  usage=None if background else CURRENT)
+    return response.choices[0].message.content
+
+def generate_answer(query, documents, history=None):
+    prompt = f"Query: {query}\n\nContext:\n" + "\n".join(documents) + "\n\nAnswer:"
+    return chat(history_messages(history) + [{"role": "user", "content": prompt}], 150)
+
+def summarize_history(summary, turns):
+    """
+    Folds older turns into the running conversation summary.
+    """
+    transcript = "\n".join(f"User: {q}\nAssistant: {a}" for q, a in turns)
+    prompt = (
+        "Update the summary of a customer support conversation with the new turns. "
+        "Keep facts the customer shared and open questions, drop small talk. "
+        f"Answer with the updated summary only.\n\nCurrent summary: {summary or '(empty)'}\n\nNew turns:\n{transcript}"
+    )
+    return chat([{"role": "user", "content": prompt}], SUMMARY_MAX_TOKENS, background=True)
 
-def get_rag_response(query):
+async def get_rag_response(query, history=None, retrieval_text=None):
     """
     Generates a response using RAG by querying Pinecone and
     using OpenAI for context-augmented generation.
+    For multi-turn sessions, `history` is the condensed conversation and `retrieval_text`
+    the query conditioned on it.
+    Every step runs within the current request deadline; a generation that would not finish in
+    time is replaced by the top retrieved document.
     """
-    # Step 1: Create embeddings for the query
-    query_embedding = client.embeddings.create(
-        model="text-embedding-3-small",
-        input=query
-    ).data[0].embedding
+    # Step 1: Create embeddings for the query (cached, micro-batched with concurrent requests)
+    text = retrieval_text or query
+    key = query_keys.key(text, "embedding")
+    query_embedding = embedding_cache.get(key)
+    if query_embedding is None:
+        query_embedding = await run_step("embed", lambda: embedding_batcher.embed(text))
+        embedding_cache.put(key, query_embedding)
+        ledger.charge_share(EMBEDDING_MODEL, estimate_tokens(text))
     
     # Step 2: Query Pinecone for relevant documents
-    results = index.query(queries=[query_embedding], top_k=3, include_metadata=True)
-    documents = [match["metadata"]["text"] for match in results["matches"]]
+    documents = await run_step("retrieve", lambda: run_in_threadpool(retrieve_documents, query_embedding))
     
     # Step 3: Create a prompt with context for OpenAI
-    prompt = f"Query: {query}\n\nContext:\n" + "\n".join(documents) + "\n\nAnswer:"
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=150
-    ).choices[0].message.content
+    response = await run_step("generate", lambda: run_in_threadpool(generate_answer, query, documents, history),
+                              fallback=(lambda: documents[0]) if documents else None)
     
     return response
@@ -0,0 +1,89 @@
+"""
+Warm-start snapshot of the embedding cache and the process-local response cache.
+
+Written with rag_common.snapshot (atomically) as two sections:
+
+    embeddings  EMBEDDINGS section, one float32 row per cached query embedding
+    responses   JSON section, [[query, response, seconds left], ...]
+
+At startup the file is memory-mapped and every cached embedding becomes a zero-copy float32
+row, so restoring takes milliseconds even for large caches.
+
+Every worker restores the snapshot, but only one writes it: the first to take the lock on
+"<path>.lock" keeps it for its lifetime (the other workers skip their saves), and another worker
+takes over at its next save once that one exits.
+"""
+import asyncio
+import fcntl
+
+from starlette.concurrency import run_in_threadpool
+
+from app.cache import cache, embedding_cache
+from app.config import SNAPSHOT_INTERVAL_SECONDS, SNAPSHOT_PATH
+from rag_common.snapshot import open_snapshot, write_snapshot
+
+# Kept open for the lifetime of the process: restored embeddings are views into it
+_mapped = []
+# Lock file held while this worker is the snapshot writer
+_writer_lock = []
+
+
+def claim_writer(path=SNAPSHOT_PATH):
+    """
+    True if this worker is, or now becomes, the one that writes the snapshot.
+    """
+    if _writer_lock:
+        return True
+    f = open(f"{path}.lock", "a")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _writer_lock.append(f)
+    return True
+
+
+def save_snapshot(path=SNAPSHOT_PATH):
+    """
+    Writes this worker's caches to the snapshot; returns the embeddings written, or None when
+    another worker is the writer.
+    """
+    if not claim_writer(path):
+        return None
+    embeddings = dict(embedding_cache.items())
+    write_snapshot(path, embeddings={"embeddings": embeddings}, documents={"responses": cache.export()})
+    return len(embeddings)
+
+
+def restore_snapshot(path=SNAPSHOT_PATH):
+    """
+    Loads a snapshot into the caches, returns (embeddings, responses) restored.
+    A missing or unreadable snapshot is a cold start, not an error.
+    """
+    snapshot = open_snapshot(path)
+    if snapshot is None:
+        return 0, 0
+    _mapped.append(snapshot)
+
+    embeddings = snapshot.embeddings("embeddings")
+    restored = 0
+    for text, vector in embeddings.items() if embeddings is not None else ():
+        if embedding_cache.get(text) is None:
+            embedding_cache.put(text, vector)
+        restored += 1
+
+    # Response TTLs keep counting while the service is down
+    downtime = snapshot.age()
+    responses = [[query, response, None if ttl is None else ttl - downtime]
+                 for query, response, ttl in snapshot.document("responses", [])]
+    return restored, cache.restore(responses)
+
+
+async def snapshot_periodically(interval=SNAPSHOT_INTERVAL_SECONDS):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(save_snapshot)
+        except Exception as e:
+            print(f"Snapshot failed: {e}")
@@ -0,0 +1,16 @@
+import multiprocessing
+import os
+
+# Multi-worker deployment: one uvicorn worker per core by default.
+# Use CACHE_BACKEND=redis so all workers share one response cache.
+bind = f"0.0.0.0:{os.getenv('PORT', '80')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app once in the master and fork it into the workers (shared pages, faster boot);
+# clients open their connections lazily, after the fork
+preload_app = True
+
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = 30
+keepalive = 5
@@ -0,0 +1,306 @@
+"""
+Load generator for the /query/ endpoint.
+
+Replays a query log (one query per line, or JSON lines with a "query" field) or a synthetic
+Zipfian mix of FAQ questions, at a fixed arrival rate with a concurrency cap, and reports
+throughput, latency percentiles, error rate and cache hit ratio per interval.
+
+    # In-process, against the app with a mocked OpenAI / Pinecone backend
+    python loadtest.py --mode inprocess --rate 200 --concurrency 64 --duration 30
+
+    # Over HTTP, against a running deployment
+    python loadtest.py --mode http --url http://localhost:8081 --log queries.txt --rate 50
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import random
+import time
+import urllib.error
+import urllib.request
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+FAQ_QUESTIONS = [
+    "What is your return policy?",
+    "How do I track my order?",
+    "What payment methods do you accept?",
+    "Do you offer student discounts?",
+    "How do I download my e-book?",
+    "Can I get a refund for a course?",
+    "How long do I have access to a course?",
+    "Do you offer certificates of completion?",
+    "I forgot my password, how do I reset it?",
+    "What are your shipping options?",
+    "Can I change or cancel my order?",
+    "Do you have a mobile app?",
+]
+
+
+def load_queries(path):
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            queries.append(json.loads(line)["query"] if line.startswith("{") else line)
+    return queries
+
+
+class ZipfianQueries:
+    """
+    Draws from `distinct` queries with probability proportional to 1 / rank^s, like real FAQ
+    traffic where a few questions dominate. Queries beyond the built-in list are numbered variants.
+    """
+
+    def __init__(self, distinct=200, s=1.1, seed=0):
+        self.queries = [
+            FAQ_QUESTIONS[i] if i < len(FAQ_QUESTIONS) else f"{FAQ_QUESTIONS[i % len(FAQ_QUESTIONS)]} (variant {i})"
+            for i in range(distinct)
+        ]
+        weights = [1 / (rank ** s) for rank in range(1, distinct + 1)]
+        total = sum(weights)
+        self.cumulative = []
+        running = 0.0
+        for weight in weights:
+            running += weight / total
+            self.cumulative.append(running)
+        self.rng = random.Random(seed)
+
+    def next(self):
+        index = bisect.bisect_left(self.cumulative, self.rng.random())
+        return self.queries[min(index, len(self.queries) - 1)]
+
+
+class ReplayQueries:
+    def __init__(self, queries):
+        self.queries = queries
+        self.position = 0
+
+    def next(self):
+        query = self.queries[self.position % len(self.queries)]
+        self.position += 1
+        return query
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def summarize(samples, elapsed):
+    """
+    samples: list of (latency_seconds, ok, cache_hit)
+    """
+    latencies = sorted(latency for latency, _, _ in samples)
+    ok = [s for s in samples if s[1]]
+    return {
+        "requests": len(samples),
+        "qps": len(samples) / elapsed if elapsed > 0 else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "error_rate": 1 - len(ok) / len(samples) if samples else 0.0,
+        "cache_hit_ratio": sum(1 for s in ok if s[2]) / len(ok) if ok else 0.0,
+    }
+
+
+# --- Targets -------------------------------------------------------------------------------------
+
+class InProcessTarget:
+    """
+    Calls the ASGI app directly. OpenAI and Pinecone are replaced by sleeps of the given latency,
+    so the numbers reflect the service itself (cache, batching, event loop, thread pool).
+    """
+
+    def __init__(self, embed_ms=20, retrieve_ms=30, generate_ms=400):
+        os.environ.setdefault("OPENAI_API_KEY", "loadtest")
+        os.environ.setdefault("PINECONE_API_KEY", "loadtest")
+        from app import rag_model
+        from app.main import app
+
+        def embed_texts(texts):
+            time.sleep(embed_ms / 1000)
+            return [array("f", [0.0] * 8) for _ in texts]
+
+        def retrieve_documents(query_embedding, top_k=3):
+            time.sleep(retrieve_ms / 1000)
+            return ["Our return policy allows customers to return products within 30 days of purchase."]
+
+        def generate_answer(query, documents, history=None):
+            time.sleep(generate_ms / 1000)
+            return f"Mocked answer to: {query}"
+
+        rag_model.embedding_batcher.embed_batch = embed_texts
+        rag_model.retrieve_documents = retrieve_documents
+        rag_model.generate_answer = generate_answer
+        self.app = app
+        self.lifespan = None
+
+    async def start(self):
+        # Run the lifespan startup so on_event("startup") handlers execute, like under uvicorn
+        queue = asyncio.Queue()
+        started = asyncio.get_running_loop().create_future()
+        await queue.put({"type": "lifespan.startup"})
+
+        async def send(message):
+            if message["type"].startswith("lifespan.startup") and not started.done():
+                started.set_result(message)
+
+        self.lifespan_queue = queue
+        self.lifespan = asyncio.get_running_loop().create_task(
+            self.app({"type": "lifespan", "asgi": {"version": "3.0"}}, queue.get, send))
+        await started
+
+    async def stop(self):
+        await self.lifespan_queue.put({"type": "lifespan.shutdown"})
+        await asyncio.wait([self.lifespan], timeout=5)
+
+    async def query(self, query):
+        body = json.dumps({"query": query}).encode("utf-8")
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": "/query/", "raw_path": b"/query/", "query_string": b"",
+            "root_path": "", "headers": [(b"content-type", b"application/json"),
+                                         (b"content-length", str(len(body)).encode())],
+            "client": ("127.0.0.1", 0), "server": ("loadtest", 80),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        status, chunks = None, []
+
+        async def receive():
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+
+class HttpTarget:
+    def __init__(self, url, concurrency, timeout=30):
+        self.url = url.rstrip("/") + "/query/"
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        self.executor.shutdown(wait=False)
+
+    def _post(self, query):
+        request = urllib.request.Request(
+            self.url, data=json.dumps({"query": query}).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST")
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    async def query(self, query):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._post, query)
+
+
+# --- Driver --------------------------------------------------------------------------------------
+
+async def run(target, queries, rate, concurrency, duration, max_requests=None, interval=5.0):
+    """
+    Open-loop load: requests start at `rate` per second (Poisson arrivals) as long as fewer than
+    `concurrency` are in flight. Prints one line per interval and returns the overall summary.
+    """
+    await target.start()
+    semaphore = asyncio.Semaphore(concurrency)
+    samples, window = [], []
+    tasks = set()
+    rng = random.Random(1)
+
+    async def one(query):
+        start = time.perf_counter()
+        ok, cache_hit = False, False
+        try:
+            status, body = await target.query(query)
+            ok = status == 200
+            cache_hit = ok and json.loads(body).get("source") == "cache"
+        except Exception:
+            pass
+        finally:
+            semaphore.release()
+        sample = (time.perf_counter() - start, ok, cache_hit)
+        samples.append(sample)
+        window.append(sample)
+
+    print(f"{'t(s)':>6} {'qps':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'errors':>7} {'cache':>7}")
+    started = time.perf_counter()
+    last_report = started
+    next_report = started + interval
+    sent = 0
+    while time.perf_counter() - started < duration and (max_requests is None or sent < max_requests):
+        await asyncio.sleep(rng.expovariate(rate) if rate else 0)
+        await semaphore.acquire()
+        task = asyncio.get_running_loop().create_task(one(queries.next()))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        sent += 1
+
+        now = time.perf_counter()
+        if now >= next_report:
+            # The window spans since the last report, longer than `interval` when sleeps overshoot
+            stats = summarize(window, now - last_report)
+            print(f"{now - started:>6.0f} {stats['qps']:>8.1f} {stats['p50_ms']:>8.1f} {stats['p90_ms']:>8.1f} "
+                  f"{stats['p99_ms']:>8.1f} {stats['error_rate']:>7.1%} {stats['cache_hit_ratio']:>7.1%}")
+            window.clear()
+            last_report = now
+            next_report = now + interval
+
+    if tasks:
+        await asyncio.wait(tasks)
+    elapsed = time.perf_counter() - started
+    await target.stop()
+    return summarize(samples, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the /query/ endpoint")
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", default="http://localhost:8081", help="Base URL for --mode http")
+    parser.add_argument("--log", help="Query log to replay (text or JSON lines); default is a Zipfian mix")
+    parser.add_argument("--distinct", type=int, default=200, help="Distinct queries in the Zipfian mix")
+    parser.add_argument("--zipf-s", type=float, default=1.1, help="Zipf exponent (higher = more skewed)")
+    parser.add_argument("--rate", type=float, default=50, help="Arrival rate in requests/s (0 = as fast as possible)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Max requests in flight")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to generate load")
+    parser.add_argument("--requests", type=int, help="Stop after this many requests")
+    parser.add_argument("--interval", type=float, default=5, help="Seconds between progress lines")
+    parser.add_argument("--mock-latency-ms", default="20,30,400",
+                        help="embed,retrieve,generate latency of the mocked backend (inprocess mode)")
+    parser.add_argument("--json", help="Write the final summary to this file")
+    args = parser.parse_args()
+
+    queries = ReplayQueries(load_queries(args.log)) if args.log else ZipfianQueries(args.distinct, args.zipf_s)
+    if args.mode == "inprocess":
+        embed_ms, retrieve_ms, generate_ms = (float(x) for x in args.mock_latency_ms.split(","))
+        target = InProcessTarget(embed_ms, retrieve_ms, generate_ms)
+    else:
+        target = HttpTarget(args.url, args.concurrency)
+
+    summary = asyncio.run(run(target, queries, args.rate, args.concurrency, args.duration, args.requests, args.interval))
+    print("\nSummary: " + ", ".join(
+        f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in summary.items()))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
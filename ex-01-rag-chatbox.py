@@ -1,68 +1,99 @@
-import boto3
 import json
 import os
+import time
 import numpy as np
 import pinecone
 from pinecone import Pinecone
+from rag_common.answer_table import AnswerTable
+from rag_common.bedrock import create_bedrock_runtime
+from rag_common.canonical import query_keys
+from rag_common.cascade import cascade_generate
+from rag_common.compression import fit_projection
+from rag_common.embeddings import EmbeddingCache, parse_embedding
+from rag_common.faqs import faq_database
+from rag_common.metadata_filter import product_line
+from rag_common.pipeline import Pipeline, Stage
+from rag_common.speculative import Speculation
+from rag_common.snapshot import PeriodicSnapshot, open_snapshot, write_snapshot
+from rag_common.vector_store import MmapVectorIndex, write_index
 
 # Initialize clients
-bedrock_runtime = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+bedrock_runtime = create_bedrock_runtime()
 
 index_name = "ecommerce-index"
 pc = Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
 index_db = pc.Index(index_name)
 
-faq_database = {
-    "What is your return policy?": "Our return policy allows customers to return products within 30 days of purchase. Items must be in their original condition and packaging. To initiate a return, visit our return portal and provide your order number and email address.",
+# Local on-disk FAQ index (see create_faq_index)
+FAQ_INDEX_PATH = os.environ.get('FAQ_INDEX_PATH', 'faq_index.bin')
+# Optional compression of the stored vectors (pick with python -m rag_common.compression)
+FAQ_INDEX_REDUCTION = os.environ.get('FAQ_INDEX_REDUCTION', 'none')  # none, pca or random
+FAQ_INDEX_DIM = int(os.environ.get('FAQ_INDEX_DIM', '0'))
 
-    "How do I track my order?": "You can track your order by using the tracking number provided in the shipment confirmation email. Alternatively, you can log in to your account and go to the 'Order History' section to find the tracking link.",
+# Warm-start snapshot: FAQ embeddings (and the local index) restored with mmap instead of re-embedding
+SNAPSHOT_PATH = os.environ.get('SNAPSHOT_PATH', 'rag_snapshot.bin')
+SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get('SNAPSHOT_INTERVAL_SECONDS', '0'))
+snapshot = open_snapshot(SNAPSHOT_PATH)
+embedding_cache = EmbeddingCache(snapshot.embeddings("titan") if snapshot else None, key=query_keys.canonical)
 
-    "What payment methods do you accept?": "We accept all major credit cards (Visa, MasterCard, American Express), PayPal, and Apple Pay. For corporate accounts, we also offer invoicing options. Please contact support for more information on setting up a corporate account.",
+# Answers precomputed for every FAQ (python -m rag_common.answer_table), served instead of generating
+answer_table = AnswerTable.load()
 
-    "Can I change or cancel my order after it’s been placed?": "Once an order has been placed, we are unable to modify it directly. However, you can cancel your order within the first hour of placing it through the 'My Orders' section of your account. After that, you’ll need to wait for the order to be delivered and then initiate a return.",
-
-    "What are your shipping options?": "We offer standard, expedited, and overnight shipping. Standard shipping takes 5-7 business days, while expedited shipping takes 2-3 business days. Overnight shipping ensures delivery by the next business day. International shipping options are also available, with delivery times varying by destination.",
-
-    "How do I reset my account password?": "To reset your password, go to the login page and click on 'Forgot Password'. You will receive an email with instructions to reset your password. If you don't see the email, check your spam folder or contact customer support for help.",
-
-    "Do you ship internationally?": "Yes, we ship to select international destinations. International shipping costs and delivery times vary depending on the destination. You can calculate the shipping costs at checkout after providing your address.",
-
-    "What do I do if I receive a damaged or defective product?": "If you receive a damaged or defective product, please contact our customer support within 48 hours of receiving the item. We will provide instructions on how to return the product or arrange for a replacement. Make sure to include photos of the damaged item and packaging for faster processing.",
-
-    "How do I contact customer support?": "You can contact our customer support via email at support@ourcompany.com, or by calling our support line at 1-800-123-4567 during business hours (9 AM to 5 PM, Monday to Friday). We also offer live chat support on our website.",
-
-    "Can I use multiple discount codes on a single order?": "No, our system only allows one discount code per order. However, you can apply store credit or a gift card in addition to a discount code at checkout.",
-
-    "How do I update my shipping address after placing an order?": "If your order has not yet been processed, you can update your shipping address by logging into your account and navigating to the 'My Orders' section. If the order has already been processed or shipped, you will need to contact customer support to discuss possible options.",
-
-    "What should I do if I never received my order?": "If your order has not arrived by the estimated delivery date, first check the tracking information. If the tracking shows the item was delivered but you didn't receive it, contact customer support so we can investigate and resolve the issue.",
-
-    "Do you offer gift wrapping?": "Yes, we offer gift wrapping for an additional fee. You can select the gift wrapping option at checkout, and you can also include a personalized message with the gift.",
-
-    "Can I return a product after 30 days?": "Unfortunately, returns are only accepted within 30 days of the purchase date. If you have extenuating circumstances, please contact customer support to discuss possible exceptions on a case-by-case basis.",
-
-    "What are your business hours?": "Our customer support team is available from 9 AM to 5 PM, Monday through Friday, excluding holidays. Our website is available for orders 24/7.",
-
-    "How do I subscribe to your newsletter?": "To subscribe to our newsletter, scroll to the bottom of our homepage and enter your email in the subscription box. You’ll receive exclusive offers, product updates, and company news directly to your inbox.",
-
-    "What is your warranty policy?": "We offer a one-year warranty on all our products. The warranty covers manufacturing defects but does not cover damage caused by misuse, accidents, or normal wear and tear. To file a warranty claim, contact our customer support team with your order details and a description of the issue.",
-
-    "How can I become a reseller of your products?": "We welcome reseller partnerships! If you're interested in becoming a reseller, please contact our sales team at sales@ourcompany.com with details about your business, and we’ll get back to you with more information.",
-
-    "Do you offer student discounts?": "Yes, we offer a 10% discount for students. To get the discount, sign up with your valid student email, and we will verify your status. After verification, you will receive a unique discount code to use at checkout.",
-
-    "Can I expedite the shipping of my order?": "Yes, you can select expedited or overnight shipping at checkout. Expedited shipping typically takes 2-3 business days, while overnight shipping ensures delivery by the next business day. Please note that expedited shipping costs more than standard shipping."
-}
+# FAQ wording is the vocabulary for QUERY_SPELLING_CORRECTION
+query_keys.add_vocabulary(text for item in faq_database.items() for text in item)
 
 def get_answer(question):
     return faq_database.get(question, "I'm sorry, I don't have an answer for that question.")
 
+def embed_cached(text):
+    return embedding_cache.embed(text, get_embedding_model)
+
 def create_faq_vector():
     faq_vector_db = {}
     for question in faq_database.keys():
-        faq_vector_db[question] = get_embedding_model(question)
+        faq_vector_db[question] = embed_cached(question)
     return faq_vector_db
 
+def create_faq_index(path=FAQ_INDEX_PATH, dtype="int8", reduction=FAQ_INDEX_REDUCTION, dim=FAQ_INDEX_DIM):
+    """
+    Embeds every FAQ once and writes an on-disk index (int8 or float16 vectors + float rescoring block).
+    With a reduction ("pca" or "random") and dim the vectors are stored in `dim` dimensions.
+    The file is opened with mmap, so several processes share one page-cached copy.
+    """
+    questions = list(faq_database.keys())
+    vectors = [embed_cached(question) for question in questions]
+    updated_at = int(time.time())
+    metadata = [{"question": question, "answer": faq_database[question], "category": "ecommerce", "language": "en",
+                 "product_line": product_line(question), "updated_at": updated_at}
+                for question in questions]
+    projection = fit_projection(reduction, vectors, dim)
+    write_index(path, questions, vectors, metadata, dtype=dtype, projection=projection)
+    return MmapVectorIndex(path)
+
+def load_faq_index(path=FAQ_INDEX_PATH):
+    # Reuse the index written by a previous run (or kept in the snapshot) instead of re-embedding
+    if os.path.exists(path):
+        return MmapVectorIndex(path)
+    if snapshot is not None and "faq_index" in snapshot.sections:
+        return snapshot.vector_index("faq_index")
+    return create_faq_index(path)
+
+def snapshot_state():
+    """
+    Everything a new process needs to start warm, see save_snapshot.
+    """
+    return {
+        "embeddings": {"titan": embedding_cache.items()},
+        "vector_indexes": {"faq_index": FAQ_INDEX_PATH} if os.path.exists(FAQ_INDEX_PATH) else None,
+    }
+
+def save_snapshot(path=SNAPSHOT_PATH):
+    write_snapshot(path, **snapshot_state())
+
+def start_snapshots(path=SNAPSHOT_PATH, interval=SNAPSHOT_INTERVAL_SECONDS):
+    # Written every `interval` seconds (0 = never) and at exit
+    return PeriodicSnapshot(path, snapshot_state, interval).start()
+
 def cosine_similarity(vec1, vec2):
     return np.dot(vec1, vec2) / (np.linalg.norm(vec1) * np.linalg.norm(vec2))
 
@@ -81,6 +112,17 @@ def find_most_similar(query_embedding, faq_vector_db):
     
     return best_batch
 
+def find_best_match(query_embedding, vector_database):
+    """
+    Returns (question, similarity) from either a create_faq_vector dict or an on-disk FAQ index.
+    """
+    if isinstance(vector_database, MmapVectorIndex):
+        match = vector_database.search(query_embedding, top_k=1)[0]
+        return match['id'], match['score']
+
+    best_match = find_most_similar(query_embedding, vector_database)
+    return best_match, cosine_similarity(query_embedding, vector_database[best_match])
+
 def simple_chatbot(query):
     body = json.dumps({
         "anthropic_version": "bedrock-2023-05-31",
@@ -105,30 +147,21 @@ def rag_chatbot(query, vector_database, faq_database):
     query_embedding = get_embedding_model(query)
 
     # Step 2: Find the most similar FAQ using cosine similarity
-    best_match = find_most_similar(query_embedding, vector_database)
+    best_match, best_score = find_best_match(query_embedding, vector_database)
     best_answer = get_answer(best_match)
+
+    precomputed = answer_table.lookup("ecommerce", best_match, best_answer, best_score)
+    if precomputed is not None:
+        return precomputed
     
     system_prompt = f"""You are a helpful E-Commerce assistant helping customers with their general questions regarding policies and procedures when buying in our store.
         Our store sells e-books and courses for IT professionals.
         Only answer based on the context!
         Context: {best_answer}"""
 
-    # Step 3: Use Bedrock API to generate a response with context
-    response = bedrock_runtime.invoke_model(
-        modelId='anthropic.claude-3-sonnet-20240229-v1:0',
-        body=json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 200,
-            "system": system_prompt,
-            "messages": [{"role": "user", "content": query}],
-            "temperature": 0.5
-        }),
-        contentType='application/json',
-        accept='application/json'
-    )
-    
-    response_body = json.loads(response['body'].read())
-    return response_body['content'][0]['text']
+    # Step 3: Generate a response with context (FAQ answer, fast model or Sonnet depending on the score)
+    return cascade_generate(bedrock_runtime, query, best_answer, best_score, system_prompt,
+                            direct_answer=best_answer, max_tokens=200, temperature=0.5)
 
 def get_system_prompt(context):
     return f"""
@@ -139,15 +172,26 @@ def get_system_prompt(context):
 
     Context: {context}"""
 
-def retrieve_faq(query_embedding, top_k=1):
+def retrieve_faq(query_embedding, top_k=1, filter=None):
     response = index_db.query(
-        vector=query_embedding,
+        vector=query_embedding.tolist(),
         top_k=top_k,
         include_metadata=True,
-        namespace="ns1"
+        namespace="ns1",
+        filter=filter
     )
     return response.matches[0].metadata['answer']
 
+def retrieve_best_match(query_embedding, filter=None):
+    response = index_db.query(
+        vector=query_embedding.tolist(),
+        top_k=1,
+        include_metadata=True,
+        namespace="ns1",
+        filter=filter
+    )
+    return response.matches[0]
+
 def get_embedding_model(prompt, model="amazon.titan-embed-text-v1"):
     body = json.dumps({
         "inputText": prompt
@@ -160,37 +204,46 @@ def get_embedding_model(prompt, model="amazon.titan-embed-text-v1"):
         accept='application/json'
     )
     
-    response_body = json.loads(response['body'].read())
-    return response_body['embedding']
+    return parse_embedding(response['body'].read())
 
-def rag_chatbot_with_pinecone(query):
-    # Step 1: Encode the query
-    query_embedding = get_embedding_model(query)
+def generate_from_match(query, match):
+    best_match = match.metadata['answer']
 
-    # Step 2: Find the most similar FAQ from Pinecone
-    best_match = retrieve_faq(query_embedding)
-    
-    # Step 3: Augment the query with context
+    # Confident match on an FAQ whose answer has not changed since the table was built
+    precomputed = answer_table.lookup("ecommerce", match.metadata['question'], best_match, match.score)
+    if precomputed is not None:
+        return precomputed
+
+    # Augment the query with context
     augmented_prompt = get_system_prompt(best_match)
 
-    messages = [{"role": "user","content": query}]
+    # Generate a response with context (FAQ answer, fast model or Sonnet depending on the score)
+    return cascade_generate(bedrock_runtime, query, best_match, match.score, augmented_prompt,
+                            direct_answer=best_match)
 
-    # Step 4: Use Bedrock API to generate a response with context
-    response = bedrock_runtime.invoke_model(
-        modelId='anthropic.claude-3-sonnet-20240229-v1:0',
-        body=json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 250,
-            "system": augmented_prompt,
-            "messages": messages,
-            "temperature": 0.3
-        }),
-        contentType='application/json',
-        accept='application/json'
-    )
-    
-    response_body = json.loads(response['body'].read())
-    return response_body['content'][0]['text']
+# Encode the query -> find the most similar FAQ in Pinecone -> generate. Generation is optional:
+# with too little of the request deadline left the FAQ answer is returned as is
+rag_pipeline = Pipeline([
+    Stage("embed", get_embedding_model, inputs=["query"], cache=True,
+          cache_key=query_keys.cache_key("embed")),
+    Stage("retrieve", retrieve_best_match, inputs=["embed"]),
+    Stage("generate", generate_from_match, inputs=["query", "retrieve"], optional=True,
+          fallback=lambda query, match: match.metadata['answer']),
+], name="direct")
+
+# SPECULATIVE_GENERATION=true: a repeated query starts generating from the match it retrieved
+# last time while embed + retrieve run, the answer is kept if the top match is the same
+speculation = Speculation("direct", top_id=lambda match: match.id)
+
+def rag_chatbot_with_pinecone(query):
+    # The exact wording of an FAQ (or a known paraphrase) skips embedding and retrieval too
+    precomputed = answer_table.lookup_alias(query, faqs={"ecommerce": faq_database})
+    if precomputed is not None:
+        return precomputed
+    if speculation.enabled:
+        return speculation.run(query, lambda q: rag_pipeline.run(query=q, output="retrieve"),
+                               rag_pipeline.stages["generate"])
+    return rag_pipeline.run(query=query)
 
 def main():
     print(f"Chatbot with RAG")
@@ -207,6 +260,11 @@ def main():
 
         # Test rag chatbot with Pinecone
         #faq_vector_db = create_faq_vector()
+
+        # Test rag chatbot with the local on-disk index (warm start from SNAPSHOT_PATH, saved at exit)
+        #start_snapshots()
+        #faq_index = load_faq_index()
+        #print(f"RAG (local): {rag_chatbot('do you have discount for students?', faq_index, faq_database)}")
         response = rag_chatbot_with_pinecone("do you have discount for students?")
         print(f"RAG: {response}")
 
@@ -1,11 +1,16 @@
-import boto3
 import json
 import os
 import pinecone
 from pinecone import Pinecone
+from rag_common.bedrock import create_bedrock_runtime
+from rag_common.canonical import query_keys
+from rag_common.cascade import cascade_generate
+from rag_common.embeddings import parse_embedding
+from rag_common.output import parse_json
+from rag_common.pipeline import Pipeline, Stage
 
 # Initialize clients
-bedrock_runtime = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+bedrock_runtime = create_bedrock_runtime()
 
 index_name = "ecommerce-index"
 pc = Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
@@ -21,14 +26,15 @@ def get_system_prompt(context):
 
     Context: {context}"""
 
-def retrieve_faq(query_embedding, top_k=1):
+def retrieve_best_match(query_embedding, filter=None):
     response = index_db.query(
-        vector=query_embedding,
-        top_k=top_k,
+        vector=query_embedding.tolist(),
+        top_k=1,
         include_metadata=True,
-        namespace="ns1"
+        namespace="ns1",
+        filter=filter
     )
-    return response.matches[0].metadata['answer']
+    return response.matches[0]
 
 def get_embedding_model(prompt, model="amazon.titan-embed-text-v1"):
     body = json.dumps({
@@ -42,8 +48,7 @@ def get_embedding_model(prompt, model="amazon.titan-embed-text-v1"):
         accept='application/json'
     )
     
-    response_body = json.loads(response['body'].read())
-    return response_body['embedding']
+    return parse_embedding(response['body'].read())
 
 def combine_documents(retrieved_docs):
     return "\n\n".join(retrieved_docs)
@@ -80,58 +85,37 @@ def candidates_generation(query, n_candidates=5):
     #print(f"DEBUG - Full response body: {response_body}")
     return response_body['choices'][0]['message']['content']
 
-def clean_response(response_text):
-    # Clean the response - remove reasoning tags and markdown code blocks
-    if "<reasoning>" in response_text:
-        response_text = response_text.split("</reasoning>")[1].strip()
-    
-    if "```json" in response_text:
-        response_text = response_text.split("```json")[1].split("```")[0].strip()
-    elif "```" in response_text:
-        response_text = response_text.split("```")[1].split("```")[0].strip()
-    
-    return response_text
-
-def multi_query_rag_chatbot(query):
+def generate_candidates(query, n_candidates=5):
+    candidates_json = candidates_generation(query, n_candidates=n_candidates)
+    return list(parse_json(candidates_json).values())
 
-    # Step 1: Get multi-representation
-    candidates_json = candidates_generation(query, n_candidates=5)
-    candidates_json = clean_response(candidates_json)
-    candidates = json.loads(candidates_json)
+def generate_from_matches(query, matches):
+    # Combine docs
+    context = combine_documents([match.metadata['answer'] for match in matches])
 
-    # Step 2: Retrieve the most relevant FAQ from Pinecone (for each candidate)
-    relevant_docs = []
-    for key, candidate in candidates.items():
-      candidate_embedding = get_embedding_model(candidate)
-      best_match = retrieve_faq(candidate_embedding)
-      relevant_docs.append(best_match)
-
-    # Step 3: Combine docs
-    context = combine_documents(relevant_docs)
-
-    # Step 4: Augment the query with context
+    # Augment the query with context
     augmented_prompt = get_system_prompt(context)
 
-    messages = [{"role": "user", "content": [
-        { "type": "text", "text": f"{query}" }
-        ]}]
+    # Generate a response (FAQ answer, fast model or Sonnet depending on the best score)
+    top_match = max(matches, key=lambda match: match.score)
+    return cascade_generate(bedrock_runtime, query, context, top_match.score, augmented_prompt,
+                            direct_answer=top_match.metadata['answer'])
+
+# Multi-representation -> embed and retrieve the most relevant FAQ for each candidate (in parallel)
+# -> generate. If candidate generation fails (or is skipped to meet the request deadline), the
+# original query is used as the only candidate; a skipped generation returns the best FAQ answer.
+multi_query_pipeline = Pipeline([
+    Stage("candidates", generate_candidates, inputs=["query"], cache=True, optional=True,
+          cache_key=query_keys.cache_key("candidates"), fallback=lambda query: [query]),
+    Stage("embed", get_embedding_model, inputs=["candidates"], each=True, cache=True,
+          cache_key=query_keys.cache_key("embed")),
+    Stage("retrieve", retrieve_best_match, inputs=["embed"], each=True),
+    Stage("generate", generate_from_matches, inputs=["query", "retrieve"], optional=True,
+          fallback=lambda query, matches: max(matches, key=lambda match: match.score).metadata['answer']),
+], name="multi_query")
 
-    # Step 4: Use Sonnet to generate a response
-    response = bedrock_runtime.invoke_model(
-        modelId='anthropic.claude-3-sonnet-20240229-v1:0',
-        body=json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 250,
-            "system": augmented_prompt,
-            "messages": messages,
-            "temperature": 0.3
-        }),
-        contentType='application/json',
-        accept='application/json'
-    )
-
-    response_body = json.loads(response['body'].read())
-    return response_body['content'][0]['text']
+def multi_query_rag_chatbot(query):
+    return multi_query_pipeline.run(query=query)
 
 
 """ 
@@ -1,11 +1,16 @@
-import boto3
 import json
 import os
 import pinecone
 from pinecone import Pinecone
+from rag_common.bedrock import create_bedrock_runtime
+from rag_common.canonical import query_keys
+from rag_common.embeddings import parse_embedding
+from rag_common.output import clean_response, parse_json
+from rag_common.pipeline import Pipeline, Stage
+from rag_common.rerank import rerank
 
 # Initialize clients
-bedrock_runtime = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+bedrock_runtime = create_bedrock_runtime()
 
 index_name = "ecommerce-index"
 pc = Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
@@ -21,15 +26,6 @@ def get_system_prompt(context):
 
     Context: {context}"""
 
-def retrieve_faq(query_embedding, top_k=1):
-    response = index_db.query(
-        vector=query_embedding,
-        top_k=top_k,
-        include_metadata=True,
-        namespace="ns1"
-    )
-    return response.matches[0].metadata['answer']
-
 def get_embedding_model(prompt, model="amazon.titan-embed-text-v1"):
     body = json.dumps({
         "inputText": prompt
@@ -42,8 +38,7 @@ def get_embedding_model(prompt, model="amazon.titan-embed-text-v1"):
         accept='application/json'
     )
     
-    response_body = json.loads(response['body'].read())
-    return response_body['embedding']
+    return parse_embedding(response['body'].read())
 
 def combine_documents(retrieved_docs):
     return "\n\n".join(retrieved_docs)
@@ -81,12 +76,13 @@ def candidates_generation(query, n_candidates=5):
     #print(f"DEBUG - Full response body: {response_body}")
     return response_body['choices'][0]['message']['content']
 
-def retrieve_faq_top_n(query_embedding, top_k=5):
+def retrieve_faq_top_n(query_embedding, top_k=5, filter=None):
     response = index_db.query(
-        vector=query_embedding,
+        vector=query_embedding.tolist(),
         top_k=top_k,
         include_metadata=True,
-        namespace="ns1"
+        namespace="ns1",
+        filter=filter
     )
 
     results = []
@@ -108,45 +104,15 @@ def reciprocal_rank_fusion(results, k=60, top_n=5):
     top_n_docs = [doc for doc, score in sorted(ranked_docs.items(), key=lambda x: x[1], reverse=True)[:top_n]]
     return top_n_docs
 
-def clean_response(response_text):
-    # Clean the response - remove reasoning tags and markdown code blocks
-    if "<reasoning>" in response_text:
-        response_text = response_text.split("</reasoning>")[1].strip()
-    
-    if "```json" in response_text:
-        response_text = response_text.split("```json")[1].split("```")[0].strip()
-    elif "```" in response_text:
-        response_text = response_text.split("```")[1].split("```")[0].strip()
-    
-    return response_text
-
-def fusion_rag_chatbot(query):
-
-    # Step 1: Get multi-representation
-    candidates_json = candidates_generation(query, n_candidates=5)
-    candidates_json = clean_response(candidates_json)
-    candidates = json.loads(candidates_json)
-
-    # Step 2: Retrieve the most relevant FAQ from Pinecone (for each candidate)
-    relevant_docs = []
-    for key, candidate in candidates.items():
-      candidate_embedding = get_embedding_model(candidate)
-      best_matches = retrieve_faq_top_n(candidate_embedding, top_k=5)
-      relevant_docs.append(best_matches)
-
-    # Step 3: Ranking - Run the reciprotial fusion ranking algorithm to re-rank all results
-    ranked_docs = reciprocal_rank_fusion(relevant_docs, k=60, top_n=4)
-
-    # Step 4: Combine docs
-    context = combine_documents(ranked_docs)
-
-    # Step 5: Augment the query with context
-    augmented_prompt = get_system_prompt(context)
+def generate_candidates(query, n_candidates=5):
+    candidates_json = candidates_generation(query, n_candidates=n_candidates)
+    return list(parse_json(candidates_json).values())
 
+def generate_answer(query, augmented_prompt):
     messages = [{"role": "system","content": augmented_prompt},
                 {"role": "user","content": query}]
 
-    # Step 6: Use OpenAI to generate a response
+    # Use OpenAI to generate a response
     response = bedrock_runtime.invoke_model(
         modelId='openai.gpt-oss-20b-1:0',
         body=json.dumps({
@@ -160,12 +126,30 @@ def fusion_rag_chatbot(query):
 
     response_body = json.loads(response['body'].read())
     answer = response_body['choices'][0]['message']['content']
-    
-    # Remove reasoning tags if present
-    if "<reasoning>" in answer:
-        answer = answer.split("</reasoning>")[1].strip()
-    
-    return answer
+
+    # Remove reasoning tags and code fences
+    return clean_response(answer)
+
+# Multi-representation -> top 5 FAQs per candidate (in parallel) -> reciprocal rank fusion (top 10)
+# -> re-rank against the original query (best 4) -> pack the context -> generate. Under a tight
+# request deadline the candidates (original query only), the re-ranking (fused order) and the
+# generation (best fused FAQ answer) are skipped.
+fusion_pipeline = Pipeline([
+    Stage("candidates", generate_candidates, inputs=["query"], cache=True, optional=True,
+          cache_key=query_keys.cache_key("candidates"), fallback=lambda query: [query]),
+    Stage("embed", get_embedding_model, inputs=["candidates"], each=True, cache=True,
+          cache_key=query_keys.cache_key("embed")),
+    Stage("retrieve", lambda embedding: retrieve_faq_top_n(embedding, top_k=5), inputs=["embed"], each=True),
+    Stage("fuse", lambda results: reciprocal_rank_fusion(results, k=60, top_n=10), inputs=["retrieve"]),
+    Stage("rerank", lambda query, docs: rerank(query, docs, top_n=4), inputs=["query", "fuse"], optional=True,
+          fallback=lambda query, docs: docs[:4]),
+    Stage("pack", lambda docs: get_system_prompt(combine_documents(docs)), inputs=["rerank"]),
+    Stage("generate", lambda query, prompt, docs: generate_answer(query, prompt), inputs=["query", "pack", "rerank"],
+          optional=True, fallback=lambda query, prompt, docs: docs[0] if docs else "I don't know."),
+], name="fusion")
+
+def fusion_rag_chatbot(query):
+    return fusion_pipeline.run(query=query)
 
 """ 
 Fusion RAG (Reciprocal Rank Fusion)
@@ -1,11 +1,15 @@
-import boto3
 import json
 import os
 import pinecone
 from pinecone import Pinecone
+from rag_common.bedrock import create_bedrock_runtime
+from rag_common.canonical import query_keys
+from rag_common.embeddings import parse_embedding
+from rag_common.output import clean_response
+from rag_common.pipeline import Pipeline, Stage
 
 # Initialize clients
-bedrock_runtime = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+bedrock_runtime = create_bedrock_runtime()
 
 index_name = "ecommerce-index"
 pc = Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
@@ -21,12 +25,13 @@ def get_system_prompt(context):
 
     Context: {context}"""
 
-def retrieve_faq(query_embedding, top_k=1):
+def retrieve_faq(query_embedding, top_k=1, filter=None):
     response = index_db.query(
-        vector=query_embedding,
+        vector=query_embedding.tolist(),
         top_k=top_k,
         include_metadata=True,
-        namespace="ns1"
+        namespace="ns1",
+        filter=filter
     )
     return response.matches[0].metadata['answer']
 
@@ -42,8 +47,7 @@ def get_embedding_model(prompt, model="amazon.titan-embed-text-v1"):
         accept='application/json'
     )
     
-    response_body = json.loads(response['body'].read())
-    return response_body['embedding']
+    return parse_embedding(response['body'].read())
 
 def generate_hypothetical_doc(query):
 
@@ -64,26 +68,14 @@ def generate_hypothetical_doc(query):
     )
 
     response_body = json.loads(response['body'].read())
-    return response_body['choices'][0]['message']['content']
-
-def hypo_chatbot(query):
-
-    # Step 1: Get multi-representation
-    hypo_candidate = generate_hypothetical_doc(query)
-
-    # Step 2: Retrieve the most relevant FAQ from Pinecone (for each candidate)
-    candidate_embedding = get_embedding_model(hypo_candidate)
-
-    # Step 3: Get real answer
-    best_match = retrieve_faq(candidate_embedding)
-
-    # Step 4: Augment the query with context
-    augmented_prompt = get_system_prompt(best_match)
+    # Only the document itself is embedded, not the model's reasoning about it
+    return clean_response(response_body['choices'][0]['message']['content'])
 
+def generate_answer(query, augmented_prompt):
     messages = [{"role": "system","content": augmented_prompt},
                 {"role": "user","content": query}]
 
-    # Step 6: Use OpenAI to generate a response
+    # Use OpenAI to generate a response
     response = bedrock_runtime.invoke_model(
         modelId='openai.gpt-oss-20b-1:0',
         body=json.dumps({
@@ -97,12 +89,35 @@ def hypo_chatbot(query):
 
     response_body = json.loads(response['body'].read())
     answer = response_body['choices'][0]['message']['content']
-    
-    # Remove reasoning tags if present
-    if "<reasoning>" in answer:
-        answer = answer.split("</reasoning>")[1].strip()
-    
-    return answer
+
+    # Remove reasoning tags and code fences
+    return clean_response(answer)
+
+def pack_context(hypo_match, raw_match):
+    # The HyDE match first, the raw query match only if it found a different FAQ
+    docs = [hypo_match] if hypo_match == raw_match else [hypo_match, raw_match]
+    return get_system_prompt("\n\n".join(docs))
+
+# Two branches run concurrently: hypothetical document -> embed -> retrieve, and the raw query
+# -> embed -> retrieve (it costs no extra latency and catches queries HyDE drifts away from).
+# Under a tight request deadline the query stands in for the hypothetical document and the
+# retrieved FAQ answer for the generated one.
+hyde_pipeline = Pipeline([
+    Stage("hypothetical_doc", generate_hypothetical_doc, inputs=["query"], cache=True, optional=True,
+          cache_key=query_keys.cache_key("hypothetical_doc"), fallback=lambda query: query),
+    Stage("hypo_embed", get_embedding_model, inputs=["hypothetical_doc"], cache=True,
+          cache_key=query_keys.cache_key("hypo_embed")),
+    Stage("hypo_retrieve", retrieve_faq, inputs=["hypo_embed"]),
+    Stage("raw_embed", get_embedding_model, inputs=["query"], cache=True,
+          cache_key=query_keys.cache_key("raw_embed")),
+    Stage("raw_retrieve", retrieve_faq, inputs=["raw_embed"]),
+    Stage("pack", pack_context, inputs=["hypo_retrieve", "raw_retrieve"]),
+    Stage("generate", lambda query, prompt, match: generate_answer(query, prompt),
+          inputs=["query", "pack", "hypo_retrieve"], optional=True, fallback=lambda query, prompt, match: match),
+], name="hyde")
+
+def hypo_chatbot(query):
+    return hyde_pipeline.run(query=query)
 
 """
 Hypothetical Document Embeddings (HyDE) RAG
@@ -1,27 +1,11 @@
-import boto3
 import json
-import os
+from rag_common.bedrock import create_bedrock_runtime
+from rag_common.canonical import query_keys
+from rag_common.output import clean_response, clean_stream, stream_chat_text
+from rag_common.pipeline import Pipeline, Stage
 
 # Initialize clients
-bedrock_runtime = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
-
-def clean_response(response_text):
-    """Remove reasoning tags from model responses"""
-    original = response_text
-    if "<reasoning>" in response_text and "</reasoning>" in response_text:
-        # Extract content after reasoning tags
-        parts = response_text.split("</reasoning>")
-        if len(parts) > 1 and parts[1].strip():
-            response_text = parts[1].strip()
-        else:
-            # If nothing after reasoning, extract content before reasoning tag
-            response_text = response_text.split("<reasoning>")[0].strip()
-    
-    # If cleaning resulted in empty string, return original
-    if not response_text.strip():
-        return original.strip()
-    
-    return response_text
+bedrock_runtime = create_bedrock_runtime()
 
 # Step 1: Basic Intent Classifier
 def classify_intent(query):
@@ -72,17 +56,7 @@ def generate_prompt(query, intent):
     else:
         return f"Answer the question: {query}"
     
-# Step 3: RAG response using Prompt Routing
-def prompt_routing_rag(query):
-    # Classify the intent
-    intent = classify_intent(query)
-    print(f"Detected Intent: {intent}")
-
-    # Generate appropriate prompt
-    prompt = generate_prompt(query, intent)
-    print(f"Generated Prompt: {prompt}")
-
-    # Generate response based on prompt
+def generate_response(prompt):
     response = bedrock_runtime.invoke_model(
         modelId='openai.gpt-oss-20b-1:0',
         body=json.dumps({
@@ -97,6 +71,34 @@ def prompt_routing_rag(query):
     answer = response_body['choices'][0]['message']['content']
     return clean_response(answer)
 
+# Step 3: RAG response using Prompt Routing
+# Classify the intent -> generate the appropriate prompt -> generate the response. Under a tight
+# request deadline the classification is skipped and the generic prompt used.
+prompt_routing_pipeline = Pipeline([
+    Stage("classify", classify_intent, inputs=["query"], cache=True, optional=True,
+          cache_key=query_keys.cache_key("classify"), fallback=lambda query: "other"),
+    Stage("prompt", generate_prompt, inputs=["query", "classify"]),
+    Stage("generate", generate_response, inputs=["prompt"]),
+], name="prompt_routing")
+
+def prompt_routing_rag(query):
+    values, _ = prompt_routing_pipeline.execute({"query": query})
+    print(f"Detected Intent: {values['classify']}")
+    print(f"Generated Prompt: {values['prompt']}")
+    return values['generate']
+
+def stream_prompt_routing_rag(query):
+    """
+    Same as prompt_routing_rag, but yields the answer as it is generated: the reasoning
+    section is dropped on the fly and the text after it is passed through immediately.
+    """
+    prompt = prompt_routing_pipeline.run(query=query, output="prompt")
+    body = json.dumps({
+        "messages": [{"role": "user", "content": prompt}],
+        "max_tokens": 250
+    })
+    return clean_stream(stream_chat_text(bedrock_runtime, 'openai.gpt-oss-20b-1:0', body))
+
 """
 Flow Routing
 
@@ -115,6 +117,10 @@ def main():
         #query = "what is quantum entanglement?"
         query = "how to change a bike tire?"
         response = prompt_routing_rag(query)
+
+        # Stream the answer instead
+        #for text in stream_prompt_routing_rag(query):
+        #    print(text, end="", flush=True)
         print(f"User: {query}")
         print("------------------------------------------------------------------------")
         print(f"Bot: {response}")
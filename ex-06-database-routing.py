@@ -1,10 +1,20 @@
-import boto3
 import json
 import os
 from pinecone import Pinecone
+from rag_common.answer_table import AnswerTable
+from rag_common.bedrock import create_bedrock_runtime
+from rag_common.canonical import query_keys
+from rag_common.cascade import cascade_generate
+from rag_common.embeddings import parse_embedding
+from rag_common.faqs import finance_faq, product_faq, tech_faq
+from rag_common.output import clean_response
+from rag_common.pipeline import Pipeline, Stage
+from rag_common.rerank import get_reranker
+from rag_common.shards import ShardedVectorStore
+from rag_common.speculative import Speculation
 
 # Initialize clients
-bedrock_runtime = boto3.client('bedrock-runtime', region_name=os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+bedrock_runtime = create_bedrock_runtime()
 
 pc = Pinecone(api_key=os.environ.get('PINECONE_API_KEY'))
 
@@ -16,6 +26,23 @@ product_db = pc.Index(product_name)
 tech_db = pc.Index(tech_name)
 finance_db = pc.Index(finance_name)
 
+# With SHARED_INDEX_NAME set (see ex-00), one index serves every route through a category filter
+shared_index_name = os.environ.get('SHARED_INDEX_NAME')
+shared_db = pc.Index(shared_index_name) if shared_index_name else None
+
+# With LOCAL_SHARDS_DIR set (python -m rag_common.shards build), every route is a local shard
+# searched in its own worker process instead of a Pinecone index
+local_shards_dir = os.environ.get('LOCAL_SHARDS_DIR')
+local_store = ShardedVectorStore.from_dir(local_shards_dir) if local_shards_dir else None
+
+# Answers precomputed for every FAQ (python -m rag_common.answer_table), one namespace per route
+answer_table = AnswerTable.load()
+ROUTES = ('product', 'finance', 'tech')
+
+# The FAQ sets ex-00 populates the route indexes with: an answer served by its question alone
+# (before retrieval) must have been generated from the current FAQ answer
+route_faqs = {"product": product_faq, "finance": finance_faq, "tech": tech_faq}
+
 system_prompt = {
                     "role": "system",
                     "content": f"""
@@ -27,24 +54,6 @@ system_prompt = {
                     """,
                 }
 
-def clean_response(response_text):
-    """Remove reasoning tags from model responses"""
-    # Remove reasoning tags (both complete and incomplete)
-    if "<reasoning>" in response_text:
-        if "</reasoning>" in response_text:
-            # Complete reasoning tags - get content after
-            parts = response_text.split("</reasoning>")
-            if len(parts) > 1 and parts[1].strip():
-                response_text = parts[1].strip()
-            else:
-                # If nothing after, get content before
-                response_text = response_text.split("<reasoning>")[0].strip()
-        else:
-            # Incomplete reasoning tag - remove it and everything after
-            response_text = response_text.split("<reasoning>")[0].strip()
-    
-    return response_text.strip() if response_text.strip() else "other"
-
 # Step 1: Basic Intent Classifier
 def classify_intent_db_route(query):
     system_msg = """You are a classification assistant. Classify the user's question into exactly ONE of these categories:
@@ -73,10 +82,15 @@ Respond with ONLY the category name, nothing else."""
     )
 
     response_body = json.loads(response['body'].read())
-    print
-    return response_body['content'][0]['text']
+    # Reasoning blocks, code fences, case and stray whitespace must not change the route
+    return clean_response(response_body['content'][0]['text'], default="other").strip().lower()
 
 # Step 2: Prompt Selection Based on Intent
+def get_route_filter(intent):
+    if intent in ROUTES:
+        return {"category": {"$eq": intent}}
+    return None
+
 def get_index(intent):
     if intent == 'product':
         return product_db
@@ -96,60 +110,114 @@ def get_embedding_model(prompt, model="amazon.titan-embed-text-v1"):
         contentType='application/json',
         accept='application/json'
     )
-    response_body = json.loads(response['body'].read())
-    return response_body['embedding']
+    return parse_embedding(response['body'].read())
 
 # Step 3: Enhanced database routing RAG function
-def advanced_database_routing_rag(query):
+def query_routed_index(intent, query_embedding):
     # Route to the correct index
-    intent = classify_intent_db_route(query)
-    index = get_index(intent)
+    if local_store is not None:
+        print(f"DEBUG - Routing to local shard for intent: {intent}")
+        if intent not in local_store.shards:
+            return None
+        return local_store.search(query_embedding, top_k=8, shards=[intent])
+
+    route_filter = None
+    if shared_db is not None:
+        route_filter = get_route_filter(intent)
+        index = shared_db if route_filter else None
+    else:
+        index = get_index(intent)
     print(f"DEBUG - Routing to index for intent: {intent}")
     if index:
-        # Generate embedding
-        query_embedding = get_embedding_model(query)
-
-        # Retrieve documents from the correct index
+        # Retrieve documents from the correct index (or the matching category of the shared one)
         response = index.query(
-            vector=query_embedding,
-            top_k=3,
+            vector=query_embedding.tolist(),
+            top_k=8,
             include_metadata=True,
-            namespace="ns1")
-
-        return "\n\n".join([match['metadata']['answer'] for match in response['matches']])
+            namespace="ns1",
+            filter=route_filter)
+        return response['matches']
     else:
         return None
 
-def prompt_builder(system_message, context):
-  return system_message['content'].format(context)
-
-# Step 3: Answer question
-def routing_rag(query):
-
-    context = advanced_database_routing_rag(query)
-
-    if context is None:
+def rerank_matches(query, matches):
+    if matches is None:
+        return None
+    # Re-rank the wider candidate set and keep the best 3
+    reranker = get_reranker()
+    if reranker is not None:
+        order = reranker.rank(query, [match['metadata']['answer'] for match in matches])
+        matches = [matches[i] for i in order]
+    return matches[:3]
+
+def generate_from_matches(query, matches, intent=None):
+    if not matches:
       return "Can't help you with that."
 
+    # Confident match on an FAQ whose answer has not changed since the table was built
+    top_match = matches[0]
+    precomputed = answer_table.lookup(intent, top_match['metadata']['question'], top_match['metadata']['answer'],
+                                      top_match['score'])
+    if precomputed is not None:
+        return precomputed
+
+    context = "\n\n".join([match['metadata']['answer'] for match in matches])
     augmented_prompt = system_prompt['content'].format(context)
 
-    messages = [{"role": "user", "content": [{"type": "text", "text": query}]}]
+    # Generate a response (FAQ answer, fast model or Sonnet depending on the top score)
+    return cascade_generate(bedrock_runtime, query, context, top_match['score'], augmented_prompt,
+                            direct_answer=top_match['metadata']['answer'])
+
+# The intent classification and the query embedding do not depend on each other and run
+# concurrently; the embedding is wasted only for queries routed to "other". Under a tight request
+# deadline the re-ranking (index order) and the generation (top FAQ answer) are skipped.
+routing_pipeline = Pipeline([
+    Stage("classify", classify_intent_db_route, inputs=["query"], cache=True,
+          cache_key=query_keys.cache_key("classify")),
+    Stage("embed", get_embedding_model, inputs=["query"], cache=True,
+          cache_key=query_keys.cache_key("embed")),
+    Stage("retrieve", query_routed_index, inputs=["classify", "embed"]),
+    Stage("rerank", rerank_matches, inputs=["query", "retrieve"], optional=True,
+          fallback=lambda query, matches: matches[:3] if matches is not None else None),
+    Stage("generate", generate_from_matches, inputs=["query", "rerank", "classify"], optional=True,
+          fallback=lambda query, matches, intent: (matches[0]['metadata']['answer'] if matches
+                                                   else "Can't help you with that.")),
+], name="db_routing")
+
+def retrieve_routed_context(query):
+    values, _ = routing_pipeline.execute({"query": query}, output="rerank")
+    return values["classify"], values["rerank"]
+
+def top_routed_id(context):
+    intent, matches = context
+    return intent, matches[0]['id'] if matches else None
+
+# SPECULATIVE_GENERATION=true: a repeated query starts generating from the route and matches it
+# got last time while classification and retrieval run, kept if the route and top match agree
+speculation = Speculation("db_routing", top_id=top_routed_id)
+
+def retrieve_routed_matches(query):
+    return routing_pipeline.run(query=query, output="rerank")
 
-    response = bedrock_runtime.invoke_model(
-        modelId='anthropic.claude-3-sonnet-20240229-v1:0',
-        body=json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 250,
-            "system": augmented_prompt,
-            "messages": messages,
-            "temperature": 0.3
-        }),
-        contentType='application/json',
-        accept='application/json'
-    )
+def advanced_database_routing_rag(query):
+    matches = retrieve_routed_matches(query)
+    if matches is None:
+        return None
+    return "\n\n".join([match['metadata']['answer'] for match in matches])
 
-    response_body = json.loads(response['body'].read())
-    return response_body['content'][0]['text']
+def prompt_builder(system_message, context):
+  return system_message['content'].format(context)
+
+# Step 3: Answer question
+def routing_rag(query):
+    # The exact wording of an FAQ (or a known paraphrase) skips classification and retrieval too
+    precomputed = answer_table.lookup_alias(query, faqs=route_faqs)
+    if precomputed is not None:
+        return precomputed
+    if speculation.enabled:
+        return speculation.run(query, retrieve_routed_context, routing_pipeline.stages["generate"],
+                               arguments=lambda q, context: (q, context[1], context[0]))
+    return routing_pipeline.run(query=query)
     
 """
 Database Routing
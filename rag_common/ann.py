@@ -0,0 +1,365 @@
+"""
+Approximate nearest neighbor search (IVF-PQ) in NumPy.
+
+Vectors are normalized and assigned to the closest of `nlist` coarse centroids (inverted lists);
+the residual to that centroid is compressed with product quantization into `m` one-byte codes.
+A query scores only the `nprobe` closest lists, using one lookup table per query:
+
+    q . x  ~=  q . centroid + sum_j q_j . codebook_j[code_j]
+
+MmapVectorIndex(path, backend="ivfpq") (or VECTOR_SEARCH_BACKEND=ivfpq) searches an on-disk index
+through one built with build_index(). Run `python -m rag_common.ann --help` for the recall@k / QPS
+benchmark against exact search.
+"""
+import argparse
+import math
+import time
+
+import numpy as np
+
+from rag_common.config import ANN_M, ANN_NLIST, ANN_NPROBE
+from rag_common.vector_store import normalize
+
+
+def kmeans(vectors, k, n_iter=20, seed=0, block=16384):
+    """
+    Plain Lloyd's k-means, returns the (k, dim) centroids.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = assign(vectors, centroids, block)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty clusters with random points so every list stays useful
+        centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+    return centroids
+
+
+def assign(vectors, centroids, block=16384):
+    """
+    Index of the closest centroid (L2) for every vector, computed in blocks.
+    """
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block):
+        chunk = vectors[start:start + block]
+        distances = centroid_norms[None, :] - 2 * chunk @ centroids.T
+        assignment[start:start + block] = distances.argmin(axis=1)
+    return assignment
+
+
+class IVFPQIndex:
+    """
+    Inverted-file index with product-quantized residuals.
+
+    Supports incremental add(), delete() (tombstones, compacted lazily), tunable nprobe and
+    rescore per search, and save()/load() to a single .npz file. With store_vectors=True a
+    float16 copy of every vector is kept so the best PQ candidates can be rescored exactly.
+    """
+
+    def __init__(self, dim, nlist=256, m=16, nbits=8, nprobe=8, store_vectors=True, rescore=4):
+        if dim % m:
+            raise ValueError(f"dim ({dim}) must be divisible by m ({m})")
+        if nbits > 8:
+            raise ValueError("nbits must be <= 8 (codes are stored as uint8)")
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.ksub = 2 ** nbits
+        self.nprobe = nprobe
+        self.store_vectors = store_vectors
+        self.rescore = rescore if store_vectors else 0
+        self.vector_chunks = []
+        self.centroids = None
+        self.codebooks = None
+        self.ids = []
+        self.id_to_row = {}
+        self.deleted = set()
+        self.list_rows = [[] for _ in range(nlist)]
+        self.list_codes = [[] for _ in range(nlist)]
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return len(self.id_to_row)
+
+    def train(self, vectors, n_iter=20, max_samples=100000, seed=0):
+        vectors = normalize(vectors)
+        if len(vectors) > max_samples:
+            vectors = vectors[np.random.default_rng(seed).choice(len(vectors), max_samples, replace=False)]
+        self.centroids = kmeans(vectors, self.nlist, n_iter, seed)
+        self.nlist = len(self.centroids)
+        self.list_rows = self.list_rows[:self.nlist]
+        self.list_codes = self.list_codes[:self.nlist]
+
+        residuals = vectors - self.centroids[assign(vectors, self.centroids)]
+        dsub = self.dim // self.m
+        self.codebooks = np.stack([
+            self._pad_codebook(kmeans(residuals[:, j * dsub:(j + 1) * dsub], self.ksub, n_iter, seed + j))
+            for j in range(self.m)
+        ])
+
+    def _pad_codebook(self, codebook):
+        # Tiny training sets give fewer than ksub centroids, keep the array rectangular
+        if len(codebook) < self.ksub:
+            codebook = np.vstack([codebook, np.repeat(codebook[-1:], self.ksub - len(codebook), axis=0)])
+        return codebook
+
+    def _encode(self, residuals):
+        dsub = self.dim // self.m
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = assign(residuals[:, j * dsub:(j + 1) * dsub], self.codebooks[j])
+        return codes
+
+    def add(self, ids, vectors):
+        """
+        Inserts (or replaces) vectors under the given ids.
+        """
+        if not self.is_trained:
+            raise RuntimeError("Index must be trained before adding vectors")
+        ids = [str(i) for i in ids]
+        self.delete([i for i in ids if i in self.id_to_row])
+
+        vectors = normalize(vectors)
+        lists = assign(vectors, self.centroids)
+        codes = self._encode(vectors - self.centroids[lists])
+
+        first_row = len(self.ids)
+        self.ids.extend(ids)
+        if self.store_vectors:
+            self.vector_chunks.append(vectors.astype(np.float16))
+        rows = np.arange(first_row, first_row + len(ids))
+        self.id_to_row.update(zip(ids, rows.tolist()))
+        for lst in np.unique(lists):
+            mask = lists == lst
+            self.list_rows[lst].append(rows[mask])
+            self.list_codes[lst].append(codes[mask])
+
+    def delete(self, ids):
+        for i in ids:
+            row = self.id_to_row.pop(str(i), None)
+            if row is not None:
+                self.deleted.add(row)
+        if len(self.deleted) > 0.2 * max(1, len(self.ids)):
+            self.compact()
+
+    def _list(self, lst):
+        # Merge the chunks appended by incremental adds on first access
+        if len(self.list_rows[lst]) > 1:
+            self.list_rows[lst] = [np.concatenate(self.list_rows[lst])]
+            self.list_codes[lst] = [np.concatenate(self.list_codes[lst])]
+        if not self.list_rows[lst]:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.m), dtype=np.uint8)
+        return self.list_rows[lst][0], self.list_codes[lst][0]
+
+    def _vectors(self):
+        if len(self.vector_chunks) > 1:
+            self.vector_chunks = [np.concatenate(self.vector_chunks)]
+        return self.vector_chunks[0] if self.vector_chunks else np.empty((0, self.dim), dtype=np.float16)
+
+    def compact(self):
+        """
+        Physically removes deleted rows and renumbers the remaining ones.
+        """
+        if not self.deleted:
+            return
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[list(self.deleted)] = False
+        new_row = np.cumsum(keep) - 1
+        for lst in range(self.nlist):
+            rows, codes = self._list(lst)
+            mask = keep[rows]
+            self.list_rows[lst] = [new_row[rows[mask]]] if mask.any() else []
+            self.list_codes[lst] = [codes[mask]] if mask.any() else []
+        if self.store_vectors:
+            self.vector_chunks = [self._vectors()[keep]]
+        self.ids = [i for i, k in zip(self.ids, keep) if k]
+        self.id_to_row = {i: row for row, i in enumerate(self.ids)}
+        self.deleted = set()
+
+    def search(self, query, top_k=10, nprobe=None, rescore=None, allowed=None):
+        """
+        Returns [(id, score)] for the top_k vectors in the nprobe closest lists.
+        With rescore > 0 the top_k * rescore PQ candidates are rescored against the stored vectors.
+        `allowed` (sorted row numbers, e.g. a metadata pre-filter) restricts the candidates to those rows.
+        """
+        query = normalize(query)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        coarse = self.centroids @ query
+        probes = np.argpartition(-coarse, nprobe - 1)[:nprobe]
+
+        dsub = self.dim // self.m
+        table = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.m, dsub))
+
+        all_rows, all_scores = [], []
+        for lst in probes:
+            rows, codes = self._list(lst)
+            if len(rows):
+                all_rows.append(rows)
+                all_scores.append(coarse[lst] + table[np.arange(self.m), codes].sum(axis=1))
+        if not all_rows:
+            return []
+        rows = np.concatenate(all_rows)
+        scores = np.concatenate(all_scores)
+        if self.deleted:
+            alive = ~np.isin(rows, list(self.deleted))
+            rows, scores = rows[alive], scores[alive]
+        if allowed is not None:
+            keep = np.isin(rows, allowed, assume_unique=True)
+            rows, scores = rows[keep], scores[keep]
+
+        rescore = self.rescore if rescore is None else rescore
+        if rescore and self.store_vectors:
+            n = min(top_k * rescore, len(rows))
+            candidates = np.argpartition(-scores, n - 1)[:n]
+            rows = rows[candidates]
+            scores = self._vectors()[rows].astype(np.float32) @ query
+
+        n = min(top_k, len(rows))
+        if n == 0:
+            return []
+        best = np.argpartition(-scores, n - 1)[:n]
+        best = best[np.argsort(-scores[best])]
+        return [(self.ids[rows[i]], float(scores[i])) for i in best]
+
+    def save(self, path):
+        self.compact()
+        lists = [self._list(lst) for lst in range(self.nlist)]
+        np.savez(
+            path,
+            config=np.array([self.dim, self.nlist, self.m, self.ksub, self.nprobe, int(self.store_vectors), self.rescore]),
+            centroids=self.centroids,
+            codebooks=self.codebooks,
+            vectors=self._vectors(),
+            ids=np.array(self.ids, dtype=str),
+            list_sizes=np.array([len(rows) for rows, _ in lists]),
+            rows=np.concatenate([rows for rows, _ in lists]) if lists else np.empty(0, dtype=np.int64),
+            codes=np.concatenate([codes for _, codes in lists]) if lists else np.empty((0, self.m), dtype=np.uint8),
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        dim, nlist, m, ksub, nprobe, store_vectors, rescore = data["config"].tolist()
+        index = cls(dim, nlist=nlist, m=m, nbits=int(np.log2(ksub)), nprobe=nprobe,
+                    store_vectors=bool(store_vectors), rescore=rescore)
+        if index.store_vectors:
+            index.vector_chunks = [data["vectors"]]
+        index.centroids = data["centroids"]
+        index.codebooks = data["codebooks"]
+        index.ids = data["ids"].tolist()
+        index.id_to_row = {i: row for row, i in enumerate(index.ids)}
+        offsets = np.concatenate([[0], np.cumsum(data["list_sizes"])])
+        rows, codes = data["rows"], data["codes"]
+        for lst in range(nlist):
+            start, end = offsets[lst], offsets[lst + 1]
+            if end > start:
+                index.list_rows[lst] = [rows[start:end]]
+                index.list_codes[lst] = [codes[start:end]]
+        return index
+
+
+def build_index(vectors, nlist=ANN_NLIST, m=ANN_M, nprobe=ANN_NPROBE, store_vectors=False):
+    """
+    An index over `vectors` whose ids are their row numbers ("0", "1", ...), so its rows are the
+    rows of `vectors`. nlist=0 picks about 4 * sqrt(count) lists; m is lowered to a divisor of the
+    dimension.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+    m = max(d for d in range(1, min(m, dim) + 1) if dim % d == 0)
+    index = IVFPQIndex(dim, nlist=nlist or max(1, int(4 * math.sqrt(count))), m=m, nprobe=nprobe,
+                       store_vectors=store_vectors)
+    index.train(vectors)
+    index.add(range(count), vectors)
+    return index
+
+
+def exact_search(vectors, query, top_k=10):
+    scores = vectors @ normalize(query)
+    n = min(top_k, len(scores))
+    best = np.argpartition(-scores, n - 1)[:n]
+    return best[np.argsort(-scores[best])]
+
+
+def benchmark(index, vectors, ids, queries, top_k=10, nprobes=(1, 2, 4, 8, 16, 32), rescores=(0, 4, 10)):
+    """
+    Measures recall@k against exact search and QPS for each (nprobe, rescore) pair.
+    Returns a list of {"nprobe", "rescore", "recall", "qps"} rows, the first row being exact search.
+    """
+    vectors = normalize(vectors)
+    start = time.perf_counter()
+    truth = [{ids[i] for i in exact_search(vectors, q, top_k)} for q in queries]
+    results = [{"nprobe": "exact", "rescore": "-", "recall": 1.0, "qps": len(queries) / (time.perf_counter() - start)}]
+
+    for rescore in rescores:
+        if rescore and not index.store_vectors:
+            continue
+        for nprobe in nprobes:
+            if nprobe > index.nlist:
+                break
+            start = time.perf_counter()
+            found = [{i for i, _ in index.search(q, top_k, nprobe=nprobe, rescore=rescore)} for q in queries]
+            elapsed = time.perf_counter() - start
+            recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+            results.append({"nprobe": nprobe, "rescore": rescore, "recall": float(recall), "qps": len(queries) / elapsed})
+    return results
+
+
+def synthetic_corpus(n, dim, n_topics=50, n_subtopics=3000, seed=0):
+    # Topic / sub-topic / noise mixture, closer to real embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    subtopics = rng.standard_normal((n_subtopics, dim)).astype(np.float32)
+    subtopic = rng.integers(0, n_subtopics, n)
+    vectors = (topics[subtopic % n_topics] + 0.6 * subtopics[subtopic]
+               + 0.3 * rng.standard_normal((n, dim)).astype(np.float32))
+    return normalize(vectors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k / QPS benchmark of IVF-PQ against exact search")
+    parser.add_argument("--index", help="On-disk vector index (rag_common.vector_store) to benchmark on")
+    parser.add_argument("--n", type=int, default=100000, help="Synthetic corpus size (without --index)")
+    parser.add_argument("--dim", type=int, default=256, help="Synthetic vector dimension (without --index)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=256)
+    parser.add_argument("--m", type=int, default=16)
+    args = parser.parse_args()
+
+    if args.index:
+        from rag_common.vector_store import MmapVectorIndex
+        with MmapVectorIndex(args.index) as store:
+            vectors = np.array(store.vectors())
+            ids = [store.get_id(i) for i in range(len(store))]
+    else:
+        vectors = synthetic_corpus(args.n, args.dim)
+        ids = [str(i) for i in range(len(vectors))]
+
+    rng = np.random.default_rng(1)
+    queries = normalize(vectors[rng.choice(len(vectors), args.queries)]
+                        + 0.1 * rng.standard_normal((args.queries, vectors.shape[1])).astype(np.float32))
+
+    index = IVFPQIndex(vectors.shape[1], nlist=args.nlist, m=args.m)
+    start = time.perf_counter()
+    index.train(vectors)
+    index.add(ids, vectors)
+    print(f"Built IVF-PQ over {len(vectors)} vectors in {time.perf_counter() - start:.1f}s")
+
+    print(f"{'nprobe':>8} {'rescore':>8} {'recall@' + str(args.top_k):>10} {'QPS':>10}")
+    for row in benchmark(index, vectors, ids, queries, args.top_k):
+        print(f"{row['nprobe']:>8} {row['rescore']:>8} {row['recall']:>10.3f} {row['qps']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Precomputed chatbot answers for the known FAQ questions.
+
+An offline job generates the final answer for every FAQ with the strong model and stores it with
+a hash of the FAQ answer it was generated from. At serve time:
+
+- lookup() answers a retrieval hit scoring at least ANSWER_TABLE_THRESHOLD from the table if the
+  hash still matches the retrieved FAQ answer, so an edited FAQ never serves a stale answer;
+- lookup_alias() answers the FAQ question itself and its known paraphrases by canonical text
+  (canonical_query), before embedding or retrieval, if the hash still matches the FAQ answer the
+  caller holds (the live FAQ text it passes in).
+
+Both are dictionary lookups. Re-running the job regenerates only missing and changed entries.
+
+    python -m rag_common.answer_table                    # ex-01 and ex-06 FAQ sets
+    python -m rag_common.answer_table --backend mock     # offline, mocked Bedrock
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rag_common.canonical import canonical_query
+from rag_common.config import ANSWER_TABLE_ENABLED, ANSWER_TABLE_PATH, ANSWER_TABLE_THRESHOLD
+
+# 2: aliases keyed by canonical_query
+VERSION = 2
+
+
+def source_hash(answer):
+    return hashlib.sha256(answer.encode("utf-8")).hexdigest()[:16]
+
+
+class AnswerTable:
+    def __init__(self, path=ANSWER_TABLE_PATH, threshold=ANSWER_TABLE_THRESHOLD, enabled=ANSWER_TABLE_ENABLED):
+        self.path = path
+        self.threshold = threshold
+        self.enabled = enabled
+        self.entries = {}  # namespace -> {question: {"answer", "source_hash", "model", "created_at"}}
+        self.aliases = {}  # canonical text -> [namespace, question]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale = 0
+
+    @classmethod
+    def load(cls, path=ANSWER_TABLE_PATH, **kwargs):
+        table = cls(path, **kwargs)
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == VERSION:
+                table.entries = data["entries"]
+                table.aliases = data["aliases"]
+            else:
+                print(f"Ignoring answer table {path}: unsupported version {data.get('version')}")
+        return table
+
+    def save(self, path=None):
+        path = path or self.path
+        with self.lock:
+            data = {"version": VERSION, "entries": self.entries, "aliases": self.aliases}
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.entries.values())
+
+    def lookup(self, namespace, question, source_answer, score):
+        """
+        Stored answer for a retrieved FAQ, or None if the score is too low, the FAQ is unknown
+        or its answer changed since the entry was generated.
+        """
+        if not self.enabled or score < self.threshold:
+            return None
+        entry = self.entries.get(namespace, {}).get(question)
+        if entry is None:
+            return None
+        if entry["source_hash"] != source_hash(source_answer):
+            self.stale += 1
+            return None
+        self.hits += 1
+        return entry["answer"]
+
+    def lookup_alias(self, text, faqs):
+        """
+        Stored answer for a query that is a known FAQ question or paraphrase up to canonicalization.
+        faqs ({namespace: {question: answer}}) is the live FAQ text: other namespaces are not served,
+        nor entries whose FAQ was removed or whose answer changed since they were generated.
+        """
+        if not self.enabled:
+            return None
+        alias = self.aliases.get(canonical_query(text))
+        if alias is None or alias[0] not in faqs:
+            return None
+        namespace, question = alias
+        entry = self.entries.get(namespace, {}).get(question)
+        if entry is None:
+            return None
+        source_answer = faqs[namespace].get(question)
+        if source_answer is None or entry["source_hash"] != source_hash(source_answer):
+            self.stale += 1
+            return None
+        self.hits += 1
+        return entry["answer"]
+
+    def put(self, namespace, question, source_answer, answer, model, aliases=()):
+        with self.lock:
+            self.entries.setdefault(namespace, {})[question] = {
+                "answer": answer,
+                "source_hash": source_hash(source_answer),
+                "model": model,
+                "created_at": int(time.time()),
+            }
+            for text in (question, *aliases):
+                self.aliases[canonical_query(text)] = [namespace, question]
+
+    def invalidate(self, namespace, question):
+        with self.lock:
+            self.entries.get(namespace, {}).pop(question, None)
+            self.aliases = {text: alias for text, alias in self.aliases.items() if alias != [namespace, question]}
+
+    def prune(self, namespace, faq):
+        """
+        Drops the entries of `namespace` whose FAQ was removed or whose answer changed.
+        """
+        for question, entry in list(self.entries.get(namespace, {}).items()):
+            if question not in faq or entry["source_hash"] != source_hash(faq[question]):
+                self.invalidate(namespace, question)
+
+
+def build(table, namespace, faq, generate, model, paraphrase=None, workers=8):
+    """
+    Generates missing or stale entries for {question: answer} with generate(question, answer).
+    paraphrase(question) -> [texts] adds aliases. Returns the number of generated entries.
+    """
+    table.prune(namespace, faq)
+    todo = [question for question in faq if question not in table.entries.get(namespace, {})]
+
+    def one(question):
+        answer = generate(question, faq[question])
+        table.put(namespace, question, faq[question], answer, model,
+                  aliases=paraphrase(question) if paraphrase else ())
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(one, todo))
+    return len(todo)
+
+
+def main():
+    from rag_common.bedrock import create_bedrock_runtime
+    from rag_common.cascade import generate_with_claude
+    from rag_common.config import CASCADE_STRONG_MODEL
+    from rag_common.evaluate import create_backends, paraphrases
+    from rag_common.exercises import load_exercise
+    from rag_common.faqs import faq_database, finance_faq, product_faq, tech_faq
+    from rag_common.mock_backends import CallStats
+
+    parser = argparse.ArgumentParser(description="Precompute chatbot answers for the known FAQ questions")
+    parser.add_argument("--path", default=ANSWER_TABLE_PATH)
+    parser.add_argument("--backend", choices=["aws", "mock"], default="aws")
+    parser.add_argument("--model", default=CASCADE_STRONG_MODEL)
+    parser.add_argument("--paraphrases", type=int, default=2, help="Paraphrases stored as aliases per question")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate every entry")
+    args = parser.parse_args()
+
+    if args.backend == "mock":
+        bedrock_runtime, pinecone_factory = create_backends("mock", (0, 0, 0), None, CallStats())
+    else:
+        bedrock_runtime, pinecone_factory = create_bedrock_runtime(), None
+    rag_module = load_exercise("ex-01", bedrock_runtime=bedrock_runtime, pinecone_factory=pinecone_factory)
+    routing_module = load_exercise("ex-06", bedrock_runtime=bedrock_runtime, pinecone_factory=pinecone_factory)
+
+    # The same prompts the chatbots generate with, context = the FAQ answer
+    prompts = {
+        "ecommerce": (faq_database, rag_module.get_system_prompt),
+        "product": (product_faq, routing_module.system_prompt['content'].format),
+        "finance": (finance_faq, routing_module.system_prompt['content'].format),
+        "tech": (tech_faq, routing_module.system_prompt['content'].format),
+    }
+
+    table = AnswerTable(args.path) if args.rebuild else AnswerTable.load(args.path)
+    rng = random.Random(0)
+    for namespace, (faq, system_prompt) in prompts.items():
+        started = time.perf_counter()
+        generated = build(
+            table, namespace, faq,
+            lambda question, answer: generate_with_claude(bedrock_runtime, args.model, system_prompt(answer), question),
+            args.model,
+            paraphrase=lambda question: paraphrases(question, rng, args.paraphrases),
+            workers=args.workers,
+        )
+        print(f"{namespace}: {generated} generated, {len(table.entries.get(namespace, {}))} entries "
+              f"({time.perf_counter() - started:.1f}s)")
+    table.save()
+    print(f"Wrote {len(table)} answers and {len(table.aliases)} aliases to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
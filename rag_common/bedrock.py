@@ -0,0 +1,228 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import boto3
+from botocore.config import Config
+
+from rag_common.config import (
+    AWS_DEFAULT_REGION,
+    BEDROCK_BACKOFF_BASE,
+    BEDROCK_BACKOFF_MAX,
+    BEDROCK_DEFAULT_RPS,
+    BEDROCK_HEDGE,
+    BEDROCK_HEDGE_MIN_SAMPLES,
+    BEDROCK_HEDGE_QUANTILE,
+    BEDROCK_MAX_RETRIES,
+    BEDROCK_RATE_LIMITS,
+)
+from rag_common.ledger import MeteredBedrockRuntime
+from rag_common.pipeline import remaining_time
+
+# Error codes worth retrying - everything else (validation, access denied, ...) fails fast
+RETRYABLE_ERRORS = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "InternalServerException",
+}
+
+
+def error_code(error):
+    """
+    Returns the AWS error code of a botocore ClientError (None for anything else).
+    """
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code")
+
+
+def is_retryable(error):
+    return error_code(error) in RETRYABLE_ERRORS
+
+
+def backoff_delay(attempt, base=BEDROCK_BACKOFF_BASE, cap=BEDROCK_BACKOFF_MAX):
+    """
+    Exponential backoff with full jitter: uniform(0, min(cap, base * 2^attempt)).
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def parse_rate_limits(spec):
+    """
+    Parses "model=rps[:burst],model=rps[:burst]" into {model: (rps, burst)}.
+    A call takes one whole token, so burst is at least 1 (a smaller bucket would never fill).
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model_id, rate = item.rsplit("=", 1)
+        rps, _, burst = rate.partition(":")
+        rps = float(rps)
+        if rps <= 0:
+            raise ValueError(f"Rate limit of {model_id.strip()} must be positive, got {rps}")
+        limits[model_id.strip()] = (rps, max(1.0, float(burst) if burst else rps))
+    return limits
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate` tokens per second.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+
+class LatencyTracker:
+    """
+    Keeps a sliding window of call latencies to estimate the hedging deadline.
+    """
+
+    def __init__(self, window=200):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def quantile(self, q, min_samples=BEDROCK_HEDGE_MIN_SAMPLES):
+        with self.lock:
+            if len(self.samples) < min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ResilientBedrockClient:
+    """
+    Wraps a bedrock-runtime client so every invoke_model call is rate limited per model id,
+    retried with jittered exponential backoff on throttling and, optionally, hedged with a
+    second request once the first one is slower than the observed p95.
+
+    Any other attribute is forwarded to the wrapped client, so it is a drop-in replacement.
+    """
+
+    def __init__(self, client, max_retries=BEDROCK_MAX_RETRIES, rate_limits=None,
+                 default_rps=BEDROCK_DEFAULT_RPS, hedge=BEDROCK_HEDGE,
+                 hedge_quantile=BEDROCK_HEDGE_QUANTILE, sleep=time.sleep):
+        self._client = client
+        self.max_retries = max_retries
+        self.rate_limits = parse_rate_limits(BEDROCK_RATE_LIMITS) if rate_limits is None else rate_limits
+        self.default_rps = default_rps
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.sleep = sleep
+        self.buckets = {}
+        self.latencies = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="bedrock-hedge") if hedge else None
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _bucket(self, model_id):
+        with self.lock:
+            if model_id not in self.buckets:
+                rps, burst = self.rate_limits.get(model_id, (self.default_rps, max(1.0, self.default_rps)))
+                self.buckets[model_id] = TokenBucket(rps, burst) if rps > 0 else None
+            return self.buckets[model_id]
+
+    def _tracker(self, model_id):
+        with self.lock:
+            return self.latencies.setdefault(model_id, LatencyTracker())
+
+    def _call(self, kwargs):
+        start = time.monotonic()
+        response = self._client.invoke_model(**kwargs)
+        self._tracker(kwargs.get("modelId")).record(time.monotonic() - start)
+        return response
+
+    def _hedged_call(self, kwargs):
+        deadline = self._tracker(kwargs.get("modelId")).quantile(self.hedge_quantile)
+        if deadline is None:
+            return self._call(kwargs)
+
+        pending = {self.executor.submit(self._call, kwargs)}
+        done, pending = wait(pending, timeout=deadline)
+        if not done:
+            # The primary is in the tail: only hedge if the rate limiter has a spare token
+            bucket = self._bucket(kwargs.get("modelId"))
+            if bucket is None or bucket.try_acquire():
+                pending.add(self.executor.submit(self._call, kwargs))
+
+        error = None
+        while pending or done:
+            if not done:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            future = done.pop()
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+        raise error
+
+    def invoke_model(self, **kwargs):
+        bucket = self._bucket(kwargs.get("modelId"))
+        attempt = 0
+        while True:
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                if self.hedge:
+                    return self._hedged_call(kwargs)
+                return self._call(kwargs)
+            except Exception as e:
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                remaining = remaining_time()
+                if remaining is not None and delay >= remaining:
+                    # The retry could not finish before the request deadline
+                    raise
+                print(f"DEBUG - {error_code(e)} on {kwargs.get('modelId')}, retry {attempt + 1} in {delay:.2f}s")
+                self.sleep(delay)
+                attempt += 1
+
+
+def create_bedrock_runtime(region_name=AWS_DEFAULT_REGION, **kwargs):
+    """
+    Creates the bedrock-runtime client used by the exercises.
+    botocore's own retries are disabled so backoff is handled in one place, and the usage of
+    every call is recorded in the token ledger.
+    """
+    client = boto3.client(
+        "bedrock-runtime",
+        region_name=region_name,
+        config=Config(retries={"mode": "standard", "max_attempts": 1}),
+    )
+    return MeteredBedrockRuntime(ResilientBedrockClient(client, **kwargs))
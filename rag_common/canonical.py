@@ -0,0 +1,204 @@
+"""
+Query canonicalization in front of every cache keyed by query text (embeddings, routing,
+candidate generation, precomputed answers).
+
+"Do you offer student discounts?", "do you offer  student discounts" and "DO YOU OFFER STUDENT
+DISCOUNTS" share one key: Unicode NFKC + accent folding, case folding, punctuation removal,
+whitespace collapsing and, with QUERY_SPELLING_CORRECTION, correction of unknown words against a
+vocabulary (e.g. the FAQ texts, or the words of SPELLING_VOCABULARY_PATH). The original text is
+still what gets embedded or sent to the model. Punctuation that is part of a term is kept, so "C++",
+"C#" and "C" stay three keys, as do "node.js" and ".NET". A query without any word keeps its own
+(NFKC) key.
+
+QueryKeys counts, per cache, how often a key repeats exactly and after canonicalization, i.e. the
+hit rate an unbounded cache gets with raw and with canonical keys:
+
+    python -m rag_common.canonical                 # FAQ questions with typed variants
+    python -m rag_common.canonical queries.txt     # a query log, one query per line
+"""
+import argparse
+import random
+import re
+import threading
+import unicodedata
+from collections import Counter
+
+from rag_common.config import CANONICAL_QUERIES, QUERY_SPELLING_CORRECTION, SPELLING_VOCABULARY_PATH
+
+# Typographic quotes and dashes NFKC leaves alone
+TYPOGRAPHIC = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"',
+                             "–": "-", "—": "-"})
+APOSTROPHE_RE = re.compile(r"(?<=\w)'(?=\w)")
+# A word with the punctuation that belongs to it: a leading "." (".net"), inner "." ("node.js",
+# "3.5") and trailing "+" / "#" ("c++", "c#"); any other punctuation separates words
+TOKEN_RE = re.compile(r"(?:(?<!\S)\.)?[^\W_]+(?:\.[^\W_]+)*[+#]*")
+WORD_RE = re.compile(r"[a-z]+")
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+class SpellingCorrector:
+    """
+    Replaces a word missing from the vocabulary by the most frequent vocabulary word one edit
+    away (delete, transpose, replace or insert). Short words and numbers are left alone.
+    """
+
+    def __init__(self, words=(), min_length=4):
+        self.counts = Counter(words)
+        self.min_length = min_length
+
+    @classmethod
+    def from_texts(cls, texts):
+        corrector = cls()
+        corrector.add_texts(texts)
+        return corrector
+
+    def add_texts(self, texts):
+        for text in texts:
+            self.counts.update(WORD_RE.findall(fold(text)))
+
+    def edits(self, word):
+        splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+        return ({left + right[1:] for left, right in splits if right}
+                | {left + right[1] + right[0] + right[2:] for left, right in splits if len(right) > 1}
+                | {left + c + right[1:] for left, right in splits if right for c in LETTERS}
+                | {left + c + right for left, right in splits for c in LETTERS})
+
+    def correct(self, word):
+        if len(word) < self.min_length or word in self.counts or not word.isalpha():
+            return word
+        candidates = [candidate for candidate in self.edits(word) if candidate in self.counts]
+        return max(candidates, key=self.counts.__getitem__) if candidates else word
+
+
+def fold(text):
+    """
+    NFKC, accents and case folded, typographic punctuation mapped to ASCII.
+    """
+    text = unicodedata.normalize("NFKD", unicodedata.normalize("NFKC", text))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return text.casefold().translate(TYPOGRAPHIC)
+
+
+def canonical_query(text, corrector=None):
+    """
+    The query's words joined by single spaces. A query without any word ("???", an emoji) keys on
+    its NFKC text instead, so such queries do not all share the empty key.
+    """
+    words = TOKEN_RE.findall(APOSTROPHE_RE.sub("", fold(text)))
+    if not words:
+        return unicodedata.normalize("NFKC", text).strip()
+    if corrector is not None:
+        words = [corrector.correct(word) for word in words]
+    return " ".join(words)
+
+
+class QueryKeys:
+    """
+    Canonical cache keys plus per-cache repeat statistics (bounded to max_tracked keys per cache).
+    """
+
+    def __init__(self, enabled=CANONICAL_QUERIES, spelling=QUERY_SPELLING_CORRECTION, max_tracked=100000):
+        self.enabled = enabled
+        self.corrector = SpellingCorrector() if spelling else None
+        self.max_tracked = max_tracked
+        self.lock = threading.Lock()
+        self.seen = {}  # cache -> (raw keys, canonical keys)
+        self.counts = {}  # cache -> Counter(lookups, exact_repeats, canonical_repeats)
+
+    def add_vocabulary(self, texts):
+        # Known texts (FAQ questions and answers) feed the spelling corrector when it is on
+        if self.corrector is not None:
+            self.corrector.add_texts(texts)
+
+    def canonical(self, text):
+        return canonical_query(text, self.corrector) if self.enabled else text
+
+    def key(self, text, cache="default"):
+        key = self.canonical(text)
+        with self.lock:
+            raw_seen, canonical_seen = self.seen.setdefault(cache, (set(), set()))
+            counts = self.counts.setdefault(cache, Counter())
+            counts["lookups"] += 1
+            counts["exact_repeats"] += text in raw_seen
+            counts["canonical_repeats"] += key in canonical_seen
+            if len(raw_seen) < self.max_tracked:
+                raw_seen.add(text)
+                canonical_seen.add(key)
+        return key
+
+    def cache_key(self, cache):
+        """
+        Key function for a pipeline Stage(cache=True) whose argument is a text.
+        """
+        return lambda text: self.key(text, cache)
+
+    def stats(self):
+        """
+        {cache: {"lookups", "exact_hit_rate", "canonical_hit_rate", "gain"}} where the hit rates
+        are those of an unbounded cache keyed by raw and by canonical text.
+        """
+        with self.lock:
+            counts = {cache: dict(c) for cache, c in self.counts.items()}
+        report = {}
+        for cache, c in counts.items():
+            lookups = c["lookups"]
+            exact = c.get("exact_repeats", 0) / lookups
+            canonical = c.get("canonical_repeats", 0) / lookups
+            report[cache] = {"lookups": lookups, "exact_hit_rate": round(exact, 4),
+                             "canonical_hit_rate": round(canonical, 4), "gain": round(canonical - exact, 4)}
+        return report
+
+
+query_keys = QueryKeys()
+
+if SPELLING_VOCABULARY_PATH:
+    with open(SPELLING_VOCABULARY_PATH, encoding="utf-8") as f:
+        query_keys.add_vocabulary(f)
+
+
+def typed_variants(question, rng, per_question=3):
+    """
+    How users type an FAQ question: case, punctuation, spacing, curly quotes and a typo.
+    """
+    variants = [question, question.lower().rstrip("?"), question.upper(), "  " + question.replace(" ", "  "),
+                question.replace("'", "’"), question.rstrip("?") + "??"]
+    words = question.split()
+    long_words = [i for i, word in enumerate(words) if len(word) > 5]
+    if long_words:
+        i = rng.choice(long_words)
+        j = rng.randrange(1, len(words[i]) - 1)
+        words[i] = words[i][:j] + words[i][j + 1:]
+        variants.append(" ".join(words))
+    return rng.sample(variants, min(per_question, len(variants)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache hit rates with raw vs canonical query keys")
+    parser.add_argument("log", nargs="?", help="Query log, one query per line (default: FAQ questions with variants)")
+    parser.add_argument("--variants", type=int, default=3, help="Typed variants per FAQ question")
+    parser.add_argument("--spelling", action="store_true", help="Correct spelling against the FAQ vocabulary")
+    args = parser.parse_args()
+
+    from rag_common.faqs import INDEXES
+
+    faqs = list(INDEXES.values())
+    if args.log:
+        with open(args.log, encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        rng = random.Random(0)
+        queries = [variant for faq in faqs for question in faq for variant in typed_variants(question, rng, args.variants)]
+        rng.shuffle(queries)
+
+    keys = QueryKeys(enabled=True, spelling=args.spelling)
+    for faq in faqs:
+        keys.add_vocabulary([text for item in faq.items() for text in item])
+    for query in queries:
+        keys.key(query, "queries")
+    stats = keys.stats()["queries"]
+    print(f"{stats['lookups']} queries: exact-key hit rate {stats['exact_hit_rate']:.1%}, "
+          f"canonical-key hit rate {stats['canonical_hit_rate']:.1%} (+{stats['gain']:.1%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import json
+
+from rag_common.config import (
+    CASCADE_DIRECT_THRESHOLD,
+    CASCADE_ENABLED,
+    CASCADE_FAST_MODEL,
+    CASCADE_FAST_THRESHOLD,
+    CASCADE_MIN_GROUNDING,
+    CASCADE_STRONG_MODEL,
+)
+from rag_common.text import content_words
+
+REFUSAL_MARKERS = (
+    "i don't know",
+    "i do not know",
+    "i'm sorry",
+    "i am sorry",
+    "i cannot",
+    "i can't",
+    "not able to",
+    "no information",
+    "does not contain",
+    "doesn't contain",
+    "not mentioned",
+)
+
+
+def grounding_score(answer, context):
+    """
+    Fraction of the answer's content words that also appear in the retrieved context.
+    """
+    answer_words = content_words(answer)
+    if not answer_words:
+        return 0.0
+    return len(answer_words & content_words(context)) / len(answer_words)
+
+
+def passes_quality_check(answer, context, min_grounding=CASCADE_MIN_GROUNDING):
+    """
+    Cheap checks on the fast model's answer: not empty, not a refusal, grounded in the context.
+    """
+    if not answer or not answer.strip():
+        return False
+    lowered = answer.lower()
+    if any(marker in lowered for marker in REFUSAL_MARKERS):
+        return False
+    return grounding_score(answer, context) >= min_grounding
+
+
+def generate_with_claude(bedrock_runtime, model_id, system_prompt, query, max_tokens=250, temperature=0.3):
+    response = bedrock_runtime.invoke_model(
+        modelId=model_id,
+        body=json.dumps({
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens,
+            "system": system_prompt,
+            "messages": [{"role": "user", "content": query}],
+            "temperature": temperature
+        }),
+        contentType='application/json',
+        accept='application/json'
+    )
+
+    response_body = json.loads(response['body'].read())
+    return response_body['content'][0]['text']
+
+
+def cascade_generate(bedrock_runtime, query, context, score, system_prompt, direct_answer=None,
+                     max_tokens=250, temperature=0.3):
+    """
+    Answers a query with the cheapest tier that is confident enough:
+
+    1. score >= CASCADE_DIRECT_THRESHOLD: return the retrieved FAQ answer as is
+    2. score >= CASCADE_FAST_THRESHOLD: generate with the fast model, keep it if it passes the quality check
+    3. otherwise (or when the check fails): generate with the strong model
+    """
+    if CASCADE_ENABLED and score is not None:
+        if direct_answer and score >= CASCADE_DIRECT_THRESHOLD:
+            print(f"DEBUG - Cascade: direct FAQ answer (score {score:.3f})")
+            return direct_answer
+
+        if score >= CASCADE_FAST_THRESHOLD:
+            answer = generate_with_claude(bedrock_runtime, CASCADE_FAST_MODEL, system_prompt, query,
+                                          max_tokens, temperature)
+            if passes_quality_check(answer, context):
+                print(f"DEBUG - Cascade: fast model answer (score {score:.3f})")
+                return answer
+            print("DEBUG - Cascade: fast model answer failed quality check, escalating")
+
+    print(f"DEBUG - Cascade: strong model answer (score {score})")
+    return generate_with_claude(bedrock_runtime, CASCADE_STRONG_MODEL, system_prompt, query,
+                                max_tokens, temperature)
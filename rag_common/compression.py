@@ -0,0 +1,298 @@
+"""
+Embedding compression for locally stored vectors: dimensionality reduction followed by quantization.
+
+    reduction       PCA fit on the corpus, or a (data independent) Gaussian random projection
+    quantization    float32, float16, int8 (per-row scale) or PQ (m one-byte codes per vector)
+
+A fitted Projection is passed to vector_store.write_index, which stores it in the index file so
+queries are projected the same way at search time. The vectors ex-00 upserts to Pinecone are not
+reduced: that would need indexes created with the reduced dimension and the projection applied
+to every Pinecone query.
+
+Run `python -m rag_common.compression --help` for the recall / memory / latency table used to pick
+a setting per index.
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from rag_common.ann import assign, kmeans, synthetic_corpus
+from rag_common.vector_store import normalize, project, quantize_int8
+
+REDUCTIONS = ("none", "pca", "random")
+QUANTIZATIONS = ("float32", "float16", "int8", "pq")
+
+
+class Projection:
+    """
+    Linear map source dim -> dim: reduced = normalize((vector - mean) @ matrix).
+    """
+
+    def __init__(self, mean, matrix, method):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.matrix = np.asarray(matrix, dtype=np.float32)
+        self.method = method
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    def apply(self, vectors):
+        return project(vectors, self.mean, self.matrix)
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, matrix=self.matrix, method=np.array(self.method))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["mean"], data["matrix"], str(data["method"]))
+
+
+def fit_pca(vectors, dim, max_samples=50000, seed=0):
+    """
+    Top `dim` principal components of the (normalized) corpus. A corpus of n vectors has at most
+    n - 1 useful components, `dim` is capped accordingly.
+    """
+    vectors = normalize(vectors)
+    if len(vectors) > max_samples:
+        vectors = vectors[np.random.default_rng(seed).choice(len(vectors), max_samples, replace=False)]
+    mean = vectors.mean(axis=0)
+    _, _, components = np.linalg.svd(vectors - mean, full_matrices=False)
+    dim = max(1, min(dim, len(vectors) - 1, vectors.shape[1]))
+    return Projection(mean, components[:dim].T, "pca")
+
+
+def fit_random_projection(source_dim, dim, seed=0):
+    matrix = np.random.default_rng(seed).standard_normal((source_dim, dim)).astype(np.float32) / np.sqrt(dim)
+    return Projection(np.zeros(source_dim, dtype=np.float32), matrix, "random")
+
+
+def fit_projection(method, vectors, dim, seed=0):
+    """
+    Projection for `method` ("pca" or "random"), or None for "none" / a dim that reduces nothing.
+    """
+    if method not in REDUCTIONS:
+        raise ValueError(f"Unknown reduction {method}, expected one of {list(REDUCTIONS)}")
+    source_dim = np.shape(vectors)[1]
+    if method == "none" or not dim or dim >= source_dim:
+        return None
+    if method == "pca":
+        return fit_pca(vectors, dim, seed=seed)
+    return fit_random_projection(source_dim, dim, seed)
+
+
+class ProductQuantizer:
+    """
+    Splits vectors into m sub-vectors and stores the index of the nearest of 256 centroids per
+    sub-vector. Scores against a query come from one (m, 256) lookup table (asymmetric distance).
+    """
+
+    def __init__(self, dim, m=16, ksub=256):
+        if dim % m:
+            raise ValueError(f"Dimension {dim} is not divisible by m={m}")
+        self.dim = dim
+        self.m = m
+        self.ksub = ksub
+        self.dsub = dim // m
+        self.codebooks = None
+
+    def train(self, vectors, n_iter=15, seed=0):
+        self.codebooks = [kmeans(vectors[:, j * self.dsub:(j + 1) * self.dsub], self.ksub, n_iter, seed + j)
+                          for j in range(self.m)]
+        return self
+
+    def encode(self, vectors):
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j, codebook in enumerate(self.codebooks):
+            codes[:, j] = assign(vectors[:, j * self.dsub:(j + 1) * self.dsub], codebook)
+        return codes
+
+    def decode(self, codes):
+        return np.hstack([codebook[codes[:, j]] for j, codebook in enumerate(self.codebooks)])
+
+    def scores(self, query, codes):
+        table = [codebook @ query[j * self.dsub:(j + 1) * self.dsub] for j, codebook in enumerate(self.codebooks)]
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for j in range(self.m):
+            scores += table[j][codes[:, j]]
+        return scores
+
+
+class CompressedVectors:
+    """
+    A corpus stored with one quantization, exact-scanned for the benchmark.
+    """
+
+    def __init__(self, vectors, quantization, pq_m=16):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization}, expected one of {list(QUANTIZATIONS)}")
+        self.quantization = quantization
+        self.scales = None
+        self.pq = None
+        if quantization == "float32":
+            self.codes = np.ascontiguousarray(vectors, dtype=np.float32)
+        elif quantization == "float16":
+            self.codes = vectors.astype(np.float16)
+        elif quantization == "int8":
+            self.codes, self.scales = quantize_int8(vectors)
+        else:
+            self.pq = ProductQuantizer(vectors.shape[1], pq_m).train(vectors)
+            self.codes = self.pq.encode(vectors)
+
+    @property
+    def nbytes(self):
+        size = self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+        if self.pq is not None:
+            size += sum(codebook.nbytes for codebook in self.pq.codebooks)
+        return size
+
+    def scores(self, query):
+        if self.pq is not None:
+            return self.pq.scores(query, self.codes)
+        scores = self.codes.astype(np.float32, copy=False) @ query
+        return scores * self.scales if self.scales is not None else scores
+
+
+def top_k_rows(scores, top_k):
+    n = min(top_k, len(scores))
+    best = np.argpartition(-scores, n - 1)[:n]
+    return best[np.argsort(-scores[best])]
+
+
+def measure(vectors, queries, reductions=REDUCTIONS, dims=(512, 256, 128), quantizations=QUANTIZATIONS,
+            top_k=10, pq_m=16):
+    """
+    Recall@k (against exact float32 search on the full vectors), stored bytes and query latency
+    (projection + full scan) for every reduction x dim x quantization setting.
+    Returns rows of {"reduction", "dim", "quantization", "bytes_per_vector", "memory_mb", "ratio",
+    "recall", "ms_per_query"}; the first row is the uncompressed baseline.
+    """
+    vectors = normalize(vectors)
+    queries = normalize(queries)
+    source_dim = vectors.shape[1]
+    truth = [set(top_k_rows(vectors @ q, top_k).tolist()) for q in queries]
+    baseline_bytes = vectors.nbytes
+
+    settings = [("none", source_dim)] + [(method, dim) for method in reductions if method != "none"
+                                          for dim in dims if dim < source_dim]
+    rows = []
+    measured = set()
+    for method, dim in settings:
+        projection = fit_projection(method, vectors, dim)
+        reduced = projection.apply(vectors) if projection else vectors
+        # PCA on a small corpus caps the dimension, several requested dims can end up the same
+        if (method, reduced.shape[1]) in measured:
+            continue
+        measured.add((method, reduced.shape[1]))
+        for quantization in quantizations:
+            if quantization == "pq" and reduced.shape[1] % pq_m:
+                continue
+            store = CompressedVectors(reduced, quantization, pq_m)
+            started = time.perf_counter()
+            found = []
+            for q in queries:
+                q = projection.apply(q) if projection else q
+                found.append(set(top_k_rows(store.scores(q), top_k).tolist()))
+            elapsed = time.perf_counter() - started
+            stored = store.nbytes + (projection.matrix.nbytes + projection.mean.nbytes if projection else 0)
+            rows.append({
+                "reduction": method,
+                "dim": reduced.shape[1],
+                "quantization": quantization,
+                "bytes_per_vector": store.nbytes / len(vectors),
+                "memory_mb": stored / 2 ** 20,
+                "ratio": baseline_bytes / stored,
+                "recall": float(np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])),
+                "ms_per_query": elapsed / len(queries) * 1000,
+            })
+    return rows
+
+
+def print_rows(name, rows, top_k):
+    print(f"\n{name}")
+    print(f"{'reduction':<10} {'dim':>5} {'quant':<8} {'B/vector':>9} {'MB':>9} {'ratio':>6} "
+          f"{'recall@' + str(top_k):>10} {'ms/query':>9}")
+    for row in rows:
+        print(f"{row['reduction']:<10} {row['dim']:>5} {row['quantization']:<8} {row['bytes_per_vector']:>9.1f} "
+              f"{row['memory_mb']:>9.2f} {row['ratio']:>6.1f} {row['recall']:>10.3f} {row['ms_per_query']:>9.3f}")
+
+
+def load_corpora(args):
+    """
+    {name: (vectors, queries)}: every --index file, the ex-00 FAQ sets (--faq) or a synthetic corpus.
+    """
+    rng = np.random.default_rng(1)
+
+    def noisy_queries(vectors):
+        picked = vectors[rng.choice(len(vectors), args.queries)]
+        return normalize(picked + 0.1 * rng.standard_normal(picked.shape).astype(np.float32))
+
+    corpora = {}
+    for path in args.index or []:
+        from rag_common.vector_store import MmapVectorIndex
+        with MmapVectorIndex(path) as store:
+            vectors = np.array(store.vectors())
+        corpora[path] = (vectors, noisy_queries(vectors))
+
+    if args.faq:
+        # FAQ questions as the corpus, their paraphrases as the queries
+        from rag_common.evaluate import create_backends, paraphrases
+        from rag_common.exercises import load_exercise
+        from rag_common.faqs import INDEXES
+        from rag_common.mock_backends import CallStats
+
+        bedrock_runtime, pinecone_factory = create_backends(args.backend, (0, 0, 0), args.cache_dir, CallStats())
+        faq_module = load_exercise("ex-00", bedrock_runtime=bedrock_runtime, pinecone_factory=pinecone_factory)
+        rng_text = random.Random(0)
+        for name, faq in INDEXES.items():
+            questions = list(faq)
+            queries = [text for question in questions for text in paraphrases(question, rng_text, 2)]
+            corpora[name] = (np.array([faq_module.get_embedding_model(q) for q in questions], dtype=np.float32),
+                             np.array([faq_module.get_embedding_model(q) for q in queries], dtype=np.float32))
+
+    if not corpora:
+        vectors = synthetic_corpus(args.n, args.dim)
+        corpora[f"synthetic {args.n} x {args.dim}"] = (vectors, noisy_queries(vectors))
+    return corpora
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall / memory / latency of embedding compression settings")
+    parser.add_argument("--index", action="append", help="On-disk vector index to measure (repeatable)")
+    parser.add_argument("--faq", action="store_true", help="Measure the ex-00 FAQ sets (paraphrases as queries)")
+    parser.add_argument("--backend", choices=["mock", "aws"], default="mock", help="Embeddings for --faq")
+    parser.add_argument("--cache-dir", default=".eval_cache", help="Embedding cache for --faq --backend aws")
+    parser.add_argument("--n", type=int, default=20000, help="Synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=1536, help="Synthetic vector dimension")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--reductions", default="pca,random")
+    parser.add_argument("--dims", default="512,256,128", help="Reduced dimensions to try")
+    parser.add_argument("--quantizations", default=",".join(QUANTIZATIONS))
+    parser.add_argument("--pq-m", type=int, default=16, help="PQ sub-vectors (bytes per vector)")
+    parser.add_argument("--json", action="store_true", help="Print the rows as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for name, (vectors, queries) in load_corpora(args).items():
+        top_k = min(args.top_k, len(vectors))
+        results[name] = measure(
+            vectors, queries,
+            reductions=args.reductions.split(","),
+            dims=[int(d) for d in args.dims.split(",")],
+            quantizations=args.quantizations.split(","),
+            top_k=top_k,
+            pq_m=args.pq_m,
+        )
+        if not args.json:
+            print_rows(f"{name}: {len(vectors)} vectors, {len(queries)} queries", results[name], top_k)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import os
+
+# AWS region used by every Bedrock client
+AWS_DEFAULT_REGION = os.getenv("AWS_DEFAULT_REGION", "us-east-1")
+
+# Retry / backoff for throttled Bedrock calls
+BEDROCK_MAX_RETRIES = int(os.getenv("BEDROCK_MAX_RETRIES", "6"))
+BEDROCK_BACKOFF_BASE = float(os.getenv("BEDROCK_BACKOFF_BASE", "0.25"))  # seconds
+BEDROCK_BACKOFF_MAX = float(os.getenv("BEDROCK_BACKOFF_MAX", "8.0"))  # seconds
+
+# Client-side token bucket per model id, e.g. "amazon.titan-embed-text-v1=20:40,openai.gpt-oss-20b-1:0=5"
+# (requests per second, optional burst). BEDROCK_DEFAULT_RPS=0 disables the limiter for unlisted models.
+BEDROCK_RATE_LIMITS = os.getenv("BEDROCK_RATE_LIMITS", "")
+BEDROCK_DEFAULT_RPS = float(os.getenv("BEDROCK_DEFAULT_RPS", "0"))
+
+# Hedged requests: fire a second call once the first one exceeds the observed latency quantile
+BEDROCK_HEDGE = os.getenv("BEDROCK_HEDGE", "false").lower() == "true"
+BEDROCK_HEDGE_QUANTILE = float(os.getenv("BEDROCK_HEDGE_QUANTILE", "0.95"))
+BEDROCK_HEDGE_MIN_SAMPLES = int(os.getenv("BEDROCK_HEDGE_MIN_SAMPLES", "20"))
+
+# Multi-model cascade: answer high-confidence FAQ hits directly or with a small model,
+# escalate to the strong model on low retrieval scores or failed quality checks
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "true").lower() == "true"
+CASCADE_DIRECT_THRESHOLD = float(os.getenv("CASCADE_DIRECT_THRESHOLD", "0.92"))
+CASCADE_FAST_THRESHOLD = float(os.getenv("CASCADE_FAST_THRESHOLD", "0.80"))
+CASCADE_MIN_GROUNDING = float(os.getenv("CASCADE_MIN_GROUNDING", "0.35"))
+CASCADE_FAST_MODEL = os.getenv("CASCADE_FAST_MODEL", "anthropic.claude-3-haiku-20240307-v1:0")
+CASCADE_STRONG_MODEL = os.getenv("CASCADE_STRONG_MODEL", "anthropic.claude-3-sonnet-20240229-v1:0")
+
+# Re-ranking after retrieval/fusion: "lexical" (BM25 over the candidates), "onnx" (cross-encoder) or "none"
+RERANKER = os.getenv("RERANKER", "lexical")
+RERANK_WEIGHT = float(os.getenv("RERANK_WEIGHT", "0.7"))  # share of the re-ranker score vs. the retrieval order
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "10000"))
+RERANK_ONNX_MODEL = os.getenv("RERANK_ONNX_MODEL", "")  # path to a cross-encoder .onnx file
+RERANK_ONNX_TOKENIZER = os.getenv("RERANK_ONNX_TOKENIZER", "")  # path to its tokenizer.json
+
+# Metadata fields the local vector store can filter on (free-text fields like question/answer are
+# not indexed)
+METADATA_FILTER_FIELDS = [f.strip() for f in os.getenv(
+    "METADATA_FILTER_FIELDS", "category,language,product_line,updated_at").split(",") if f.strip()]
+
+# Search over the local on-disk indexes (ex-01's FAQ index, the shards): "exact" scans every vector,
+# "ivfpq" (rag_common.ann) scans the ANN_NPROBE closest of ANN_NLIST clusters (0 = about 4 * sqrt(count))
+# with ANN_M product-quantization codes per vector
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "exact")
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0"))
+ANN_M = int(os.getenv("ANN_M", "16"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+
+# Pipeline engine: worker threads shared by every pipeline, default per-stage timeout (seconds, 0 = none)
+# and entries kept by each cached stage
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "32"))
+PIPELINE_STAGE_TIMEOUT = float(os.getenv("PIPELINE_STAGE_TIMEOUT", "60"))
+PIPELINE_CACHE_SIZE = int(os.getenv("PIPELINE_CACHE_SIZE", "1024"))
+
+# Request deadline (seconds, 0 = none) of a pipeline run whose caller set none. Optional stages are
+# skipped when less time is left than their PIPELINE_STAGE_QUANTILE duration so far
+PIPELINE_DEADLINE = float(os.getenv("PIPELINE_DEADLINE", "0"))
+PIPELINE_STAGE_QUANTILE = float(os.getenv("PIPELINE_STAGE_QUANTILE", "0.9"))
+
+# Precomputed answer table (python -m rag_common.answer_table): retrieval hits scoring at least
+# ANSWER_TABLE_THRESHOLD against an FAQ whose source answer is unchanged skip generation
+ANSWER_TABLE_ENABLED = os.getenv("ANSWER_TABLE_ENABLED", "true").lower() == "true"
+ANSWER_TABLE_PATH = os.getenv("ANSWER_TABLE_PATH", "answer_table.json")
+ANSWER_TABLE_THRESHOLD = float(os.getenv("ANSWER_TABLE_THRESHOLD", "0.85"))
+
+# Sharded local vector search (rag_common.shards): worker processes (0 = one per CPU) and how they
+# are started ("spawn" is safe with the threads the pipelines run in, "fork" starts faster on Linux)
+SHARD_PROCESSES = int(os.getenv("SHARD_PROCESSES", "0"))
+SHARD_START_METHOD = os.getenv("SHARD_START_METHOD", "spawn")
+
+# Query canonicalization for cache keys (rag_common.canonical); spelling correction needs a
+# vocabulary (the exercises add their FAQ texts, Module 5 reads the words of SPELLING_VOCABULARY_PATH)
+CANONICAL_QUERIES = os.getenv("CANONICAL_QUERIES", "true").lower() == "true"
+QUERY_SPELLING_CORRECTION = os.getenv("QUERY_SPELLING_CORRECTION", "false").lower() == "true"
+SPELLING_VOCABULARY_PATH = os.getenv("SPELLING_VOCABULARY_PATH", "")
+
+# Token and cost ledger (rag_common.ledger): finished requests kept in memory, JSON-lines file they
+# are appended to every LEDGER_FLUSH_SECONDS (empty = memory only), per-request token budget
+# (0 = none) and price overrides in USD per 1K tokens, e.g. "anthropic.claude-3-sonnet-20240229-v1:0=0.003:0.015"
+# or "gpt-4o-mini=0.00015:0.0006" (Module 5)
+LEDGER_BUFFER_SIZE = int(os.getenv("LEDGER_BUFFER_SIZE", "10000"))
+LEDGER_PATH = os.getenv("LEDGER_PATH", "")
+LEDGER_FLUSH_SECONDS = float(os.getenv("LEDGER_FLUSH_SECONDS", "30"))
+LEDGER_PRICES = os.getenv("LEDGER_PRICES", "")
+REQUEST_TOKEN_BUDGET = int(os.getenv("REQUEST_TOKEN_BUDGET", "0"))
+
+# Speculative generation (rag_common.speculative): generate from the context a query retrieved last
+# time while the fresh retrieval runs; contexts remembered per canonical query
+SPECULATIVE_GENERATION = os.getenv("SPECULATIVE_GENERATION", "false").lower() == "true"
+SPECULATIVE_CACHE_SIZE = int(os.getenv("SPECULATIVE_CACHE_SIZE", "10000"))
+
+# Stack-sampling profiler (rag_common.profiler): share of pipeline runs profiled (0 = off, 1 = all,
+# one at a time), sampling interval, output directory and format ("collapsed" or "speedscope"),
+# and the most recent profiles kept in the directory (0 = all)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_FORMAT = os.getenv("PROFILE_FORMAT", "collapsed")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "100"))
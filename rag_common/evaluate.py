@@ -0,0 +1,250 @@
+"""
+Offline evaluation of the retrieval strategies (ex-01 .. ex-06) on recall, cost and latency.
+
+Labelled queries are paraphrases of the ex-00 FAQ questions (synonym swaps, keyword-only and
+conversational rewrites), each labelled with the FAQ answer it should retrieve. Every strategy
+runs its real pipeline function over all queries in parallel, with either:
+
+- mocked backends (default): hashed embeddings, rule-based LLM, exact in-memory Pinecone and
+  simulated latencies. Recall reflects lexical overlap only, so compare strategies relative
+  to each other, and calls/tokens/latency reflect the pipeline's shape.
+- real backends (--backend aws): Bedrock + Pinecone, with every model call cached on disk
+  (--cache-dir) so re-running the evaluation is free.
+
+Per strategy it reports recall@1/3/5 and MRR over the FAQ answers the pipeline retrieved
+(ranked by their best similarity), LLM and embedding calls, tokens and cost per query (at the
+ledger's prices) and latency.
+
+    python -m rag_common.evaluate
+    python -m rag_common.evaluate --strategies direct,fusion,db_routing --json eval.json
+    python -m rag_common.evaluate --backend aws --cache-dir .eval_cache --limit 40
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rag_common import mock_backends
+from rag_common.exercises import load_exercise
+from rag_common.faqs import INDEXES, faq_database, finance_faq, product_faq, tech_faq
+from rag_common.ledger import ledger, metered
+from rag_common.mock_backends import SYNONYMS, CallStats, MockBedrockRuntime, MockPinecone, MockPineconeIndex
+from rag_common.text import tokenize
+
+# name -> (exercise, pipeline function, dataset, measures retrieval)
+STRATEGIES = {
+    "direct": ("ex-01", "rag_chatbot_with_pinecone", "ecommerce", True),
+    "multi_query": ("ex-02", "multi_query_rag_chatbot", "ecommerce", True),
+    "fusion": ("ex-03", "fusion_rag_chatbot", "ecommerce", True),
+    "hyde": ("ex-04", "hypo_chatbot", "ecommerce", True),
+    "prompt_routing": ("ex-05", "prompt_routing_rag", "ecommerce", False),
+    "db_routing": ("ex-06", "routing_rag", "routed", True),
+}
+
+PREFIXES = ["", "I'd like to know: ", "Quick question - ", "Hi, "]
+
+
+def paraphrases(question, rng, per_question=2):
+    """
+    Rewrites of an FAQ question that a user might type instead of the exact wording.
+    """
+    swapped = question
+    for canonical, synonym in SYNONYMS.items():
+        swapped = re.sub(rf"\b{canonical}\b", synonym, swapped, flags=re.I)
+    keywords = " ".join(tokenize(question, stem_words=False)) + "?"
+    variants = [
+        swapped,
+        keywords,
+        rng.choice(PREFIXES[1:]) + swapped[0].lower() + swapped[1:],
+    ]
+    unique = []
+    for variant in variants:
+        if variant != question and variant not in unique:
+            unique.append(variant)
+    return unique[:per_question]
+
+
+def build_dataset(faq_sets, per_question=2, seed=0):
+    """
+    faq_sets: {name: {question: answer}} -> [{"query", "question", "answer", "source"}]
+    """
+    rng = random.Random(seed)
+    dataset = []
+    for source, faq in faq_sets.items():
+        for question, answer in faq.items():
+            for query in paraphrases(question, rng, per_question):
+                dataset.append({"query": query, "question": question, "answer": answer, "source": source})
+    return dataset
+
+
+def rank_of(expected_answer, trace):
+    """
+    1-based rank of the expected answer among the retrieved answers ordered by best score.
+    """
+    best = {}
+    for answer, score in trace:
+        best[answer] = max(score, best.get(answer, float("-inf")))
+    ranked = sorted(best, key=best.get, reverse=True)
+    return ranked.index(expected_answer) + 1 if expected_answer in best else None
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def create_backends(backend, latency_ms, cache_dir, stats):
+    """
+    Returns (bedrock_runtime, pinecone_factory) for load_exercise.
+    """
+    if backend == "mock":
+        embed_ms, retrieve_ms, llm_ms = latency_ms
+        indexes = {name: MockPineconeIndex.from_faq(faq, latency_ms=retrieve_ms) for name, faq in INDEXES.items()}
+        return metered(MockBedrockRuntime({"embed": embed_ms, "llm": llm_ms}, stats)), MockPinecone(indexes)
+
+    from pinecone import Pinecone
+
+    from rag_common.bedrock import create_bedrock_runtime
+
+    class TracingPinecone:
+        def __init__(self, api_key=None, **kwargs):
+            self.pc = Pinecone(api_key=api_key, **kwargs)
+
+        def Index(self, name):
+            return mock_backends.TracingIndex(self.pc.Index(name))
+
+    return mock_backends.CachingBedrockRuntime(create_bedrock_runtime(), cache_dir, stats), TracingPinecone
+
+
+def evaluate_strategy(name, pipeline, dataset, measures_retrieval, stats, workers):
+    stats.reset()
+
+    def run_one(item):
+        mock_backends.start_trace()
+        started = time.perf_counter()
+        error = None
+        try:
+            pipeline(item["query"])
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        latency = time.perf_counter() - started
+        return latency, rank_of(item["answer"], mock_backends.end_trace()), error
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_one, dataset))
+    wall = time.perf_counter() - started
+
+    n = len(results)
+    latencies = sorted(latency for latency, _, _ in results)
+    calls = stats.snapshot()
+    llm_calls = sum(c["calls"] for model, c in calls.items() if "embed" not in model)
+    embed_calls = sum(c["calls"] for model, c in calls.items() if "embed" in model)
+    tokens = sum(c["input_tokens"] + c["output_tokens"] for c in calls.values())
+    cost = sum(ledger.cost(model, c["input_tokens"], c["output_tokens"]) for model, c in calls.items())
+    ranks = [rank for _, rank, _ in results]
+
+    summary = {
+        "strategy": name,
+        "queries": n,
+        "errors": sum(1 for _, _, error in results if error),
+        "recall@1": None, "recall@3": None, "recall@5": None, "mrr": None,
+        "llm_calls_per_query": llm_calls / n,
+        "embed_calls_per_query": embed_calls / n,
+        "tokens_per_query": tokens / n,
+        "cost_per_1k_queries_usd": 1000 * cost / n,
+        "latency_mean_ms": 1000 * sum(latencies) / n,
+        "latency_p50_ms": 1000 * percentile(latencies, 50),
+        "latency_p95_ms": 1000 * percentile(latencies, 95),
+        "throughput_qps": n / wall if wall else 0.0,
+        "models": calls,
+        "sample_errors": sorted({error for _, _, error in results if error})[:3],
+    }
+    if measures_retrieval:
+        for k in (1, 3, 5):
+            summary[f"recall@{k}"] = sum(1 for rank in ranks if rank and rank <= k) / n
+        summary["mrr"] = sum(1 / rank for rank in ranks if rank) / n
+    return summary
+
+
+def print_table(summaries):
+    columns = [("strategy", "{:<15}"), ("recall@1", "{:>8}"), ("recall@3", "{:>8}"), ("recall@5", "{:>8}"),
+               ("mrr", "{:>6}"), ("llm_calls_per_query", "{:>9}"), ("embed_calls_per_query", "{:>9}"),
+               ("tokens_per_query", "{:>10}"), ("cost_per_1k_queries_usd", "{:>8}"), ("latency_p50_ms", "{:>9}"),
+               ("latency_p95_ms", "{:>9}"), ("errors", "{:>6}")]
+    headers = ["strategy", "R@1", "R@3", "R@5", "MRR", "LLM/q", "embed/q", "tokens/q", "$/1K q", "p50 ms", "p95 ms",
+               "errors"]
+    print(" ".join(fmt.format(header) for (_, fmt), header in zip(columns, headers)))
+    for summary in summaries:
+        cells = []
+        for key, fmt in columns:
+            value = summary[key]
+            if value is None:
+                value = "n/a"
+            elif isinstance(value, float):
+                value = f"{value:.2f}" if key.startswith(("recall", "mrr", "llm", "embed", "cost")) else f"{value:.0f}"
+            cells.append(fmt.format(value))
+        print(" ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the retrieval strategies on recall, cost and latency")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES), help="Comma-separated subset of strategies")
+    parser.add_argument("--backend", choices=["mock", "aws"], default="mock")
+    parser.add_argument("--cache-dir", default=".eval_cache", help="Disk cache for model calls (--backend aws)")
+    parser.add_argument("--mock-latency-ms", default="25,30,350", help="embed,retrieve,llm latency of the mocks")
+    parser.add_argument("--paraphrases", type=int, default=2, help="Paraphrased queries per FAQ question")
+    parser.add_argument("--limit", type=int, help="Evaluate at most this many queries per strategy")
+    parser.add_argument("--workers", type=int, default=16, help="Queries evaluated in parallel")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write the per-strategy results to this file")
+    parser.add_argument("--verbose", action="store_true", help="Keep the pipelines' debug output")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.strategies.split(",") if name.strip()]
+    unknown = [name for name in names if name not in STRATEGIES]
+    if unknown:
+        parser.error(f"unknown strategies {unknown}, expected some of {list(STRATEGIES)}")
+
+    stats = CallStats()
+    latency_ms = [float(x) for x in args.mock_latency_ms.split(",")]
+    bedrock_runtime, pinecone_factory = create_backends(args.backend, latency_ms, args.cache_dir, stats)
+
+    datasets = {
+        "ecommerce": build_dataset({"faq_database": faq_database}, args.paraphrases, args.seed),
+        "routed": build_dataset({"product": product_faq, "finance": finance_faq, "tech": tech_faq},
+                                args.paraphrases, args.seed),
+    }
+    if args.limit:
+        datasets = {name: random.Random(args.seed).sample(items, min(args.limit, len(items)))
+                    for name, items in datasets.items()}
+
+    summaries = []
+    for name in names:
+        exercise, function, dataset, measures_retrieval = STRATEGIES[name]
+        module = load_exercise(exercise, bedrock_runtime=bedrock_runtime, pinecone_factory=pinecone_factory)
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            summary = evaluate_strategy(name, getattr(module, function), datasets[dataset],
+                                        measures_retrieval, stats, args.workers)
+        summaries.append(summary)
+        print(f"Evaluated {name} on {summary['queries']} queries ({summary['errors']} errors)")
+
+    print()
+    print_table(summaries)
+    for summary in summaries:
+        for error in summary["sample_errors"]:
+            print(f"{summary['strategy']}: {error}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"backend": args.backend, "strategies": summaries}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import glob
+import importlib.util
+import os
+from unittest import mock
+
+import rag_common.bedrock
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def exercise_path(prefix):
+    """
+    Resolves "ex-03" (or "ex-03-fusion-rag.py") to the exercise script in the repository root.
+    """
+    matches = sorted(glob.glob(os.path.join(REPO_ROOT, f"{prefix.replace('.py', '')}*.py")))
+    if not matches:
+        raise FileNotFoundError(f"No exercise matching {prefix}")
+    return matches[0]
+
+
+def load_exercise(prefix, bedrock_runtime=None, pinecone_factory=None):
+    """
+    Imports an ex-*.py script as a module (their file names are not valid module names).
+
+    bedrock_runtime / pinecone_factory replace the clients the script creates at import time,
+    which lets the exercises run offline against mocked backends.
+    """
+    path = exercise_path(prefix)
+    name = os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+
+    patches = []
+    if bedrock_runtime is not None:
+        patches.append(mock.patch.object(rag_common.bedrock, "create_bedrock_runtime", lambda *a, **k: bedrock_runtime))
+    if pinecone_factory is not None:
+        patches.append(mock.patch("pinecone.Pinecone", pinecone_factory, create=True))
+
+    for patch in patches:
+        patch.start()
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        for patch in reversed(patches):
+            patch.stop()
+    return module
@@ -0,0 +1,420 @@
+"""
+Streaming ingestion of long-form documents (Markdown, HTML, text, PDF) into a Pinecone index.
+
+    readers -> chunker -> dedupe -> batched embed -> batched upsert
+
+Every stage is a generator and at most `max_in_flight` documents are parsed ahead, so the text
+in memory stays bounded regardless of the corpus size; the dedupe set costs 8 bytes per stored
+chunk. Parsing runs in a process pool. A checkpoint log records finished documents and the
+hashes of the stored chunks (appended after every batch, compacted at the end of a run), so a
+crashed run resumes where it stopped; chunk ids are deterministic, so re-upserting a half-done
+document is harmless.
+
+Chunks are stored with the same metadata layout as the FAQ entries ("question" / "answer"), so
+retrieve_faq and friends work unchanged:
+
+    python -m rag_common.ingest docs/ --index ecommerce-index --category course
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from html.parser import HTMLParser
+
+import numpy as np
+
+SUPPORTED_EXTENSIONS = {".md", ".markdown", ".txt", ".html", ".htm", ".pdf"}
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])|\n\s*\n")
+
+
+# --- Readers -------------------------------------------------------------------------------------
+
+class _HTMLTextExtractor(HTMLParser):
+    SKIP_TAGS = {"script", "style", "nav", "footer", "header", "noscript"}
+    BLOCK_TAGS = {"p", "div", "section", "article", "li", "br", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.title = None
+        self.skip_depth = 0
+        self.current_tag = None
+
+    def handle_starttag(self, tag, attrs):
+        self.current_tag = tag
+        if tag in self.SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        if self.current_tag in ("title", "h1") and not self.title and data.strip():
+            self.title = data.strip()
+        if not self.skip_depth and self.current_tag != "title":
+            self.parts.append(data)
+
+
+def read_html(path):
+    extractor = _HTMLTextExtractor()
+    with open(path, encoding="utf-8", errors="replace") as f:
+        extractor.feed(f.read())
+    return extractor.title, "".join(extractor.parts)
+
+
+def read_markdown(path):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    title = next((line.lstrip("#").strip() for line in text.splitlines() if line.startswith("# ")), None)
+    text = re.sub(r"```.*?```", "", text, flags=re.S)            # code blocks
+    text = re.sub(r"!\[[^\]]*\]\([^)]*\)", "", text)              # images
+    text = re.sub(r"\[([^\]]+)\]\([^)]*\)", r"\1", text)          # links -> link text
+    text = re.sub(r"^\s{0,3}#{1,6}\s*", "", text, flags=re.M)     # heading markers
+    text = re.sub(r"[*_`>]", "", text)
+    return title, text
+
+
+def read_pdf(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError as e:
+        raise ImportError("PDF ingestion needs `pip install pypdf`") from e
+    reader = PdfReader(path)
+    title = (reader.metadata.title if reader.metadata else None) or None
+    return title, "\n\n".join(page.extract_text() or "" for page in reader.pages)
+
+
+def read_text(path):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return None, f.read()
+
+
+READERS = {
+    ".md": read_markdown,
+    ".markdown": read_markdown,
+    ".html": read_html,
+    ".htm": read_html,
+    ".pdf": read_pdf,
+    ".txt": read_text,
+}
+
+
+def iter_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS:
+                        yield os.path.join(root, name)
+        elif os.path.splitext(path)[1].lower() in SUPPORTED_EXTENSIONS:
+            yield path
+
+
+def parse_document(path):
+    """
+    Reads one file into {"source", "title", "text"} (runs in a worker process).
+    """
+    title, text = READERS[os.path.splitext(path)[1].lower()](path)
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r"\n\s*\n\s*", "\n\n", text).strip()
+    return {"source": path, "title": title or os.path.splitext(os.path.basename(path))[0], "text": text}
+
+
+def bounded_map(executor, fn, items, max_in_flight):
+    """
+    Like executor.map, but never submits more than max_in_flight items ahead of the consumer.
+    """
+    pending = []
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_in_flight:
+            yield pending.pop(0).result()
+    for future in pending:
+        yield future.result()
+
+
+# --- Chunker -------------------------------------------------------------------------------------
+
+def count_tokens(text):
+    # Word / punctuation pieces, a close enough proxy for the Titan tokenizer
+    return len(TOKEN_RE.findall(text))
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_RE.split(text) if sentence and sentence.strip()]
+
+
+def _split_long_sentence(sentence, max_tokens):
+    words = sentence.split()
+    step = max(1, int(max_tokens * 0.75))  # words tokenize into slightly more than one token
+    for start in range(0, len(words), step):
+        yield " ".join(words[start:start + step])
+
+
+def chunk_text(text, max_tokens=300, overlap_tokens=50):
+    """
+    Packs whole sentences into chunks of at most ~max_tokens, repeating the trailing
+    sentences (up to overlap_tokens) at the start of the next chunk.
+    """
+    sentences = []
+    for sentence in split_sentences(text):
+        if count_tokens(sentence) > max_tokens:
+            sentences.extend(_split_long_sentence(sentence, max_tokens))
+        else:
+            sentences.append(sentence)
+
+    current, current_tokens = [], 0
+    for sentence in sentences:
+        tokens = count_tokens(sentence)
+        if current and current_tokens + tokens > max_tokens:
+            yield " ".join(current)
+            overlap, overlap_count = [], 0
+            for previous in reversed(current):
+                overlap_count += count_tokens(previous)
+                if overlap_count > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+            current, current_tokens = overlap, sum(count_tokens(s) for s in overlap)
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        yield " ".join(current)
+
+
+def chunk_hash(text):
+    return hashlib.sha1(" ".join(text.lower().split()).encode("utf-8")).hexdigest()
+
+
+# --- Checkpoint ----------------------------------------------------------------------------------
+
+class ChunkHashes:
+    """
+    Set of chunk hashes kept as 64-bit keys: a sorted uint64 array (8 bytes per chunk) plus a
+    set of recent additions, merged into the array every `merge_every` additions.
+    """
+
+    def __init__(self, merge_every=100_000):
+        self.sorted = np.empty(0, dtype=np.uint64)
+        self.recent = set()
+        self.merge_every = merge_every
+
+    @staticmethod
+    def key(digest):
+        return int(digest[:16], 16)
+
+    def _merge(self):
+        if self.recent:
+            recent = np.fromiter(self.recent, dtype=np.uint64, count=len(self.recent))
+            self.sorted = np.union1d(self.sorted, recent)
+            self.recent.clear()
+
+    def __contains__(self, digest):
+        key = self.key(digest)
+        if key in self.recent:
+            return True
+        i = np.searchsorted(self.sorted, np.uint64(key))
+        return bool(i < len(self.sorted) and self.sorted[i] == key)
+
+    def add(self, digest):
+        self.recent.add(self.key(digest))
+        if len(self.recent) >= self.merge_every:
+            self._merge()
+
+    def __len__(self):
+        self._merge()
+        return len(self.sorted)
+
+    def hex_keys(self):
+        self._merge()
+        return [f"{int(key):016x}" for key in self.sorted]
+
+
+class Checkpoint:
+    """
+    Append-only JSON-lines log: {"document": path, "mtime": ...} per finished document and
+    {"chunks": [...]} with the hashes of each upserted batch, so saving after a batch writes only
+    that batch. compact() rewrites the log as a single {"documents", "chunks"} line. Checkpoints
+    written as one JSON object ({"documents", "chunk_hashes"}) are read too.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.documents = {}
+        self.chunk_hashes = ChunkHashes()
+        self.unsaved_documents = {}
+        self.unsaved_chunks = []
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        damaged = False
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn line of a run that crashed while appending
+                    damaged = True
+                    continue
+                self.documents.update(entry.get("documents", {}))
+                if "document" in entry:
+                    self.documents[entry["document"]] = entry["mtime"]
+                for digest in entry.get("chunks", entry.get("chunk_hashes", [])):
+                    self.chunk_hashes.add(digest)
+        if damaged:
+            self.compact()
+
+    def is_done(self, source):
+        return self.documents.get(source) == os.path.getmtime(source)
+
+    def mark_done(self, source):
+        self.documents[source] = self.unsaved_documents[source] = os.path.getmtime(source)
+
+    def mark_stored(self, digest):
+        """
+        Records a chunk whose vector was upserted (it reaches the log at the next save).
+        """
+        self.unsaved_chunks.append(f"{ChunkHashes.key(digest):016x}")
+
+    def save(self):
+        if not self.path:
+            return
+        lines = []
+        if self.unsaved_chunks:
+            lines.append(json.dumps({"chunks": self.unsaved_chunks}))
+        lines += [json.dumps({"document": source, "mtime": mtime}) for source, mtime in self.unsaved_documents.items()]
+        if lines:
+            with open(self.path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+        self.unsaved_chunks = []
+        self.unsaved_documents = {}
+
+    def compact(self):
+        """
+        Rewrites the log as one line (superseded document entries dropped).
+        """
+        if not self.path:
+            return
+        self.save()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"documents": self.documents, "chunks": self.chunk_hashes.hex_keys()}, f)
+            f.write("\n")
+        os.replace(tmp_path, self.path)
+
+
+# --- Pipeline ------------------------------------------------------------------------------------
+
+def iter_chunk_records(documents, checkpoint, max_tokens, overlap_tokens, category=None):
+    """
+    Yields (record, source, is_last, digest) for every new chunk; records have no vector yet.
+    Documents whose chunks are all duplicates are marked done right away.
+    """
+    # Hashes seen in this run join the dedupe set right away; only upserted ones reach the log
+    seen = checkpoint.chunk_hashes
+    for document in documents:
+        doc_id = hashlib.sha1(document["source"].encode("utf-8")).hexdigest()[:16]
+        records = []
+        for i, chunk in enumerate(chunk_text(document["text"], max_tokens, overlap_tokens)):
+            digest = chunk_hash(chunk)
+            if digest in seen:
+                continue
+            seen.add(digest)
+            metadata = {"question": document["title"], "answer": chunk, "source": document["source"], "chunk": i}
+            if category:
+                metadata["category"] = category
+            records.append(({"id": f"{doc_id}-{i}", "metadata": metadata}, digest))
+
+        if not records:
+            checkpoint.mark_done(document["source"])
+            continue
+        for j, (record, digest) in enumerate(records):
+            yield record, document["source"], j == len(records) - 1, digest
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ingest(paths, index_db, embed, namespace="ns1", category=None, checkpoint_path=None,
+           max_tokens=300, overlap_tokens=50, batch_size=64, embed_workers=8, parse_workers=None,
+           max_in_flight=16):
+    """
+    Runs the whole pipeline; `embed` maps one text to its vector. Returns the number of upserted chunks.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    todo = (path for path in iter_paths(paths) if not checkpoint.is_done(path))
+    upserted = 0
+
+    with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+            ThreadPoolExecutor(max_workers=embed_workers) as embed_pool:
+        documents = bounded_map(parse_pool, parse_document, todo, max_in_flight)
+        records = iter_chunk_records(documents, checkpoint, max_tokens, overlap_tokens, category)
+
+        for batch in batched(records, batch_size):
+            vectors = list(embed_pool.map(embed, [record["metadata"]["answer"] for record, _, _, _ in batch]))
+            index_db.upsert(
+                vectors=[{**record, "values": vector.tolist()} for (record, _, _, _), vector in zip(batch, vectors)],
+                namespace=namespace
+            )
+            upserted += len(batch)
+            for _, source, is_last, digest in batch:
+                checkpoint.mark_stored(digest)
+                if is_last:
+                    checkpoint.mark_done(source)
+            checkpoint.save()
+            print(f"Upserted {upserted} chunks")
+
+    checkpoint.compact()
+    return upserted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunk, embed and upsert long-form documents into Pinecone")
+    parser.add_argument("paths", nargs="+", help="Files or directories (.md, .html, .txt, .pdf)")
+    parser.add_argument("--index", required=True, help="Pinecone index name")
+    parser.add_argument("--namespace", default="ns1")
+    parser.add_argument("--category", help="Value of the 'category' metadata field")
+    parser.add_argument("--checkpoint", default=".ingest_checkpoint.json")
+    parser.add_argument("--max-tokens", type=int, default=300)
+    parser.add_argument("--overlap-tokens", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--embed-workers", type=int, default=8)
+    args = parser.parse_args()
+
+    from pinecone import Pinecone
+
+    from rag_common.bedrock import create_bedrock_runtime
+    from rag_common.embeddings import embed_text
+
+    bedrock_runtime = create_bedrock_runtime()
+    index_db = Pinecone(api_key=os.environ.get("PINECONE_API_KEY")).Index(args.index)
+    total = ingest(
+        args.paths, index_db, lambda text: embed_text(bedrock_runtime, text),
+        namespace=args.namespace, category=args.category, checkpoint_path=args.checkpoint,
+        max_tokens=args.max_tokens, overlap_tokens=args.overlap_tokens,
+        batch_size=args.batch_size, embed_workers=args.embed_workers,
+    )
+    print(f"Ingestion finished: {total} new chunks in {args.index}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+"""
+Token and cost ledger for every model call.
+
+MeteredBedrockRuntime wraps a bedrock-runtime client (create_bedrock_runtime returns one) and
+reads the usage each response reports: Claude "usage", OpenAI-format "usage", Titan
+"inputTextTokenCount" and the invocation metrics at the end of a response stream. Every call is
+charged to:
+
+- the current request, opened with ledger.request(pipeline, budget). Pipeline.execute opens
+  one per run named after the pipeline; a scope opened inside another one joins it, so a
+  caller can wrap several pipeline runs into one request;
+- running totals per pipeline and per model.
+
+Callers of other model APIs record their calls themselves with ledger.record() (Module 5 records
+the OpenAI usage). A call serving several requests (a micro-batched embeddings call) is recorded
+in the totals only (usage=None) and each request is charged its share with ledger.charge_share().
+
+Finished requests are kept in a ring buffer of LEDGER_BUFFER_SIZE records and appended to
+LEDGER_PATH (JSON lines) every LEDGER_FLUSH_SECONDS and at exit. Once a request has used its
+token budget (REQUEST_TOKEN_BUDGET, 0 = none) its next model call raises TokenBudgetExceeded,
+and the max_tokens of every generation is capped to the tokens it has left.
+
+    python -m rag_common.ledger ledger.jsonl    # per pipeline / per model totals of a flushed ledger
+"""
+import argparse
+import atexit
+import contextlib
+import contextvars
+import io
+import json
+import re
+import threading
+import time
+import uuid
+from collections import deque
+
+from rag_common.config import (
+    LEDGER_BUFFER_SIZE,
+    LEDGER_FLUSH_SECONDS,
+    LEDGER_PATH,
+    LEDGER_PRICES,
+    REQUEST_TOKEN_BUDGET,
+)
+
+# On-demand USD per 1K (input, output) tokens, override with LEDGER_PRICES
+DEFAULT_PRICES = {
+    "amazon.titan-embed-text-v1": (0.0001, 0.0),
+    "amazon.titan-embed-text-v2:0": (0.00002, 0.0),
+    "anthropic.claude-3-haiku-20240307-v1:0": (0.00025, 0.00125),
+    "anthropic.claude-3-sonnet-20240229-v1:0": (0.003, 0.015),
+    "openai.gpt-oss-20b-1:0": (0.00007, 0.0003),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "text-embedding-3-small": (0.00002, 0.0),
+}
+
+# Usage fields of the response formats above. Usage comes last in every one of them, so only the
+# tail of a body is searched (an embedding body is mostly the vector)
+INPUT_KEYS = (b"input_tokens", b"prompt_tokens", b"inputTextTokenCount", b"inputTokenCount")
+OUTPUT_KEYS = (b"output_tokens", b"completion_tokens", b"outputTokenCount")
+USAGE_RE = re.compile(rb'"(' + b"|".join(INPUT_KEYS + OUTPUT_KEYS) + rb')"\s*:\s*(\d+)')
+USAGE_TAIL_BYTES = 1024
+
+# Request body fields bounding the generated tokens
+MAX_TOKEN_FIELDS = ("max_tokens", "max_completion_tokens", "max_gen_len")
+
+COUNTERS = ("calls", "input_tokens", "output_tokens", "embeddings", "cost_usd")
+
+# Default of record(usage=...): the request of the caller's context
+CURRENT = object()
+
+
+class TokenBudgetExceeded(RuntimeError):
+    pass
+
+
+def parse_prices(spec):
+    """
+    Parses "model=input:output,..." (USD per 1K tokens) into {model: (input, output)}.
+    """
+    prices = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model_id, rate = item.rsplit("=", 1)
+        input_price, _, output_price = rate.partition(":")
+        prices[model_id.strip()] = (float(input_price), float(output_price or 0))
+    return prices
+
+
+def usage_from_body(data):
+    """
+    (input tokens, output tokens, embeddings) reported by a model response body.
+    """
+    usage = {}
+    for match in USAGE_RE.finditer(data, max(0, len(data) - USAGE_TAIL_BYTES)):
+        usage[match.group(1)] = int(match.group(2))
+    input_tokens = next((usage[key] for key in INPUT_KEYS if key in usage), 0)
+    output_tokens = next((usage[key] for key in OUTPUT_KEYS if key in usage), 0)
+    return input_tokens, output_tokens, int(b"inputTextTokenCount" in usage)
+
+
+def empty_counters():
+    return dict.fromkeys(COUNTERS, 0)
+
+
+def add_counters(counters, input_tokens, output_tokens, embeddings, cost, calls=1):
+    counters["calls"] += calls
+    counters["input_tokens"] += input_tokens
+    counters["output_tokens"] += output_tokens
+    counters["embeddings"] += embeddings
+    counters["cost_usd"] += cost
+
+
+class RequestUsage:
+    """
+    Model usage of one request, in total and per model.
+    """
+
+    def __init__(self, pipeline, budget=0):
+        self.id = uuid.uuid4().hex[:12]
+        self.pipeline = pipeline
+        self.budget = budget
+        self.started_at = time.time()
+        self.seconds = None
+        self.totals = empty_counters()
+        self.by_model = {}
+        self.lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        return self.totals["input_tokens"] + self.totals["output_tokens"]
+
+    def remaining(self):
+        """
+        Tokens left in the budget, None without a budget.
+        """
+        return self.budget - self.tokens if self.budget else None
+
+    def add(self, model_id, input_tokens, output_tokens, embeddings, cost, calls=1):
+        with self.lock:
+            add_counters(self.totals, input_tokens, output_tokens, embeddings, cost, calls)
+            add_counters(self.by_model.setdefault(model_id, empty_counters()),
+                         input_tokens, output_tokens, embeddings, cost, calls)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "request_id": self.id,
+                "pipeline": self.pipeline,
+                "started_at": round(self.started_at, 3),
+                "seconds": round(self.seconds, 4) if self.seconds is not None else None,
+                **self.totals,
+                "cost_usd": round(self.totals["cost_usd"], 8),
+                "budget": self.budget or None,
+                "by_model": {model: dict(counters, cost_usd=round(counters["cost_usd"], 8))
+                             for model, counters in self.by_model.items()},
+            }
+
+
+class Ledger:
+    def __init__(self, path=LEDGER_PATH, buffer_size=LEDGER_BUFFER_SIZE, flush_seconds=LEDGER_FLUSH_SECONDS,
+                 prices=None, budget=REQUEST_TOKEN_BUDGET):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.prices = {**DEFAULT_PRICES, **parse_prices(LEDGER_PRICES)} if prices is None else prices
+        self.budget = budget
+        self.current = contextvars.ContextVar("ledger_request", default=None)
+        self.records = deque(maxlen=buffer_size)  # the most recent finished requests
+        self.unflushed = deque(maxlen=buffer_size)  # finished requests not written to `path` yet
+        self.dropped = 0
+        self.pipelines = {}
+        self.models = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flusher = None
+        self.stopped = threading.Event()
+        atexit.register(self.close)
+
+    def cost(self, model_id, input_tokens, output_tokens):
+        input_price, output_price = self.prices.get(model_id, (0.0, 0.0))
+        return (input_tokens * input_price + output_tokens * output_price) / 1000
+
+    @contextlib.contextmanager
+    def request(self, pipeline, budget=None):
+        """
+        Scope whose model calls are charged to one RequestUsage (yielded). Inside an open scope
+        it yields that one instead.
+        """
+        usage = self.current.get()
+        if usage is not None:
+            yield usage
+            return
+        usage = RequestUsage(pipeline, self.budget if budget is None else budget)
+        token = self.current.set(usage)
+        started = time.perf_counter()
+        try:
+            yield usage
+        finally:
+            self.current.reset(token)
+            usage.seconds = time.perf_counter() - started
+            self.finish(usage)
+
+    def finish(self, usage):
+        with self.lock:
+            self.records.append(usage)
+            if self.path:
+                if len(self.unflushed) == self.unflushed.maxlen:
+                    self.dropped += 1
+                self.unflushed.append(usage)
+                if self.flusher is None:
+                    self.flusher = threading.Thread(target=self._flush_periodically, name="ledger-flush", daemon=True)
+                    self.flusher.start()
+
+    def record(self, model_id, input_tokens=0, output_tokens=0, embeddings=0, usage=CURRENT):
+        """
+        Charges one model call to `usage` (default: the current request, None: no request) and
+        the running totals. Returns its cost in USD.
+        """
+        usage = self.current.get() if usage is CURRENT else usage
+        cost = self.cost(model_id, input_tokens, output_tokens)
+        if usage is not None:
+            usage.add(model_id, input_tokens, output_tokens, embeddings, cost)
+        pipeline = usage.pipeline if usage is not None else "-"
+        with self.lock:
+            add_counters(self.pipelines.setdefault(pipeline, empty_counters()),
+                         input_tokens, output_tokens, embeddings, cost)
+            add_counters(self.models.setdefault(model_id, empty_counters()),
+                         input_tokens, output_tokens, embeddings, cost)
+        return cost
+
+    def charge_share(self, model_id, input_tokens, embeddings=1):
+        """
+        Charges the current request its share of a call already recorded in the totals
+        (a batched embeddings call).
+        """
+        usage = self.current.get()
+        if usage is not None:
+            usage.add(model_id, input_tokens, 0, embeddings, self.cost(model_id, input_tokens, 0), calls=0)
+
+    def check_budget(self, usage=CURRENT):
+        """
+        Tokens the request has left (None without a budget), TokenBudgetExceeded if none.
+        """
+        usage = self.current.get() if usage is CURRENT else usage
+        remaining = usage.remaining() if usage is not None else None
+        if remaining is not None and remaining <= 0:
+            raise TokenBudgetExceeded(f"Request {usage.id} ({usage.pipeline}) used {usage.tokens} "
+                                      f"of its {usage.budget} token budget")
+        return remaining
+
+    def totals(self):
+        """
+        {"pipelines": {name: counters}, "models": {model: counters}, "requests": finished requests in memory}
+        """
+        with self.lock:
+            return {
+                "pipelines": {name: dict(counters) for name, counters in self.pipelines.items()},
+                "models": {name: dict(counters) for name, counters in self.models.items()},
+                "requests": len(self.records),
+            }
+
+    def recent(self, n=20):
+        with self.lock:
+            records = list(self.records)[-n:]
+        return [usage.summary() for usage in records]
+
+    def flush(self):
+        """
+        Appends the requests finished since the last flush to `path`.
+        """
+        if not self.path:
+            return 0
+        with self.flush_lock:
+            with self.lock:
+                records, dropped = list(self.unflushed), self.dropped
+                self.unflushed.clear()
+                self.dropped = 0
+            if dropped:
+                print(f"DEBUG - Ledger buffer full, {dropped} requests were not written to {self.path}")
+            if not records:
+                return 0
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(usage.summary()) + "\n" for usage in records))
+            return len(records)
+
+    def _flush_periodically(self):
+        while not self.stopped.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"DEBUG - Ledger flush to {self.path} failed: {e}")
+
+    def close(self):
+        self.stopped.set()
+        self.flush()
+
+
+ledger = Ledger()
+
+
+class MeteredBedrockRuntime:
+    """
+    Records the usage of every invoke_model / invoke_model_with_response_stream call in the
+    ledger and enforces the current request's token budget. Any other attribute is forwarded
+    to the wrapped client.
+    """
+
+    def __init__(self, client, ledger=ledger):
+        self._client = client
+        self.ledger = ledger
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _limit(self, usage, kwargs):
+        # Before the call: fail a request over its budget, cap the output to what is left
+        remaining = self.ledger.check_budget(usage)
+        if remaining is None or "body" not in kwargs:
+            return kwargs
+        body = json.loads(kwargs["body"])
+        capped = {field: min(body[field], remaining) for field in MAX_TOKEN_FIELDS
+                  if isinstance(body.get(field), int) and body[field] > remaining}
+        if not capped:
+            return kwargs
+        return dict(kwargs, body=json.dumps({**body, **capped}))
+
+    def invoke_model(self, **kwargs):
+        usage = self.ledger.current.get()
+        response = self._client.invoke_model(**self._limit(usage, kwargs))
+        data = response["body"].read()
+        self.ledger.record(kwargs.get("modelId"), *usage_from_body(data), usage=usage)
+        return dict(response, body=io.BytesIO(data))
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        usage = self.ledger.current.get()
+        response = self._client.invoke_model_with_response_stream(**self._limit(usage, kwargs))
+        return dict(response, body=self._metered_events(response["body"], kwargs.get("modelId"), usage))
+
+    def _metered_events(self, events, model_id, usage):
+        # The stream may be consumed after the request scope closed, so it is charged explicitly
+        counts = (0, 0, 0)
+        try:
+            for event in events:
+                chunk = event.get("chunk")
+                if chunk and b"TokenCount" in chunk["bytes"]:
+                    counts = usage_from_body(chunk["bytes"])
+                yield event
+        finally:
+            self.ledger.record(model_id, *counts, usage=usage)
+
+
+def metered(client):
+    return client if isinstance(client, MeteredBedrockRuntime) else MeteredBedrockRuntime(client)
+
+
+def summarize_file(path):
+    """
+    Per pipeline and per model totals of the request records in a flushed ledger file.
+    """
+    pipelines, models = {}, {}
+    requests = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            requests += 1
+            pipeline = pipelines.setdefault(record["pipeline"], dict(empty_counters(), requests=0))
+            pipeline["requests"] += 1
+            for model_id, counters in record["by_model"].items():
+                for target in (pipeline, models.setdefault(model_id, empty_counters())):
+                    for key in COUNTERS:
+                        target[key] += counters[key]
+    return requests, pipelines, models
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token and cost totals of a flushed ledger file")
+    parser.add_argument("path", nargs="?", default=LEDGER_PATH or "ledger.jsonl")
+    args = parser.parse_args()
+
+    requests, pipelines, models = summarize_file(args.path)
+    print(f"{requests} requests in {args.path}\n")
+    print(f"{'pipeline':<18} {'requests':>9} {'calls/req':>9} {'in tok/req':>10} {'out tok/req':>11} {'$/1K req':>9}")
+    for name, c in sorted(pipelines.items(), key=lambda item: -item[1]["cost_usd"]):
+        n = c["requests"]
+        print(f"{name:<18} {n:>9} {c['calls'] / n:>9.2f} {c['input_tokens'] / n:>10.1f} "
+              f"{c['output_tokens'] / n:>11.1f} {1000 * c['cost_usd'] / n:>9.3f}")
+    print(f"\n{'model':<42} {'calls':>8} {'input tok':>10} {'output tok':>10} {'embeddings':>10} {'USD':>10}")
+    for name, c in sorted(models.items(), key=lambda item: -item[1]["cost_usd"]):
+        print(f"{name:<42} {c['calls']:>8} {c['input_tokens']:>10} {c['output_tokens']:>10} "
+              f"{c['embeddings']:>10} {c['cost_usd']:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Metadata filters for the local vector store, using the Pinecone filter syntax:
+
+    {"category": "finance"}                                   implicit $eq
+    {"language": {"$in": ["en", "pt"]}}
+    {"updated_at": {"$gte": 1704067200}}
+    {"$and": [{"category": "product"}, {"product_line": {"$ne": "legacy"}}]}
+
+MetadataIndex keeps an inverted index of the filterable fields (METADATA_FILTER_FIELDS): a
+sorted array of row numbers per value, and for numeric fields the rows sorted by value, so a
+range is two binary searches. A filter is resolved with set operations on row arrays, and the
+vector scan only touches the matching rows. Free-text fields (question, answer) are not
+indexed; filtering on them raises ValueError.
+"""
+import numpy as np
+
+from rag_common.config import METADATA_FILTER_FIELDS
+
+RANGES = ("$gt", "$gte", "$lt", "$lte")
+
+EMPTY = np.empty(0, dtype=np.int64)
+
+
+def _hashable(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def product_line(question):
+    """
+    Product line of an FAQ entry: "ebooks", "courses" or "general".
+    """
+    text = question.lower()
+    if "e-book" in text or "ebook" in text:
+        return "ebooks"
+    if "course" in text:
+        return "courses"
+    return "general"
+
+
+class MetadataIndex:
+    """
+    Inverted index over the filterable fields of a list of metadata dicts (one per vector row).
+    """
+
+    def __init__(self, metadata, fields=METADATA_FILTER_FIELDS):
+        self.count = len(metadata)
+        self.fields = set(fields)
+        postings = {field: {} for field in self.fields}
+        numbers = {field: ([], []) for field in self.fields}  # field -> (numeric values, their rows)
+        for row, entry in enumerate(metadata):
+            for field in self.fields.intersection(entry):
+                value = entry[field]
+                # List values match any of their elements, like Pinecone
+                for v in (value if isinstance(value, list) else [value]):
+                    postings[field].setdefault(_hashable(v), []).append(row)
+                    if _is_number(v):
+                        numbers[field][0].append(v)
+                        numbers[field][1].append(row)
+
+        # field -> value -> sorted rows; field -> (numeric values ascending, their rows)
+        self.postings = {
+            field: {value: np.asarray(rows, dtype=np.int64) for value, rows in values.items()}
+            for field, values in postings.items()
+        }
+        self.ranges = {}
+        for field, (values, rows) in numbers.items():
+            values = np.asarray(values, dtype=np.float64)
+            order = np.argsort(values, kind="stable")
+            self.ranges[field] = (values[order], np.asarray(rows, dtype=np.int64)[order])
+
+    def _all(self):
+        return np.arange(self.count, dtype=np.int64)
+
+    def _range_rows(self, field, op, operand):
+        values, rows = self.ranges[field]
+        if op in ("$gt", "$gte"):
+            start = np.searchsorted(values, operand, side="right" if op == "$gt" else "left")
+            selected = rows[start:]
+        else:
+            end = np.searchsorted(values, operand, side="left" if op == "$lt" else "right")
+            selected = rows[:end]
+        return np.unique(selected)
+
+    def _field_rows(self, field, condition):
+        if field not in self.fields:
+            raise ValueError(f"Metadata field {field} is not filterable (indexed: {sorted(self.fields)})")
+        postings = self.postings[field]
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+
+        rows = None
+        for op, operand in condition.items():
+            if op == "$eq":
+                matched = postings.get(_hashable(operand), EMPTY)
+            elif op == "$ne":
+                matched = np.setdiff1d(self._all(), postings.get(_hashable(operand), EMPTY), assume_unique=True)
+            elif op in ("$in", "$nin"):
+                matched = self._union([postings.get(_hashable(value), EMPTY) for value in operand])
+                if op == "$nin":
+                    matched = np.setdiff1d(self._all(), matched, assume_unique=True)
+            elif op in RANGES:
+                matched = self._range_rows(field, op, operand)
+            else:
+                raise ValueError(f"Unsupported filter operator {op}")
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        return self._all() if rows is None else rows
+
+    @staticmethod
+    def _union(arrays):
+        arrays = [a for a in arrays if len(a)]
+        return np.unique(np.concatenate(arrays)) if arrays else EMPTY
+
+    def rows(self, filter):
+        """
+        Sorted row numbers whose metadata matches the filter.
+        """
+        rows = None
+        for key, condition in filter.items():
+            if key == "$and":
+                matched = None
+                for sub_filter in condition:
+                    sub_rows = self.rows(sub_filter)
+                    matched = sub_rows if matched is None else np.intersect1d(matched, sub_rows, assume_unique=True)
+                matched = self._all() if matched is None else matched
+            elif key == "$or":
+                matched = self._union([self.rows(sub_filter) for sub_filter in condition])
+            else:
+                matched = self._field_rows(key, condition)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        return self._all() if rows is None else rows
+
+    def mask(self, filter):
+        """
+        Boolean array with one entry per row, True where the metadata matches the filter.
+        """
+        mask = np.zeros(self.count, dtype=bool)
+        mask[self.rows(filter)] = True
+        return mask
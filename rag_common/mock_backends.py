@@ -0,0 +1,354 @@
+"""
+Offline stand-ins for Bedrock and Pinecone, used by the evaluation harness and the profiler.
+
+- MockBedrockRuntime answers invoke_model for Titan embeddings (hashed bag of words, so
+  paraphrases sharing words land close together), gpt-oss and Claude (rule based: query
+  candidates, hypothetical documents, intent classification, context-grounded answers).
+- MockPinecone / MockPineconeIndex do exact cosine search over the FAQ dictionaries.
+- CachingBedrockRuntime wraps a real client and replays identical calls from a disk cache.
+
+Every call is counted (calls, tokens, embeddings per model) and can sleep for a configurable
+latency, so pipelines can be compared on call counts, tokens and latency without AWS.
+"""
+import contextvars
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from rag_common.text import tokenize
+
+EMBEDDING_DIM = 1536
+
+# Paraphrase vocabulary shared by the evaluation dataset (canonical -> user wording) and the
+# mocked LLM, which maps user wording back when it rewrites a query
+SYNONYMS = {
+    "order": "purchase",
+    "return": "send back",
+    "cancel": "call off",
+    "track": "follow",
+    "payment": "pay",
+    "shipping": "delivery",
+    "discount": "deal",
+    "refund": "money back",
+    "course": "class",
+    "policy": "rules",
+    "offer": "have",
+    "account": "profile",
+    "international": "overseas",
+    "gift": "present",
+    "wrapping": "wrap",
+}
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+def canonicalize(text):
+    """
+    Maps user wording back to the canonical FAQ vocabulary (what an LLM rewrite tends to do).
+    """
+    for canonical, synonym in SYNONYMS.items():
+        text = re.sub(rf"\b{re.escape(synonym)}\b", canonical, text, flags=re.I)
+    return text
+
+
+def hashed_embedding(text, dim=EMBEDDING_DIM):
+    """
+    Deterministic bag of stemmed words + bigrams, hashed into `dim` signed buckets and normalized.
+    """
+    tokens = tokenize(text)
+    features = tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        digest = hashlib.md5(feature.encode("utf-8")).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class CallStats:
+    """
+    Thread-safe per-model counters: calls, input/output tokens.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = defaultdict(int)
+        self.input_tokens = defaultdict(int)
+        self.output_tokens = defaultdict(int)
+
+    def record(self, model_id, input_tokens, output_tokens):
+        with self.lock:
+            self.calls[model_id] += 1
+            self.input_tokens[model_id] += input_tokens
+            self.output_tokens[model_id] += output_tokens
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                model: {"calls": self.calls[model], "input_tokens": self.input_tokens[model],
+                        "output_tokens": self.output_tokens[model]}
+                for model in self.calls
+            }
+
+
+def _body(payload):
+    return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")), "contentType": "application/json"}
+
+
+def _context_of(system_prompt):
+    return system_prompt.split("Context:", 1)[1].strip() if "Context:" in system_prompt else ""
+
+
+def _first_sentence(text):
+    match = re.match(r"(.+?[.!?])(\s|$)", text.strip(), flags=re.S)
+    return match.group(1) if match else text.strip()
+
+
+DOMAIN_KEYWORDS = {
+    domain: set(tokenize(words))
+    for domain, words in {
+        "finance": "pay payment refund price pricing discount bill invoice receipt money cost fee tax taxes charge "
+                   "charged currency purchase cancel installments",
+        "tech": "login logged password download browser video error app access device devices bug audio playing "
+                "email software opening",
+        "product": "course courses e-book e-books ebook product products certificate certifications topic level "
+                   "beginner live prerequisites material instructor",
+    }.items()
+}
+
+
+def classify_domain(query):
+    """
+    Keyword vote standing in for the database-routing classifier.
+    """
+    words = set(tokenize(query))
+    scores = {domain: len(words & keywords) for domain, keywords in DOMAIN_KEYWORDS.items()}
+    best = max(scores, key=scores.get)
+    return best if scores[best] else "other"
+
+
+class MockBedrockRuntime:
+    """
+    invoke_model-compatible mock. latency_ms = {"embed": 30, "llm": 400} sleeps per call.
+    """
+
+    def __init__(self, latency_ms=None, stats=None):
+        self.latency_ms = {"embed": 0, "llm": 0, **(latency_ms or {})}
+        self.stats = stats or CallStats()
+
+    def _sleep(self, kind):
+        if self.latency_ms[kind]:
+            time.sleep(self.latency_ms[kind] / 1000)
+
+    def invoke_model(self, modelId, body, contentType=None, accept=None, **kwargs):
+        request = json.loads(body)
+        if "inputText" in request:
+            self._sleep("embed")
+            tokens = estimate_tokens(request["inputText"])
+            self.stats.record(modelId, tokens, 0)
+            return _body({"embedding": hashed_embedding(request["inputText"]).tolist(), "inputTextTokenCount": tokens})
+
+        self._sleep("llm")
+        if modelId.startswith("anthropic."):
+            system_prompt = request.get("system", "")
+            query = self._last_user_text(request["messages"])
+            text = self._respond(system_prompt, query)
+            input_tokens, output_tokens = estimate_tokens(system_prompt + query), estimate_tokens(text)
+            self.stats.record(modelId, input_tokens, output_tokens)
+            return _body({"content": [{"type": "text", "text": text}],
+                          "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}})
+
+        messages = request["messages"]
+        system_prompt = " ".join(m["content"] for m in messages if m["role"] == "system")
+        query = self._last_user_text(messages)
+        text = self._respond(system_prompt, query)
+        input_tokens, output_tokens = estimate_tokens(system_prompt + query), estimate_tokens(text)
+        self.stats.record(modelId, input_tokens, output_tokens)
+        return _body({"choices": [{"message": {"role": "assistant", "content": text}}],
+                      "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens}})
+
+    @staticmethod
+    def _last_user_text(messages):
+        users = [m for m in messages if m["role"] == "user"]
+        if not users:
+            return ""
+        content = users[-1]["content"]
+        if isinstance(content, list):
+            return " ".join(part.get("text", "") for part in content)
+        return content
+
+    def _respond(self, system_prompt, query):
+        lowered = system_prompt.lower()
+        if "different versions of the user-generated question" in lowered:
+            n = int(re.search(r"\((\d+)\)", system_prompt).group(1)) if re.search(r"\((\d+)\)", system_prompt) else 3
+            base = canonicalize(query).rstrip("?")
+            variants = [f"{base}?", f"Can you explain {base.lower()}?", f"Information about {base.lower()}",
+                        " ".join(tokenize(base, stem_words=False)), f"{query.rstrip('?')}?"]
+            return json.dumps({f"candidate_{i + 1}": variants[i % len(variants)] for i in range(n)})
+        if "hypothetical document" in lowered:
+            topic = re.sub(r"^.*following query:\s*", "", system_prompt, flags=re.S)
+            return f"{canonicalize(topic)} Our store policy explains {canonicalize(topic).lower()} for customers."
+        if "'factual', 'explanation', or 'guidance'" in lowered:
+            return "explanation" if re.match(r"\s*(how|why)\b", query, re.I) else "factual"
+        if "classification assistant" in lowered:
+            return classify_domain(query)
+        context = _context_of(system_prompt)
+        return _first_sentence(context) if context else f"Here is some general information about: {query}"
+
+
+class CachingBedrockRuntime:
+    """
+    Wraps a real bedrock-runtime client; identical invoke_model calls are replayed from
+    `cache_dir` (one JSON file per request hash), so repeated evaluations cost nothing.
+    """
+
+    def __init__(self, client, cache_dir, stats=None):
+        self.client = client
+        self.cache_dir = cache_dir
+        self.stats = stats or CallStats()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def invoke_model(self, modelId, body, **kwargs):
+        key = hashlib.sha256(f"{modelId}\0{body}".encode("utf-8")).hexdigest()
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                payload = f.read()
+        else:
+            payload = self.client.invoke_model(modelId=modelId, body=body, **kwargs)["body"].read()
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(payload)
+            os.replace(f"{path}.tmp", path)
+
+        response = json.loads(payload)
+        usage = response.get("usage", {})
+        self.stats.record(
+            modelId,
+            usage.get("input_tokens", usage.get("prompt_tokens", response.get("inputTextTokenCount", 0))),
+            usage.get("output_tokens", usage.get("completion_tokens", 0)),
+        )
+        return {"body": io.BytesIO(payload), "contentType": "application/json"}
+
+
+# A context variable rather than a thread-local, so queries made by pipeline stages on worker
+# threads (which run with a copy of the caller's context) land in the caller's trace
+_trace = contextvars.ContextVar("retrieval_trace", default=None)
+
+
+def start_trace():
+    """
+    Starts recording the matches every index query returns in the current context.
+    """
+    _trace.set([])
+
+
+def end_trace():
+    """
+    Returns the (answer, score) pairs recorded since start_trace().
+    """
+    matches = _trace.get() or []
+    _trace.set(None)
+    return matches
+
+
+def record_matches(matches):
+    trace = _trace.get()
+    if trace is not None:
+        trace.extend((m["metadata"]["answer"], m["score"]) for m in matches)
+
+
+class Match(dict):
+    """
+    Pinecone match: supports both match.metadata and match['metadata'].
+    """
+
+    __getattr__ = dict.__getitem__
+
+
+class MockPineconeIndex:
+    """
+    Exact cosine search over {question: answer} entries (+ optional category metadata).
+    Every query is recorded in the caller's trace (see start_trace / end_trace).
+    """
+
+    def __init__(self, entries, latency_ms=0):
+        self.ids = [entry["id"] for entry in entries]
+        self.metadata = [entry["metadata"] for entry in entries]
+        self.vectors = np.array([hashed_embedding(entry["metadata"]["question"]) for entry in entries],
+                                dtype=np.float32).reshape(len(entries), EMBEDDING_DIM)
+        self.latency_ms = latency_ms
+
+    @classmethod
+    def from_faq(cls, faq, category=None, id_prefix="", latency_ms=0):
+        entries = []
+        for i, (question, answer) in enumerate(faq.items()):
+            metadata = {"question": question, "answer": answer}
+            if category:
+                metadata["category"] = category
+            entries.append({"id": f"{id_prefix}{i}", "metadata": metadata})
+        return cls(entries, latency_ms)
+
+    def _matches_filter(self, metadata, filter):
+        for field, condition in (filter or {}).items():
+            value = condition.get("$eq") if isinstance(condition, dict) else condition
+            if metadata.get(field) != value:
+                return False
+        return True
+
+    def query(self, vector=None, top_k=1, include_metadata=True, namespace=None, filter=None, **kwargs):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        query = np.asarray(vector, dtype=np.float32)
+        scores = self.vectors @ (query / (np.linalg.norm(query) or 1.0))
+        order = [i for i in np.argsort(-scores) if self._matches_filter(self.metadata[i], filter)][:top_k]
+        matches = [Match(id=self.ids[i], score=float(scores[i]), metadata=self.metadata[i]) for i in order]
+        record_matches(matches)
+        return Match(matches=matches, namespace=namespace or "")
+
+    def upsert(self, vectors, namespace=None):
+        return {"upserted_count": len(vectors)}
+
+
+class TracingIndex:
+    """
+    Wraps a real Pinecone index so its query results are recorded like the mock's.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def query(self, **kwargs):
+        response = self.index.query(**kwargs)
+        record_matches(response["matches"])
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+
+class MockPinecone:
+    """
+    Stand-in for pinecone.Pinecone: Index(name) returns the MockPineconeIndex registered for name.
+    """
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+
+    def __call__(self, api_key=None, **kwargs):
+        return self
+
+    def Index(self, name):
+        return self.indexes[name]
@@ -0,0 +1,196 @@
+"""
+Normalization of model output: drops <reasoning>/<think> blocks and markdown code-fence markers.
+
+ResponseNormalizer works on streamed chunks in a single pass. It only holds back the few
+characters that could start a marker (e.g. a trailing "<reaso"), so visible text is emitted
+as soon as it arrives and an answer streams out right after its reasoning section closes.
+A reasoning block that never closes (the reply hit max_tokens) is dropped to the end.
+The language tag of an opening fence ("```json") is dropped only when a newline follows it.
+
+    clean_response(text)                  # whole reply
+    for text in clean_stream(chunks): ... # streamed reply
+    parse_json(text)                      # JSON value of a reply, prose around it ignored
+"""
+import json
+import re
+
+REASONING_TAGS = ("reasoning", "think")
+FENCE = "```"
+# A fenced block: optional language tag on the opening line, content up to the closing fence
+JSON_FENCE_RE = re.compile(r"```[\w+-]*[ \t]*\n?(.*?)```", re.DOTALL)
+
+
+class ResponseNormalizer:
+    def __init__(self, reasoning_tags=REASONING_TAGS, strip_fences=True):
+        self.closing = {f"<{tag}>": f"</{tag}>" for tag in reasoning_tags}
+        markers = list(self.closing) + ([FENCE] if strip_fences else [])
+        self.markers = markers
+        self.pattern = re.compile("|".join(re.escape(marker) for marker in markers))
+        self.max_marker = max(len(marker) for marker in markers + list(self.closing.values()))
+        self.carry = ""
+        self.close_tag = None  # set while inside a reasoning block
+        self.in_fence = False
+        self.skipping_fence_info = False  # right after an opening fence: its language tag
+        self.fence_info = ""  # tag read so far, emitted as text unless a newline ends it
+        self.started = False  # leading whitespace is dropped
+        self.whitespace = ""  # trailing whitespace held until more text follows
+        self.had_reasoning = False
+        self.truncated = False
+
+    def _holdback(self, text, start, markers):
+        """
+        Length of the longest suffix of text[start:] that is a proper prefix of a marker.
+        """
+        for size in range(min(len(text) - start, self.max_marker - 1), 0, -1):
+            suffix = text[len(text) - size:]
+            if any(marker.startswith(suffix) for marker in markers):
+                return size
+        return 0
+
+    def _emit(self, text, out):
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return
+            self.started = True
+        body = text.rstrip()
+        if not body:
+            self.whitespace += text
+            return
+        out.append(self.whitespace)
+        out.append(body)
+        self.whitespace = text[len(body):]
+
+    def feed(self, chunk):
+        """
+        Consumes the next chunk and returns the visible text that is ready ("" if none).
+        """
+        text = self.carry + chunk if self.carry else chunk
+        self.carry = ""
+        out = []
+        position = 0
+        length = len(text)
+        while position < length:
+            if self.close_tag is not None:
+                end = text.find(self.close_tag, position)
+                if end < 0:
+                    keep = self._holdback(text, position, [self.close_tag])
+                    self.carry = text[length - keep:] if keep else ""
+                    break
+                position = end + len(self.close_tag)
+                self.close_tag = None
+                continue
+
+            if self.skipping_fence_info:
+                start = position
+                while position < length and (text[position].isalnum() or text[position] in "_+-"):
+                    position += 1
+                self.fence_info += text[start:position]
+                if position == length:
+                    break
+                if text[position] == "\n":
+                    position += 1
+                else:
+                    # "a```b": not a language tag but fenced text
+                    self._emit(self.fence_info, out)
+                self.fence_info = ""
+                self.skipping_fence_info = False
+                continue
+
+            match = self.pattern.search(text, position)
+            if match is None:
+                keep = self._holdback(text, position, self.markers)
+                self._emit(text[position:length - keep], out)
+                self.carry = text[length - keep:] if keep else ""
+                break
+
+            self._emit(text[position:match.start()], out)
+            position = match.end()
+            marker = match.group()
+            if marker == FENCE:
+                self.in_fence = not self.in_fence
+                self.skipping_fence_info = self.in_fence
+            else:
+                self.close_tag = self.closing[marker]
+                self.had_reasoning = True
+        return "".join(out)
+
+    def finish(self):
+        """
+        Flushes the text held back at the end of the stream (trailing whitespace is dropped).
+        """
+        out = []
+        if self.close_tag is not None:
+            self.truncated = True
+        else:
+            self._emit(self.fence_info + self.carry, out)
+        self.carry = ""
+        self.fence_info = ""
+        return "".join(out)
+
+
+def clean_response(response_text, default=""):
+    """
+    Visible part of a complete reply, or `default` when nothing but reasoning is left.
+    """
+    normalizer = ResponseNormalizer()
+    text = normalizer.feed(response_text) + normalizer.finish()
+    return text if text else default
+
+
+def parse_json(response_text):
+    """
+    JSON value of a reply whose JSON may be wrapped in prose and a code fence: the content of
+    the first fence if there is one, else the outermost {...} or [...] of the visible text.
+    Raises ValueError (json.JSONDecodeError) when there is no valid JSON.
+    """
+    normalizer = ResponseNormalizer(strip_fences=False)
+    text = normalizer.feed(response_text) + normalizer.finish()
+    fenced = JSON_FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1)
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+        if not starts:
+            raise
+        start = min(starts)
+        end = text.rfind("}" if text[start] == "{" else "]")
+        return json.loads(text[start:end + 1])
+
+
+def clean_stream(chunks):
+    """
+    Yields the visible text of a streamed reply as it becomes available.
+    """
+    normalizer = ResponseNormalizer()
+    for chunk in chunks:
+        text = normalizer.feed(chunk)
+        if text:
+            yield text
+    text = normalizer.finish()
+    if text:
+        yield text
+
+
+def stream_chat_text(bedrock_runtime, model_id, body):
+    """
+    Raw text deltas of an OpenAI-format chat model (e.g. gpt-oss) via invoke_model_with_response_stream.
+    """
+    response = bedrock_runtime.invoke_model_with_response_stream(
+        modelId=model_id,
+        body=body,
+        contentType='application/json',
+        accept='application/json'
+    )
+    for event in response['body']:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        payload = json.loads(chunk['bytes'])
+        for choice in payload.get('choices', []):
+            content = (choice.get('delta') or {}).get('content')
+            if content:
+                yield content
@@ -0,0 +1,456 @@
+"""
+Small pipeline engine: a strategy is declared as a DAG of named stages (generate candidates,
+embed, retrieve, fuse, rerank, pack, generate, ...) and a scheduler runs every stage as soon
+as its inputs are ready, so independent branches execute concurrently.
+
+    pipeline = Pipeline([
+        Stage("embed", get_embedding_model, inputs=["query"], cache=True),
+        Stage("retrieve", retrieve_best_match, inputs=["embed"]),
+        Stage("generate", answer, inputs=["query", "retrieve"]),
+    ])
+    pipeline.run(query="What is your return policy?")
+
+- each=True applies the stage to every item of its first input (fan-out), one task per item.
+- cache=True keeps an LRU of results per stage, keyed by the stage's arguments (or by
+  cache_key(*args), e.g. a canonical form of the query text).
+- timeout (seconds) bounds a stage; on timeout or error, `fallback` (same arguments) supplies
+  the value instead, otherwise StageTimeout / the error is raised from run().
+- optional=True marks a stage the answer can do without (candidate generation, HyDE,
+  re-ranking, or generation whose fallback returns the top retrieved FAQ answer): when less of
+  the request deadline is left than the stage usually takes, its fallback is used right away.
+
+A request deadline (`with deadline(seconds) as request:` around one or more runs, or
+PIPELINE_DEADLINE) bounds every stage inside it. A stage still running when it expires resolves
+through its fallback, or the run raises DeadlineExceeded. Skipped stages and used fallbacks
+are listed in request.degradations ("skip:rerank", "timeout:generate", "error:candidates").
+StageCall runs a single stage outside a pipeline under the same rules (speculative generation).
+
+Every run is a request of the token ledger named after the pipeline (rag_common.ledger), unless
+the caller already opened one, and a PROFILE_SAMPLE_RATE share of the runs is profiled with
+their stage timings (rag_common.profiler). Stages run in a shared thread pool with the caller's contextvars. A stage that times out
+cannot be interrupted; its thread finishes in the background and the result is dropped.
+"""
+import contextlib
+import contextvars
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from rag_common.config import (
+    PIPELINE_CACHE_SIZE,
+    PIPELINE_DEADLINE,
+    PIPELINE_MAX_WORKERS,
+    PIPELINE_STAGE_QUANTILE,
+    PIPELINE_STAGE_TIMEOUT,
+)
+from rag_common.ledger import ledger
+from rag_common.profiler import profile
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Placeholder for fan-out items that have not finished yet
+_PENDING = object()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS, thread_name_prefix="pipeline")
+        return _executor
+
+
+class StageTimeout(TimeoutError):
+    pass
+
+
+class DeadlineExceeded(StageTimeout):
+    pass
+
+
+class Deadline:
+    """
+    Time budget of one request (math.inf seconds = none), shared by the runs and stages inside it,
+    and the degradations applied to meet it.
+    """
+
+    def __init__(self, seconds=math.inf):
+        self.seconds = seconds
+        self.expires_at = time.perf_counter() + seconds
+        self.degradations = []
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        return self.expires_at - time.perf_counter()
+
+    def degrade(self, what):
+        with self.lock:
+            if what not in self.degradations:
+                self.degradations.append(what)
+        print(f"DEBUG - Degraded {what} ({self.remaining():.3f}s left)")
+
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """
+    Opens a request deadline `seconds` from now (0 / None: no time limit, degradations are still
+    recorded) and yields it. Inside an open one it yields that one instead.
+    """
+    request = _deadline.get()
+    if request is not None:
+        yield request
+        return
+    token = _deadline.set(Deadline(seconds or math.inf))
+    try:
+        yield _deadline.get()
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline():
+    """
+    The open request deadline, None outside one.
+    """
+    return _deadline.get()
+
+
+def remaining_time():
+    """
+    Seconds left of the current request deadline, None without one.
+    """
+    request = _deadline.get()
+    if request is None or request.seconds == math.inf:
+        return None
+    return request.remaining()
+
+
+class StageCache:
+    """
+    Thread-safe LRU of stage results.
+    """
+
+    def __init__(self, size=PIPELINE_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+class Durations:
+    """
+    Recent durations of a stage (or any step), shared by the requests running it.
+    """
+
+    def __init__(self, window=100):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+
+    def quantile(self, quantile=PIPELINE_STAGE_QUANTILE, min_samples=5):
+        """
+        Duration quantile of the recent runs (0 until there are min_samples).
+        """
+        with self.lock:
+            durations = sorted(self.samples)
+        if len(durations) < min_samples:
+            return 0.0
+        return durations[min(len(durations) - 1, int(quantile * len(durations)))]
+
+
+class Stage:
+    def __init__(self, name, fn, inputs=(), each=False, cache=False, timeout=None, fallback=None, cache_key=None,
+                 optional=False):
+        if optional and fallback is None:
+            raise ValueError(f"Optional stage {name} needs a fallback")
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.each = each
+        self.cache = StageCache() if cache else None
+        self.cache_key = cache_key or (lambda *args: repr(args))
+        self.timeout = PIPELINE_STAGE_TIMEOUT if timeout is None else timeout
+        self.fallback = fallback
+        self.optional = optional
+        self.durations = Durations()
+
+    def expected_seconds(self, quantile=PIPELINE_STAGE_QUANTILE, min_samples=5):
+        return self.durations.quantile(quantile, min_samples)
+
+    def degraded(self, args):
+        # The fallback value for a whole invocation, item by item for a fan-out stage
+        if self.each:
+            return [self.fallback(item, *args[1:]) for item in args[0]]
+        return self.fallback(*args)
+
+    def call(self, *args):
+        """
+        One invocation of the stage function, through the cache and the fallback.
+        """
+        key = self.cache_key(*args) if self.cache is not None else None
+        if key is not None:
+            found, value = self.cache.get(key)
+            if found:
+                return value
+        try:
+            value = self.fn(*args)
+        except Exception as e:
+            if self.fallback is None:
+                raise
+            print(f"DEBUG - Stage {self.name} failed ({e}), using fallback")
+            request = _deadline.get()
+            if request is not None:
+                request.degrade(f"error:{self.name}")
+            return self.fallback(*args)
+        if key is not None:
+            self.cache.put(key, value)
+        return value
+
+
+class StageCall:
+    """
+    One invocation of a stage outside a pipeline run, started right away in the shared pool, under
+    the rules Pipeline.execute applies: an optional stage is skipped when less of the request
+    deadline is left than it usually takes, the stage timeout and the deadline bound the call, and
+    a late call resolves through the fallback (DeadlineExceeded / StageTimeout without one).
+    """
+
+    def __init__(self, stage, args):
+        self.stage = stage
+        self.args = list(args)
+        self.request = _deadline.get() or Deadline()
+        self.future = None
+        self.seconds = None  # time the call took, once it completed
+        if stage.optional and self.request.remaining() <= stage.expected_seconds():
+            self.request.degrade(f"skip:{stage.name}")
+            return
+        self.started = time.perf_counter()
+        self.future = get_executor().submit(contextvars.copy_context().run, self._call)
+
+    @property
+    def skipped(self):
+        return self.future is None
+
+    def _call(self):
+        value = self.stage.call(*self.args)
+        self.seconds = time.perf_counter() - self.started
+        return value
+
+    def result(self):
+        stage, request = self.stage, self.request
+        if self.future is None:
+            return stage.degraded(self.args)
+        expires_at = min(self.started + stage.timeout if stage.timeout else math.inf, request.expires_at)
+        try:
+            value = self.future.result(None if expires_at == math.inf else max(0.0, expires_at - time.perf_counter()))
+        except FutureTimeout:
+            self.future.cancel()
+            if stage.fallback is None:
+                if request.remaining() <= 0:
+                    raise DeadlineExceeded(f"Request deadline of {request.seconds}s reached in stage {stage.name}")
+                raise StageTimeout(f"Stage {stage.name} exceeded {stage.timeout}s")
+            print(f"DEBUG - Stage {stage.name} timed out, using fallback")
+            request.degrade(f"timeout:{stage.name}")
+            return stage.degraded(self.args)
+        stage.durations.add(self.seconds)
+        return value
+
+    def cancel(self):
+        if self.future is not None:
+            self.future.cancel()
+
+
+class Pipeline:
+    def __init__(self, stages, inputs=("query",), output=None, name="pipeline"):
+        self.name = name
+        self.stages = OrderedDict()
+        for stage in stages:
+            if stage.name in self.stages or stage.name in inputs:
+                raise ValueError(f"Duplicate stage name {stage.name}")
+            self.stages[stage.name] = stage
+        self.inputs = tuple(inputs)
+        self.output = output or stages[-1].name
+
+        for stage in stages:
+            unknown = [name for name in stage.inputs if name not in self.stages and name not in self.inputs]
+            if unknown:
+                raise ValueError(f"Stage {stage.name} depends on unknown inputs {unknown}")
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        state = {}
+
+        def visit(name):
+            if state.get(name) == "done" or name in self.inputs:
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Pipeline has a cycle through {name}")
+            state[name] = "visiting"
+            for dependency in self.stages[name].inputs:
+                visit(dependency)
+            state[name] = "done"
+
+        for name in self.stages:
+            visit(name)
+
+    def _needed(self, output):
+        needed, stack = set(), [output]
+        while stack:
+            name = stack.pop()
+            if name in needed or name in self.inputs:
+                continue
+            needed.add(name)
+            stack.extend(self.stages[name].inputs)
+        return needed
+
+    def run(self, output=None, **inputs):
+        """
+        Runs the stages `output` (default: the last stage) depends on and returns its value.
+        """
+        values, _ = self.execute(inputs, output)
+        return values[output or self.output]
+
+    def execute(self, inputs, output=None):
+        """
+        Returns ({stage or input name: value}, {stage name: seconds}).
+        """
+        with ledger.request(self.name), deadline(PIPELINE_DEADLINE), profile(self.name) as run_profile:
+            values, timings = self._execute(inputs, output)
+            if run_profile is not None:
+                run_profile.add_run(self.name, timings)
+            return values, timings
+
+    def _execute(self, inputs, output):
+        missing = [name for name in self.inputs if name not in inputs]
+        if missing:
+            raise ValueError(f"Missing pipeline inputs {missing}")
+
+        executor = get_executor()
+        request = _deadline.get()
+        values = dict(inputs)
+        timings = {}
+        pending = [self.stages[name] for name in self.stages if name in self._needed(output or self.output)]
+        futures = {}  # future -> (stage, item index or None)
+        running = {}  # stage name -> {"started", "deadline", "results", "remaining", "args"}
+
+        def finish(stage, value, completed=True):
+            values[stage.name] = value
+            timings[stage.name] = time.perf_counter() - running.pop(stage.name)["started"]
+            if completed:
+                stage.durations.add(timings[stage.name])
+
+        def submit(stage, args, index=None):
+            context = contextvars.copy_context()
+            futures[executor.submit(context.run, stage.call, *args)] = (stage, index)
+
+        try:
+            while pending or running:
+                # Launch every stage whose inputs are all available (skipped stages and empty
+                # fan-outs resolve at once and can make more stages ready)
+                ready = [s for s in pending if all(name in values for name in s.inputs)]
+                while ready:
+                    for stage in ready:
+                        pending.remove(stage)
+                        args = [values[name] for name in stage.inputs]
+                        if stage.optional and request.remaining() <= stage.expected_seconds():
+                            request.degrade(f"skip:{stage.name}")
+                            values[stage.name] = stage.degraded(args)
+                            timings[stage.name] = 0.0
+                            continue
+                        started = time.perf_counter()
+                        stage_deadline = min(started + stage.timeout if stage.timeout else math.inf,
+                                             request.expires_at)
+                        running[stage.name] = {
+                            "started": started,
+                            "deadline": stage_deadline if stage_deadline != math.inf else None,
+                            "args": args,
+                        }
+                        if stage.each:
+                            items, rest = list(args[0]), args[1:]
+                            running[stage.name].update(results=[_PENDING] * len(items), remaining=len(items))
+                            if not items:
+                                finish(stage, [])
+                            for i, item in enumerate(items):
+                                submit(stage, [item, *rest], i)
+                        else:
+                            submit(stage, args)
+                    ready = [s for s in pending if all(name in values for name in s.inputs)]
+
+                if not running:
+                    if pending:
+                        raise RuntimeError(f"Pipeline stalled with stages {[s.name for s in pending]} pending")
+                    break
+
+                deadlines = [state["deadline"] for state in running.values() if state["deadline"] is not None]
+                timeout = max(0.0, min(deadlines) - time.perf_counter()) if deadlines else None
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage, index = futures.pop(future)
+                    if stage.name not in running:
+                        continue  # already resolved by a timeout
+                    value = future.result()
+                    if index is None:
+                        finish(stage, value)
+                    else:
+                        state = running[stage.name]
+                        state["results"][index] = value
+                        state["remaining"] -= 1
+                        if state["remaining"] == 0:
+                            finish(stage, state["results"])
+
+                now = time.perf_counter()
+                for name, state in list(running.items()):
+                    if state["deadline"] is None or now < state["deadline"]:
+                        continue
+                    stage = self.stages[name]
+                    for future, (owner, _) in list(futures.items()):
+                        if owner is stage:
+                            future.cancel()
+                            del futures[future]
+                    expired = request.remaining() <= 0
+                    if stage.fallback is None:
+                        if expired:
+                            raise DeadlineExceeded(f"Request deadline of {request.seconds}s reached in stage {name}")
+                        raise StageTimeout(f"Stage {name} exceeded {stage.timeout}s")
+                    print(f"DEBUG - Stage {name} timed out, using fallback")
+                    request.degrade(f"timeout:{name}")
+                    if stage.each:
+                        items, rest = list(state["args"][0]), state["args"][1:]
+                        finish(stage, [
+                            result if result is not _PENDING else stage.fallback(item, *rest)
+                            for item, result in zip(items, state["results"])
+                        ], completed=False)
+                    else:
+                        finish(stage, stage.fallback(*state["args"]), completed=False)
+        finally:
+            for future in futures:
+                future.cancel()
+
+        return values, timings
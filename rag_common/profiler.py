@@ -0,0 +1,343 @@
+"""
+Stack-sampling profiler for slow requests.
+
+While a profile is open, a sampler thread reads the Python stack of every busy thread
+(sys._current_frames) every PROFILE_INTERVAL_MS. Nothing is traced, so the profiled code runs at
+full speed; the cost is one stack walk per thread and interval, reported as sampling_seconds.
+Idle threads (pool workers waiting for work, threads blocked in threading / queue) are left out,
+except the thread that opened the profile: its waits are part of the request's wall time.
+
+Pipeline.execute profiles a PROFILE_SAMPLE_RATE share of its runs, one profile at a time (runs
+started inside an open profile join it). Each profile writes to PROFILE_DIR:
+
+- <name>-<time>-<id>.collapsed: "thread;outer;...;inner samples" lines for flamegraph.pl,
+  speedscope or inferno, or <name>-<time>-<id>.speedscope.json with one sampled profile per
+  thread (PROFILE_FORMAT=speedscope);
+- <name>-<time>-<id>.json: wall time, samples, sampling overhead and the stage timings of
+  every pipeline run.
+
+Only the PROFILE_MAX_FILES most recent profiles are kept, older ones are deleted as new ones are
+written. Work running at the same time (concurrent requests) is sampled too.
+
+    python -m rag_common.profiler ex-03                        # ex-03's main() on mocked backends
+    python -m rag_common.profiler ex-01 --format speedscope
+"""
+import argparse
+import asyncio
+import contextlib
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from rag_common.config import PROFILE_DIR, PROFILE_FORMAT, PROFILE_INTERVAL_MS, PROFILE_MAX_FILES, PROFILE_SAMPLE_RATE
+
+FORMATS = ("collapsed", "speedscope")
+# Stack files by format, the summary of each is "<base>.json"
+SUFFIXES = (".collapsed", ".speedscope.json")
+
+# Innermost frames of a thread waiting for work
+IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+IDLE_FUNCTIONS = (("thread.py", "_worker"),)
+
+
+def frame_label(code):
+    """
+    "function (file:first line)", the file relative to site-packages or the working directory.
+    """
+    filename = code.co_filename
+    if "site-packages" + os.sep in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    elif filename.startswith(os.getcwd() + os.sep):
+        filename = os.path.relpath(filename)
+    else:
+        filename = os.path.basename(filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+def is_idle(frame):
+    filename = os.path.basename(frame.f_code.co_filename)
+    return filename in IDLE_FILES or (filename, frame.f_code.co_name) in IDLE_FUNCTIONS
+
+
+class Profile:
+    def __init__(self, name, interval=PROFILE_INTERVAL_MS / 1000):
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.interval = interval
+        self.owner = threading.get_ident()
+        self.stacks = Counter()  # (thread name, frame labels outermost first) -> samples
+        self.labels = {}  # code object -> frame label
+        self.samples = 0
+        self.sampling_seconds = 0.0
+        self.runs = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.started = None
+        self.seconds = None
+        self.path = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.seconds = time.perf_counter() - self.started
+
+    def _sample(self):
+        sampler = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            started = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == sampler or (ident != self.owner and is_idle(frame)):
+                    continue
+                stack = []
+                while frame is not None:
+                    label = self.labels.get(frame.f_code)
+                    if label is None:
+                        label = self.labels[frame.f_code] = frame_label(frame.f_code)
+                    stack.append(label)
+                    frame = frame.f_back
+                self.stacks[(names.get(ident, str(ident)), tuple(reversed(stack)))] += 1
+            self.samples += 1
+            self.sampling_seconds += time.perf_counter() - started
+
+    def add_run(self, pipeline, timings):
+        """
+        Stage timings ({stage: seconds}) of one pipeline run inside the profile.
+        """
+        with self.lock:
+            self.runs.append({"pipeline": pipeline, "stages": {name: round(seconds, 6) for name, seconds in timings.items()}})
+
+    def collapsed(self):
+        return "".join(f"{';'.join((thread, *stack))} {count}\n"
+                       for (thread, stack), count in sorted(self.stacks.items()))
+
+    def speedscope(self):
+        frames = []
+        index = {}
+        profiles = {}
+        for (thread, stack), count in sorted(self.stacks.items()):
+            ids = []
+            for label in stack:
+                if label not in index:
+                    index[label] = len(frames)
+                    frames.append({"name": label})
+                ids.append(index[label])
+            thread_profile = profiles.setdefault(thread, {
+                "type": "sampled",
+                "name": thread,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(1000 * self.seconds, 3),
+                "samples": [],
+                "weights": [],
+            })
+            thread_profile["samples"].append(ids)
+            thread_profile["weights"].append(round(1000 * self.interval * count, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "rag_common.profiler",
+            "shared": {"frames": frames},
+            "profiles": list(profiles.values()),
+        }
+
+    def self_time(self, n=10):
+        """
+        The n innermost frames seen most often, as (label, share of the samples).
+        """
+        counts = Counter()
+        for (_, stack), count in self.stacks.items():
+            counts[stack[-1]] += count
+        total = sum(counts.values())
+        return [(label, count / total) for label, count in counts.most_common(n)]
+
+    def summary(self):
+        return {
+            "name": self.name,
+            "id": self.id,
+            "profile": os.path.basename(self.path) if self.path else None,
+            "seconds": round(self.seconds, 4) if self.seconds is not None else None,
+            "interval_ms": 1000 * self.interval,
+            "samples": self.samples,
+            "sampling_seconds": round(self.sampling_seconds, 4),
+            "runs": self.runs,
+        }
+
+    def write(self, directory=PROFILE_DIR, fmt=PROFILE_FORMAT):
+        """
+        Writes the stacks in `fmt` and the summary next to them; returns the stacks' path.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown profile format {fmt}, expected one of {FORMATS}")
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{self.id}")
+        if fmt == "speedscope":
+            self.path = f"{base}.speedscope.json"
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.speedscope(), f)
+        else:
+            self.path = f"{base}.collapsed"
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(self.collapsed())
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=1)
+        return self.path
+
+
+def prune(directory=PROFILE_DIR, keep=PROFILE_MAX_FILES):
+    """
+    Deletes all but the `keep` most recent profiles of `directory` (0: keeps all); returns how
+    many were deleted. Files other processes delete at the same time are skipped.
+    """
+    if not keep:
+        return 0
+    profiles = []
+    for entry in os.scandir(directory):
+        suffix = next((suffix for suffix in SUFFIXES if entry.name.endswith(suffix)), None)
+        if suffix is not None:
+            try:
+                profiles.append((entry.stat().st_mtime, entry.path[:-len(suffix)], entry.path))
+            except FileNotFoundError:
+                continue
+    profiles.sort()
+    stale = profiles[:max(0, len(profiles) - keep)]
+    for _, base, path in stale:
+        for name in (path, f"{base}.json"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(name)
+    return len(stale)
+
+
+_current = contextvars.ContextVar("profile", default=None)
+_active = threading.Lock()  # one open profile per process
+
+
+def current_profile():
+    return _current.get()
+
+
+def _start(name, sample_rate, force, interval):
+    # A new Profile when this block is selected and no other profile is open, else None
+    selected = force or (sample_rate > 0 and random.random() < sample_rate)
+    if not selected or not _active.acquire(blocking=False):
+        return None
+    opened = Profile(name, interval)
+    opened.start()
+    return opened
+
+
+def _finish(opened, directory, fmt):
+    # Joins the sampler and writes the files: blocking, keep it off an event loop
+    opened.stop()
+    _active.release()
+    try:
+        opened.write(directory, fmt)
+        prune(directory)
+        print(f"DEBUG - Profile of {opened.name}: {opened.path} ({opened.samples} samples in {opened.seconds:.3f}s)")
+    except OSError as e:
+        print(f"DEBUG - Could not write the profile of {opened.name}: {e}")
+
+
+@contextlib.contextmanager
+def profile(name, sample_rate=PROFILE_SAMPLE_RATE, force=False, interval=PROFILE_INTERVAL_MS / 1000,
+            directory=PROFILE_DIR, fmt=PROFILE_FORMAT):
+    """
+    Profiles the block when it is selected (force, or with probability sample_rate) and no other
+    profile is open, and yields the Profile (None when not profiled). Inside an open profile it
+    yields that one. The files are written when the block exits.
+    """
+    current = _current.get()
+    if current is not None:
+        yield current
+        return
+    opened = _start(name, sample_rate, force, interval)
+    if opened is None:
+        yield None
+        return
+
+    token = _current.set(opened)
+    try:
+        yield opened
+    finally:
+        _current.reset(token)
+        _finish(opened, directory, fmt)
+
+
+@contextlib.asynccontextmanager
+async def profile_async(name, sample_rate=PROFILE_SAMPLE_RATE, force=False, interval=PROFILE_INTERVAL_MS / 1000,
+                        directory=PROFILE_DIR, fmt=PROFILE_FORMAT):
+    """
+    profile() for a coroutine: the sampler is joined and the files written in the loop's default
+    executor, so closing a profile does not stall the other requests on the event loop.
+    """
+    current = _current.get()
+    if current is not None:
+        yield current
+        return
+    opened = _start(name, sample_rate, force, interval)
+    if opened is None:
+        yield None
+        return
+
+    token = _current.set(opened)
+    try:
+        yield opened
+    finally:
+        _current.reset(token)
+        await asyncio.get_running_loop().run_in_executor(None, _finish, opened, directory, fmt)
+
+
+def main():
+    from rag_common.evaluate import create_backends
+    from rag_common.exercises import exercise_path, load_exercise
+    from rag_common.mock_backends import CallStats
+    # The pipelines join the profile of rag_common.profiler, not of this module run as __main__
+    from rag_common.profiler import profile as open_profile
+
+    parser = argparse.ArgumentParser(description="Profile an exercise's main() against mocked backends")
+    parser.add_argument("exercise", help='e.g. "ex-03" or "ex-03-fusion-rag.py"')
+    parser.add_argument("--mock-latency-ms", default="25,30,350", help="embed,retrieve,llm latency of the mocks")
+    parser.add_argument("--repeat", type=int, default=1, help="Times main() is run in the profile")
+    parser.add_argument("--interval-ms", type=float, default=PROFILE_INTERVAL_MS)
+    parser.add_argument("--format", choices=FORMATS, default=PROFILE_FORMAT)
+    parser.add_argument("--out", default=PROFILE_DIR, help="Output directory")
+    args = parser.parse_args()
+
+    latency_ms = [float(x) for x in args.mock_latency_ms.split(",")]
+    bedrock_runtime, pinecone_factory = create_backends("mock", latency_ms, None, CallStats())
+    module = load_exercise(args.exercise, bedrock_runtime=bedrock_runtime, pinecone_factory=pinecone_factory)
+    name = os.path.splitext(os.path.basename(exercise_path(args.exercise)))[0]
+
+    with open_profile(name, force=True, interval=args.interval_ms / 1000, directory=args.out, fmt=args.format) as opened:
+        for _ in range(args.repeat):
+            module.main()
+
+    print(f"\n{opened.path}: {opened.samples} samples in {opened.seconds:.3f}s, "
+          f"sampling overhead {100 * opened.sampling_seconds / opened.seconds:.1f}%")
+    print(f"\n{'self time':<90} {'share':>6}")
+    for label, share in opened.self_time():
+        print(f"{label:<90} {100 * share:>5.1f}%")
+    stages = {}
+    for run in opened.runs:
+        for stage, seconds in run["stages"].items():
+            stages.setdefault((run["pipeline"], stage), []).append(seconds)
+    if stages:
+        print(f"\n{'pipeline':<16} {'stage':<18} {'runs':>5} {'mean ms':>9}")
+        for (pipeline, stage), durations in stages.items():
+            print(f"{pipeline:<16} {stage:<18} {len(durations):>5} {1000 * sum(durations) / len(durations):>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import abc
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+from rag_common.config import (
+    RERANK_CACHE_SIZE,
+    RERANK_ONNX_MODEL,
+    RERANK_ONNX_TOKENIZER,
+    RERANK_WEIGHT,
+    RERANKER,
+)
+from rag_common.text import tokenize
+
+
+class Reranker(abc.ABC):
+    """
+    Base re-ranker: subclasses implement score_pairs(query, docs) for the docs missing from the cache.
+
+    rank() blends the re-ranker score with a reciprocal-rank prior of the incoming order, so the
+    retrieval ranking still counts when the re-ranker has no opinion (e.g. no term overlap).
+
+    Scores are cached per (query, doc) pair only when a pair's score does not depend on the
+    other candidates (pair_cache = True); a set-relative scorer caches its own per-doc work.
+    """
+
+    pair_cache = True
+
+    def __init__(self, weight=RERANK_WEIGHT, cache_size=RERANK_CACHE_SIZE):
+        self.weight = weight
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    @abc.abstractmethod
+    def score_pairs(self, query, docs):
+        """
+        One score per doc, higher is more relevant.
+        """
+
+    @staticmethod
+    def _key(query, doc):
+        return hashlib.sha1(f"{query}\0{doc}".encode("utf-8")).digest()
+
+    def scores(self, query, docs):
+        """
+        Scores every (query, doc) pair, computing all cache misses in one batched call.
+        """
+        if not self.pair_cache:
+            return np.asarray(self.score_pairs(query, docs), dtype=np.float32)
+        keys = [self._key(query, doc) for doc in docs]
+        scores = np.empty(len(docs), dtype=np.float32)
+        missing = []
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    scores[i] = self.cache[key]
+                else:
+                    missing.append(i)
+
+        if missing:
+            fresh = self.score_pairs(query, [docs[i] for i in missing])
+            scores[missing] = fresh
+            with self.lock:
+                for i, score in zip(missing, fresh):
+                    self.cache[keys[i]] = float(score)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return scores
+
+    def rank(self, query, docs):
+        """
+        Returns the indices of docs ordered from most to least relevant.
+        """
+        if len(docs) < 2:
+            return list(range(len(docs)))
+        scores = self.scores(query, docs)
+        spread = scores.max() - scores.min()
+        scores = (scores - scores.min()) / spread if spread > 0 else np.zeros_like(scores)
+
+        prior = 1.0 / (60 + np.arange(len(docs)))
+        prior = (prior - prior.min()) / (prior.max() - prior.min())
+
+        combined = self.weight * scores + (1 - self.weight) * prior
+        return np.argsort(-combined, kind="stable").tolist()
+
+
+class LexicalReranker(Reranker):
+    """
+    BM25 over the candidate set: idf and length normalization are computed from the candidates
+    themselves on every call, and all pairs are scored with one term-frequency matrix. A score
+    depends on the other candidates, so only the tokenized docs (term counts, length) are cached.
+    """
+
+    pair_cache = False
+
+    def __init__(self, k1=1.2, b=0.75, **kwargs):
+        super().__init__(**kwargs)
+        self.k1 = k1
+        self.b = b
+
+    def doc_stats(self, doc):
+        """
+        (term counts, length) of a doc, from the LRU cache when possible.
+        """
+        key = hashlib.sha1(doc.encode("utf-8")).digest()
+        with self.lock:
+            stats = self.cache.get(key)
+            if stats is not None:
+                self.cache.move_to_end(key)
+                return stats
+        tokens = tokenize(doc)
+        stats = (Counter(tokens), len(tokens))
+        with self.lock:
+            self.cache[key] = stats
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return stats
+
+    def score_pairs(self, query, docs):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return np.zeros(len(docs), dtype=np.float32)
+
+        tf = np.zeros((len(docs), len(terms)), dtype=np.float32)
+        lengths = np.empty(len(docs), dtype=np.float32)
+        for i, doc in enumerate(docs):
+            counts, lengths[i] = self.doc_stats(doc)
+            tf[i] = [counts.get(term, 0) for term in terms]
+
+        df = (tf > 0).sum(axis=0)
+        idf = np.log1p((len(docs) - df + 0.5) / (df + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * lengths / max(lengths.mean(), 1.0))
+        return ((tf * (self.k1 + 1)) / (tf + norm[:, None]) * idf).sum(axis=1)
+
+
+class OnnxCrossEncoderReranker(Reranker):
+    """
+    Cross-encoder exported to ONNX (e.g. ms-marco-MiniLM-L-6-v2), run on CPU with onnxruntime.
+    All pairs go through the model as one padded batch.
+    """
+
+    def __init__(self, model_path=RERANK_ONNX_MODEL, tokenizer_path=RERANK_ONNX_TOKENIZER, max_length=256, **kwargs):
+        super().__init__(**kwargs)
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The onnx re-ranker needs `pip install onnxruntime tokenizers`") from e
+
+        self.session = onnxruntime.InferenceSession(model_path, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+
+    def score_pairs(self, query, docs):
+        encodings = self.tokenizer.encode_batch([(query, doc) for doc in docs])
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(None, {k: v for k, v in inputs.items() if k in self.input_names})[0]
+        return logits.reshape(len(docs), -1)[:, 0]
+
+
+_reranker = None
+
+
+def get_reranker():
+    """
+    Process-wide re-ranker selected by the RERANKER setting (None when disabled).
+    """
+    global _reranker
+    if _reranker is None and RERANKER != "none":
+        _reranker = OnnxCrossEncoderReranker() if RERANKER == "onnx" else LexicalReranker()
+    return _reranker
+
+
+def rerank(query, docs, top_n, reranker=None):
+    """
+    Re-orders docs (strings) by relevance to the query and keeps the top_n.
+    """
+    reranker = reranker or get_reranker()
+    if reranker is None:
+        return docs[:top_n]
+    return [docs[i] for i in reranker.rank(query, docs)[:top_n]]
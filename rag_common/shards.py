@@ -0,0 +1,310 @@
+"""
+Local vector search sharded across worker processes.
+
+Every shard is an on-disk vector_store index (one per FAQ set / tenant, or one slice of a large
+corpus). Shards are spread over SHARD_PROCESSES worker processes, balanced by file size; each
+worker memory-maps its own shards, so searches run on every core instead of one GIL-bound thread.
+
+    store = ShardedVectorStore({"product": "shards/product.bin", "tech": "shards/tech.bin"})
+    store.search(query_embedding, top_k=8, shards=["tech"])   # routed
+    store.search(query_embedding, top_k=8)                    # every shard, merged top-k
+
+search() scatters one request per worker that owns a selected shard (the worker merges its own
+shards first) and gathers the merged top-k by score.
+
+    python -m rag_common.shards build --out shards          # one shard per ex-00 FAQ set
+    python -m rag_common.shards bench --n 400000 --shards 8 # sharded vs single-process QPS
+"""
+import argparse
+import atexit
+import heapq
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from rag_common.config import SHARD_PROCESSES, SHARD_START_METHOD
+from rag_common.vector_store import MmapVectorIndex, write_index
+
+
+def _serve(conn, shards):
+    """
+    Worker loop: ("open", name, path) | ("search", request_id, names, query, top_k, filter, rescore) | None.
+    """
+    indexes = {name: MmapVectorIndex(path) for name, path in shards.items()}
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        if message[0] == "open":
+            _, name, path = message
+            if name in indexes:
+                indexes[name].close()
+            indexes[name] = MmapVectorIndex(path)
+            continue
+        _, request_id, names, query, top_k, filter, rescore = message
+        try:
+            matches = []
+            for name in names:
+                for match in indexes[name].search(query, top_k=top_k, rescore=rescore, filter=filter):
+                    match["shard"] = name
+                    matches.append(match)
+            conn.send((request_id, True, heapq.nlargest(top_k, matches, key=lambda match: match["score"])))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}"))
+    for index in indexes.values():
+        index.close()
+
+
+class _Worker:
+    """
+    One search process and the thread in the parent that resolves its replies.
+    """
+
+    def __init__(self, context, shards):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child, shards), daemon=True)
+        self.process.start()
+        child.close()
+        self.shards = dict(shards)
+        self.size = sum(os.path.getsize(path) for path in shards.values())
+        self.send_lock = threading.Lock()
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.request_ids = itertools.count()
+        self.reader = threading.Thread(target=self._read, name="shard-reader", daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        while True:
+            try:
+                request_id, ok, result = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self.pending_lock:
+                future = self.pending.pop(request_id)
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(result))
+        # The process is gone: fail whatever is still waiting
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+        for future in pending.values():
+            future.set_exception(RuntimeError("Shard worker exited"))
+
+    def send(self, message):
+        with self.send_lock:
+            self.conn.send(message)
+
+    def open(self, name, path):
+        self.send(("open", name, path))
+        self.shards[name] = path
+        self.size += os.path.getsize(path)
+
+    def search(self, names, query, top_k, filter, rescore):
+        future = Future()
+        request_id = next(self.request_ids)
+        with self.pending_lock:
+            self.pending[request_id] = future
+        self.send(("search", request_id, names, query, top_k, filter, rescore))
+        return future
+
+    def close(self):
+        try:
+            self.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class ShardedVectorStore:
+    """
+    Router over shards = {name: index path} served by `processes` workers (0 = one per CPU,
+    never more than there are shards).
+    """
+
+    def __init__(self, shards, processes=SHARD_PROCESSES, start_method=SHARD_START_METHOD):
+        processes = min(processes or os.cpu_count() or 1, max(1, len(shards)))
+        # Largest shards first, each to the least loaded worker
+        assignment = [{} for _ in range(processes)]
+        sizes = [0] * processes
+        for name, path in sorted(shards.items(), key=lambda item: -os.path.getsize(item[1])):
+            worker = sizes.index(min(sizes))
+            assignment[worker][name] = path
+            sizes[worker] += os.path.getsize(path)
+
+        context = multiprocessing.get_context(start_method)
+        self.workers = [_Worker(context, worker_shards) for worker_shards in assignment]
+        self.owner = {name: worker for worker in self.workers for name in worker.shards}
+        self.lock = threading.Lock()
+        self.closed = False
+        atexit.register(self.close)
+
+    @classmethod
+    def from_dir(cls, directory, **kwargs):
+        """
+        One shard per *.bin file of `directory`, named after the file.
+        """
+        shards = {os.path.splitext(name)[0]: os.path.join(directory, name)
+                  for name in sorted(os.listdir(directory)) if name.endswith(".bin")}
+        return cls(shards, **kwargs)
+
+    @property
+    def shards(self):
+        return list(self.owner)
+
+    def add_shard(self, name, path):
+        """
+        Opens a new shard (or reopens `name` from a new file) in the least loaded worker.
+        """
+        with self.lock:
+            worker = self.owner.get(name) or min(self.workers, key=lambda worker: worker.size)
+            worker.open(name, path)
+            self.owner[name] = worker
+
+    def search(self, query, top_k=10, shards=None, filter=None, rescore=10, timeout=None):
+        """
+        Merged top_k over `shards` (default: all) as {"id", "score", "metadata", "shard"} dicts.
+        """
+        names = self.shards if shards is None else list(shards)
+        unknown = [name for name in names if name not in self.owner]
+        if unknown:
+            raise KeyError(f"Unknown shards: {unknown}")
+        by_worker = {}
+        for name in names:
+            by_worker.setdefault(self.owner[name], []).append(name)
+
+        query = np.asarray(query, dtype=np.float32)
+        futures = [worker.search(worker_names, query, top_k, filter, rescore)
+                   for worker, worker_names in by_worker.items()]
+        matches = [match for future in futures for match in future.result(timeout=timeout)]
+        return heapq.nlargest(top_k, matches, key=lambda match: match["score"])
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for worker in self.workers:
+            worker.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_shards(directory, ids, vectors, metadata=None, n_shards=4, dtype="int8", prefix="part"):
+    """
+    Splits one corpus round-robin into n_shards index files, returns {name: path}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    metadata = metadata if metadata is not None else [{} for _ in ids]
+    shards = {}
+    for shard in range(n_shards):
+        rows = range(shard, len(ids), n_shards)
+        name = f"{prefix}-{shard}"
+        shards[name] = os.path.join(directory, f"{name}.bin")
+        write_index(shards[name], [ids[i] for i in rows], vectors[shard::n_shards],
+                    [metadata[i] for i in rows], dtype=dtype)
+    return shards
+
+
+def build_faq_shards(args):
+    from rag_common.evaluate import create_backends
+    from rag_common.exercises import load_exercise
+    from rag_common.faqs import INDEXES
+    from rag_common.mock_backends import CallStats
+
+    bedrock_runtime, pinecone_factory = create_backends(args.backend, (0, 0, 0), args.cache_dir, CallStats())
+    faq_module = load_exercise("ex-00", bedrock_runtime=bedrock_runtime, pinecone_factory=pinecone_factory)
+    os.makedirs(args.out, exist_ok=True)
+    for index_name, faq in INDEXES.items():
+        category = index_name.replace("-index", "")
+        questions = list(faq)
+        path = os.path.join(args.out, f"{category}.bin")
+        write_index(path, [f"{category}-{i}" for i in range(len(questions))],
+                    [faq_module.get_embedding_model(question) for question in questions],
+                    [{"question": q, "answer": faq[q], "category": category, "language": "en"} for q in questions],
+                    dtype=args.dtype)
+        print(f"Wrote {len(questions)} vectors to {path}")
+
+
+def benchmark(args):
+    from rag_common.ann import synthetic_corpus
+
+    vectors = synthetic_corpus(args.n, args.dim)
+    ids = [str(i) for i in range(len(vectors))]
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), args.queries)]
+    directory = args.out
+    single_path = os.path.join(directory, "single.bin")
+    os.makedirs(directory, exist_ok=True)
+    write_index(single_path, ids, vectors, dtype=args.dtype)
+    shards = write_shards(directory, ids, vectors, n_shards=args.shards, dtype=args.dtype)
+
+    def run(search):
+        # Concurrent callers, like request threads of a service
+        started = time.perf_counter()
+        threads = [threading.Thread(target=lambda chunk=chunk: [search(q) for q in chunk])
+                   for chunk in np.array_split(queries, args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(queries) / (time.perf_counter() - started)
+
+    with MmapVectorIndex(single_path) as index:
+        truth = [[m["id"] for m in index.search(q, top_k=args.top_k)] for q in queries]
+        single_qps = run(lambda q: index.search(q, top_k=args.top_k))
+    with ShardedVectorStore(shards, processes=args.processes) as store:
+        store.search(queries[0], top_k=args.top_k)  # workers started and pages mapped
+        found = [[m["id"] for m in store.search(q, top_k=args.top_k)] for q in queries]
+        sharded_qps = run(lambda q: store.search(q, top_k=args.top_k))
+        workers = len(store.workers)
+    same = np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+    print(f"{args.n} x {args.dim} {args.dtype}, top_k={args.top_k}, {args.clients} client threads")
+    print(f"single process:            {single_qps:10.1f} QPS")
+    print(f"{args.shards} shards / {workers} workers: {sharded_qps:10.1f} QPS  (overlap with single: {same:.3f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and benchmark process-sharded local vector indexes")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="One shard per ex-00 FAQ set (product, finance, tech, ecommerce)")
+    build.add_argument("--out", default="shards")
+    build.add_argument("--backend", choices=["aws", "mock"], default="aws")
+    build.add_argument("--cache-dir", default=".eval_cache")
+    build.add_argument("--dtype", choices=["int8", "float16"], default="int8")
+
+    bench = commands.add_parser("bench", help="Sharded vs single-process search on a synthetic corpus")
+    bench.add_argument("--out", default=".shard_bench")
+    bench.add_argument("--n", type=int, default=400000)
+    bench.add_argument("--dim", type=int, default=256)
+    bench.add_argument("--shards", type=int, default=8)
+    bench.add_argument("--processes", type=int, default=SHARD_PROCESSES)
+    bench.add_argument("--queries", type=int, default=400)
+    bench.add_argument("--clients", type=int, default=8)
+    bench.add_argument("--top-k", type=int, default=10)
+    bench.add_argument("--dtype", choices=["int8", "float16"], default="int8")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_faq_shards(args)
+    else:
+        benchmark(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Versioned binary snapshots of warm state (embedding caches, local vector indexes, JSON documents)
+so a new process starts warm instead of re-embedding everything through Bedrock.
+
+Layout (little endian, every section aligned to 64 bytes):
+
+    header          magic, version, section count, creation time
+    section table   name, kind, offset, length for every section
+    sections        EMBEDDINGS: rows, dim, keys (offsets + UTF-8), float32 rows x dim matrix
+                    JSON:       one UTF-8 JSON document
+                    VECTOR_INDEX: a complete vector_store index file, opened in place
+
+Snapshot() maps the file read-only: embedding rows and indexes are views into the page cache,
+so restoring costs a few page faults rather than reading or parsing the whole file.
+"""
+import atexit
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from rag_common.vector_store import MmapVectorIndex
+
+MAGIC = b"RAGSNAP1"
+VERSION = 1
+ALIGNMENT = 64
+HEADER = struct.Struct("<8sIId")
+SECTION = struct.Struct("<32sIIQQ")
+EMBEDDINGS_HEADER = struct.Struct("<QQQ")
+
+EMBEDDINGS, JSON_DOCUMENT, VECTOR_INDEX = 1, 2, 3
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _pad(f):
+    f.write(b"\0" * (_align(f.tell()) - f.tell()))
+    return f.tell()
+
+
+def _write_embeddings(f, table):
+    keys = list(table.keys())
+    matrix = np.asarray([table[key] for key in keys], dtype="<f4")
+    dim = matrix.shape[1] if len(keys) else 0
+    start = f.tell()
+    f.write(b"\0" * EMBEDDINGS_HEADER.size)
+    blobs = [key.encode("utf-8") for key in keys]
+    offsets = np.zeros(len(blobs) + 1, dtype="<u8")
+    np.cumsum([len(blob) for blob in blobs], out=offsets[1:])
+    f.write(offsets.tobytes())
+    for blob in blobs:
+        f.write(blob)
+    matrix_offset = _pad(f) - start
+    f.write(matrix.tobytes())
+    end = f.tell()
+    f.seek(start)
+    f.write(EMBEDDINGS_HEADER.pack(len(keys), dim, matrix_offset))
+    f.seek(end)
+
+
+def write_snapshot(path, embeddings=None, documents=None, vector_indexes=None):
+    """
+    Writes a snapshot atomically (temporary file + rename).
+
+    embeddings: {name: {text: vector}}, documents: {name: JSON-serializable value},
+    vector_indexes: {name: path of a vector_store index file}.
+    """
+    sections = ([(name, EMBEDDINGS, table) for name, table in (embeddings or {}).items()]
+                + [(name, JSON_DOCUMENT, value) for name, value in (documents or {}).items()]
+                + [(name, VECTOR_INDEX, source) for name, source in (vector_indexes or {}).items()])
+    for name, _, _ in sections:
+        if len(name.encode("utf-8")) > 32:
+            raise ValueError(f"Section name {name} is longer than 32 bytes")
+
+    table = []
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * (HEADER.size + SECTION.size * len(sections)))
+            for name, kind, value in sections:
+                offset = _pad(f)
+                if kind == EMBEDDINGS:
+                    _write_embeddings(f, value)
+                elif kind == JSON_DOCUMENT:
+                    f.write(json.dumps(value, separators=(",", ":")).encode("utf-8"))
+                else:
+                    with open(value, "rb") as source:
+                        while True:
+                            block = source.read(1 << 20)
+                            if not block:
+                                break
+                            f.write(block)
+                table.append((name, kind, offset, f.tell() - offset))
+
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, len(table), time.time()))
+            for name, kind, offset, length in table:
+                f.write(SECTION.pack(name.encode("utf-8"), kind, 0, offset, length))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class EmbeddingTable:
+    """
+    Read-only text -> embedding mapping over a snapshot section. Rows are float32 views.
+    """
+
+    def __init__(self, buf, offset):
+        rows, dim, matrix_offset = EMBEDDINGS_HEADER.unpack_from(buf, offset)
+        self.dim = dim
+        self._buf = buf
+        self._key_offsets = np.frombuffer(buf, dtype="<u8", count=rows + 1, offset=offset + EMBEDDINGS_HEADER.size)
+        self._keys_base = offset + EMBEDDINGS_HEADER.size + (rows + 1) * 8
+        self._matrix = np.frombuffer(buf, dtype="<f4", count=rows * dim, offset=offset + matrix_offset).reshape(rows, dim)
+        self._rows = None
+
+    def _index(self):
+        # Keys are decoded on first lookup, the vectors themselves are never copied
+        if self._rows is None:
+            self._rows = {self.key(i): i for i in range(len(self._matrix))}
+        return self._rows
+
+    def key(self, i):
+        start, end = self._key_offsets[i], self._key_offsets[i + 1]
+        return self._buf[self._keys_base + start:self._keys_base + end].decode("utf-8")
+
+    def __len__(self):
+        return len(self._matrix)
+
+    def __contains__(self, text):
+        return text in self._index()
+
+    def get(self, text, default=None):
+        row = self._index().get(text)
+        return default if row is None else self._matrix[row]
+
+    def items(self):
+        for i in range(len(self._matrix)):
+            yield self.key(i), self._matrix[i]
+
+    def matrix(self):
+        return self._matrix
+
+
+class Snapshot:
+    """
+    Read-only, memory-mapped view over a file written by write_snapshot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, self.created_at = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} snapshot")
+        self.sections = {}
+        for i in range(count):
+            name, kind, _, offset, length = SECTION.unpack_from(self._mmap, HEADER.size + i * SECTION.size)
+            self.sections[name.rstrip(b"\0").decode("utf-8")] = (kind, offset, length)
+
+    def _section(self, name, kind):
+        if name not in self.sections:
+            return None
+        section_kind, offset, length = self.sections[name]
+        if section_kind != kind:
+            raise ValueError(f"Snapshot section {name} has kind {section_kind}, expected {kind}")
+        return offset, length
+
+    def embeddings(self, name):
+        section = self._section(name, EMBEDDINGS)
+        return EmbeddingTable(self._mmap, section[0]) if section else None
+
+    def document(self, name, default=None):
+        section = self._section(name, JSON_DOCUMENT)
+        if section is None:
+            return default
+        offset, length = section
+        return json.loads(self._mmap[offset:offset + length])
+
+    def vector_index(self, name):
+        section = self._section(name, VECTOR_INDEX)
+        if section is None:
+            return None
+        return MmapVectorIndex(self.path, offset=section[0])
+
+    def age(self):
+        return time.time() - self.created_at
+
+
+def open_snapshot(path):
+    """
+    Returns the Snapshot at `path`, or None if it is missing or unreadable (the caller starts cold).
+    """
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Ignoring snapshot {path}: {e}")
+        return None
+
+
+class PeriodicSnapshot:
+    """
+    Calls `collect()` -> write_snapshot keyword arguments and writes the snapshot every
+    `interval` seconds (0 = never) from a daemon thread, and once more at interpreter exit.
+    """
+
+    def __init__(self, path, collect, interval=0):
+        self.path = path
+        self.collect = collect
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def save(self):
+        with self.lock:
+            started = time.perf_counter()
+            write_snapshot(self.path, **self.collect())
+            print(f"DEBUG - Snapshot written to {self.path} in {time.perf_counter() - started:.3f}s")
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                print(f"Snapshot failed: {e}")
+
+    def start(self):
+        atexit.register(self.stop)
+        if self.interval:
+            self.thread = threading.Thread(target=self._loop, name="snapshot", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        try:
+            self.save()
+        except Exception as e:
+            print(f"Snapshot failed: {e}")
@@ -0,0 +1,160 @@
+"""
+Speculative generation: overlap generation with retrieval for queries seen before.
+
+The chatbots embed, retrieve, then generate, strictly in series. A repeated (or reworded, up to
+canonical_query) FAQ question usually retrieves the same top document as last time, so
+Speculation.run starts generating from the context remembered for the query while the fresh
+retrieval runs:
+
+- retrieval confirms the same top document: the speculative answer is committed, the query
+  costs max(retrieve, generate) instead of retrieve + generate;
+- it does not: the speculative answer is dropped and the answer is regenerated from the fresh
+  context (a running model call cannot be interrupted, it finishes in the background and its
+  tokens still count in the ledger).
+
+Both generations go through the pipeline's generation Stage as a StageCall inside the request
+deadline (PIPELINE_DEADLINE), so they are skipped, bounded and replaced by the stage's fallback
+exactly as in a pipeline run.
+
+    speculation = Speculation("direct", top_id=lambda match: match.id)
+    speculation.run(query, retrieve, pipeline.stages["generate"])   # retrieve(query) -> context
+
+stats() reports the win rate and the time saved;
+`python -m rag_common.speculative` measures both against mocked backends.
+"""
+import argparse
+import contextlib
+import io
+import random
+import threading
+import time
+
+from rag_common.canonical import query_keys
+from rag_common.config import PIPELINE_DEADLINE, SPECULATIVE_CACHE_SIZE, SPECULATIVE_GENERATION
+from rag_common.ledger import ledger
+from rag_common.pipeline import StageCache, StageCall, deadline
+
+
+class Speculation:
+    def __init__(self, name, top_id, enabled=SPECULATIVE_GENERATION, cache_size=SPECULATIVE_CACHE_SIZE):
+        self.name = name
+        self.top_id = top_id  # context -> id of its top document
+        self.enabled = enabled
+        self.contexts = StageCache(cache_size)
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(("queries", "speculated", "wins", "losses"), 0)
+        self.saved_seconds = 0.0
+
+    def _count(self, outcome, saved=0.0):
+        with self.lock:
+            self.counts["queries"] += 1
+            if outcome:
+                self.counts["speculated"] += 1
+                self.counts[outcome] += 1
+            self.saved_seconds += saved
+
+    def run(self, query, retrieve, generate, arguments=lambda query, context: (query, context)):
+        """
+        Answer of the `generate` Stage on arguments(query, retrieve(query)), speculating on the
+        context remembered for the query. The whole run is one ledger request named after the
+        speculation, within one request deadline (retrieve's pipeline run joins both).
+        """
+        key = query_keys.key(query, "speculation")
+        with ledger.request(self.name), deadline(PIPELINE_DEADLINE):
+            found, cached = self.contexts.get(key) if self.enabled else (False, None)
+            if not found:
+                context = retrieve(query)
+                self.contexts.put(key, context)
+                self._count(None)
+                return StageCall(generate, arguments(query, context)).result()
+
+            started = time.perf_counter()
+            speculative = StageCall(generate, arguments(query, cached))
+            context = retrieve(query)
+            retrieve_seconds = time.perf_counter() - started
+            self.contexts.put(key, context)
+
+            if speculative.skipped:
+                # Too little time left to generate: the fallback answers from the fresh context
+                self._count(None)
+                return StageCall(generate, arguments(query, context)).result()
+            if self.top_id(context) == self.top_id(cached):
+                try:
+                    answer = speculative.result()
+                except Exception as e:
+                    print(f"DEBUG - Speculation {self.name} failed ({e}), regenerating")
+                else:
+                    # Serial time minus the time it actually took (none saved when it timed out)
+                    saved = retrieve_seconds + speculative.seconds - (time.perf_counter() - started) \
+                        if speculative.seconds is not None else 0.0
+                    self._count("wins", saved=saved)
+                    return answer
+            else:
+                speculative.cancel()
+                print(f"DEBUG - Speculation {self.name}: top document changed, regenerating")
+            self._count("losses")
+            return StageCall(generate, arguments(query, context)).result()
+
+    def stats(self):
+        """
+        Queries, speculated ones (a context was remembered), wins and losses (a discarded
+        generation each), win rate and time saved per win and per query.
+        """
+        with self.lock:
+            counts = dict(self.counts)
+            saved = self.saved_seconds
+        speculated = counts["speculated"]
+        return {
+            **counts,
+            "win_rate": round(counts["wins"] / speculated, 4) if speculated else 0.0,
+            "saved_ms_per_win": round(1000 * saved / counts["wins"], 2) if counts["wins"] else 0.0,
+            "saved_ms_per_query": round(1000 * saved / counts["queries"], 2) if counts["queries"] else 0.0,
+        }
+
+
+def main():
+    from rag_common.evaluate import build_dataset, create_backends, percentile
+    from rag_common.exercises import load_exercise
+    from rag_common.faqs import faq_database, finance_faq, product_faq, tech_faq
+    from rag_common.mock_backends import CallStats
+
+    parser = argparse.ArgumentParser(description="Win rate and latency of speculative generation (mocked backends)")
+    parser.add_argument("--mock-latency-ms", default="25,30,350", help="embed,retrieve,llm latency of the mocks")
+    parser.add_argument("--repeats", type=int, default=3, help="Times each query is asked")
+    parser.add_argument("--limit", type=int, default=40, help="Distinct queries per chatbot")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    latency_ms = [float(x) for x in args.mock_latency_ms.split(",")]
+    bedrock_runtime, pinecone_factory = create_backends("mock", latency_ms, None, CallStats())
+    rng = random.Random(args.seed)
+    datasets = {
+        "ex-01": build_dataset({"faq_database": faq_database}, seed=args.seed),
+        "ex-06": build_dataset({"product": product_faq, "finance": finance_faq, "tech": tech_faq}, seed=args.seed),
+    }
+    chatbots = {"ex-01": "rag_chatbot_with_pinecone", "ex-06": "routing_rag"}
+
+    print(f"{'chatbot':<8} {'mode':<12} {'p50 ms':>8} {'mean ms':>8} {'win rate':>9} {'saved ms/q':>11}")
+    for exercise, function in chatbots.items():
+        items = rng.sample(datasets[exercise], min(args.limit, len(datasets[exercise])))
+        queries = [item["query"] for item in items] * args.repeats
+        for enabled in (False, True):
+            # A fresh module per mode: empty stage caches and no precomputed answers
+            module = load_exercise(exercise, bedrock_runtime=bedrock_runtime, pinecone_factory=pinecone_factory)
+            module.answer_table.enabled = False
+            module.speculation.enabled = enabled
+            latencies = []
+            with contextlib.redirect_stdout(io.StringIO()):
+                for query in queries:
+                    started = time.perf_counter()
+                    getattr(module, function)(query)
+                    latencies.append(time.perf_counter() - started)
+            latencies.sort()
+            stats = module.speculation.stats()
+            print(f"{exercise:<8} {'speculative' if enabled else 'serial':<12} {1000 * percentile(latencies, 50):>8.1f} "
+                  f"{1000 * sum(latencies) / len(latencies):>8.1f} "
+                  f"{stats['win_rate'] if enabled else 0:>9.2f} {stats['saved_ms_per_query']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
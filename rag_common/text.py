@@ -0,0 +1,48 @@
+import re
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "if", "of", "to", "in", "on", "for", "with", "at", "by",
+    "from", "is", "are", "was", "were", "be", "been", "it", "its", "this", "that", "these", "those",
+    "you", "your", "we", "our", "us", "i", "me", "my", "can", "will", "do", "does", "have", "has",
+    "as", "so", "not", "no", "yes", "any", "all", "also", "there", "their", "they", "them",
+}
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def stem(word):
+    """
+    Very light suffix stripping so "discounts"/"discount", "shipping"/"shipped"/"ships"/"ship" and
+    "courses"/"course" match. A final "e" is dropped too, so "pricing" and "price" both give "pric".
+    """
+    if word.endswith("ies") and len(word) > 4:
+        word = word[:-3] + "y"
+    elif word.endswith("es") and word[:-2].endswith(("s", "x", "z", "ch", "sh")) and len(word) > 4:
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith(("ss", "us")) and len(word) > 3:
+        word = word[:-1]
+
+    for suffix in ("ing", "ed"):
+        # Not "speed" / "need"
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not word.endswith("e" + suffix):
+            word = word[:-len(suffix)]
+            # "shipp" -> "ship", but "bill" / "pass" keep their double letter
+            if len(word) >= 4 and word[-1] == word[-2] and word[-1] not in "lsz":
+                word = word[:-1]
+            break
+
+    if word.endswith("e") and len(word) > 3:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text, stem_words=True):
+    """
+    Lowercased content words (stopwords removed), optionally stemmed.
+    """
+    words = [word for word in WORD_RE.findall(text.lower()) if word not in STOPWORDS]
+    return [stem(word) for word in words] if stem_words else words
+
+
+def content_words(text):
+    return set(tokenize(text, stem_words=False))
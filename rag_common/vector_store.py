@@ -0,0 +1,315 @@
+"""
+On-disk vector index opened with mmap.
+
+Layout (little endian, every section aligned to 64 bytes):
+
+    header          magic, version, dtype, count, dim, source dim and the offset of every section below
+    id table        (count + 1) uint64 offsets followed by the UTF-8 ids
+    vector block    count x dim quantized vectors (float16, or int8 with one float32 scale per row)
+    scales          count float32 scales (int8 only)
+    float block     count x dim float32 unit vectors, only touched to rescore candidates (optional)
+    metadata table  (count + 1) uint64 offsets followed by one JSON document per vector
+    projection      source dim float32 mean + source dim x dim float32 matrix (optional, see compression)
+
+Vectors are normalized at write time, so cosine similarity is a dot product. With a projection the
+stored vectors are reduced embeddings and search() projects the query the same way. Several
+processes opening the same file share one page-cached copy.
+
+search() scans every vector (backend "exact"), or with backend "ivfpq" takes its candidates from an
+IVF-PQ index (rag_common.ann) built over the stored vectors on the first search. A metadata filter
+is applied first and the IVF-PQ candidates are limited to the matching rows; when that leaves
+fewer than top_k, the matching rows are scanned exactly.
+"""
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from rag_common.config import VECTOR_SEARCH_BACKEND
+from rag_common.metadata_filter import MetadataIndex
+
+MAGIC = b"RAGVEC01"
+VERSION = 1
+ALIGNMENT = 64
+HEADER = struct.Struct("<8sIIQII6Q")
+
+DTYPES = {"float16": 1, "int8": 2}
+DTYPE_NAMES = {code: name for name, code in DTYPES.items()}
+BACKENDS = ("exact", "ivfpq")
+
+# Rows scored per step when scanning the quantized block, bounds temporary memory
+SCAN_BLOCK = 65536
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _pad(f):
+    f.write(b"\0" * (_align(f.tell()) - f.tell()))
+    return f.tell()
+
+
+def _write_strings(f, strings):
+    blobs = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(blobs) + 1, dtype="<u8")
+    np.cumsum([len(b) for b in blobs], out=offsets[1:])
+    f.write(offsets.tobytes())
+    for blob in blobs:
+        f.write(blob)
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def quantize_int8(vectors):
+    """
+    Symmetric per-row int8 quantization, returns (codes, scales).
+    """
+    scales = np.abs(vectors).max(axis=1, initial=0.0) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def project(vectors, mean, matrix):
+    return normalize((np.asarray(vectors, dtype=np.float32) - mean) @ matrix)
+
+
+def write_index(path, ids, vectors, metadata=None, dtype="int8", projection=None, rescore_block=True):
+    """
+    Writes ids, vectors and metadata to `path` atomically (temporary file + rename).
+
+    projection (a fitted compression.Projection) stores reduced vectors; rescore_block=False leaves
+    out the float block, search then ranks on the quantized vectors alone.
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported dtype {dtype}, expected one of {list(DTYPES)}")
+
+    source_dim = 0
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.size == 0:
+        # Empty corpus: a (0, dim) block, readable like any other index (search returns nothing)
+        dim = projection.matrix.shape[1] if projection is not None else (vectors.shape[1] if vectors.ndim == 2 else 0)
+        vectors = np.zeros((0, dim), dtype=np.float32)
+    elif projection is not None:
+        vectors = project(vectors, projection.mean, projection.matrix)
+    if projection is not None:
+        source_dim = len(projection.mean)
+    vectors = normalize(vectors)
+    count, dim = vectors.shape
+    ids = [str(i) for i in ids]
+    metadata = metadata if metadata is not None else [{} for _ in ids]
+    if len(ids) != count or len(metadata) != count:
+        raise ValueError("ids, vectors and metadata must have the same length")
+
+    if dtype == "int8":
+        codes, scales = quantize_int8(vectors)
+    else:
+        codes, scales = vectors.astype("<f2"), None
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * HEADER.size)
+        ids_offset = _pad(f)
+        _write_strings(f, ids)
+        vectors_offset = _pad(f)
+        f.write(codes.tobytes())
+        scales_offset = _pad(f)
+        if scales is not None:
+            f.write(scales.astype("<f4").tobytes())
+        floats_offset = _pad(f) if rescore_block else 0
+        if rescore_block:
+            f.write(vectors.astype("<f4").tobytes())
+        metadata_offset = _pad(f)
+        _write_strings(f, [json.dumps(m, separators=(",", ":")) for m in metadata])
+        projection_offset = 0
+        if projection is not None:
+            projection_offset = _pad(f)
+            f.write(np.asarray(projection.mean, dtype="<f4").tobytes())
+            f.write(np.asarray(projection.matrix, dtype="<f4").tobytes())
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, DTYPES[dtype], count, dim, source_dim, ids_offset, vectors_offset,
+                            scales_offset, floats_offset, metadata_offset, projection_offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class MmapVectorIndex:
+    """
+    Read-only view over a file written by write_index. `offset` locates an index embedded in a
+    larger file (e.g. a snapshot), it must be a multiple of 64. `backend` is "exact" or "ivfpq".
+    """
+
+    def __init__(self, path, offset=0, backend=VECTOR_SEARCH_BACKEND):
+        if offset % ALIGNMENT:
+            raise ValueError(f"Index offset {offset} is not aligned to {ALIGNMENT} bytes")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unsupported search backend {backend}, expected one of {list(BACKENDS)}")
+        self.path = path
+        self.backend = backend
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, dtype, count, dim, source_dim, ids_offset, vectors_offset, scales_offset,
+         floats_offset, metadata_offset, projection_offset) = HEADER.unpack_from(self._mmap, offset)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} vector index")
+        ids_offset, vectors_offset, scales_offset, metadata_offset = (
+            offset + ids_offset, offset + vectors_offset, offset + scales_offset, offset + metadata_offset)
+
+        self.dtype = DTYPE_NAMES[dtype]
+        self.count = count
+        self.dim = dim
+        self.source_dim = source_dim or dim
+
+        buf = self._mmap
+        self._id_offsets = np.frombuffer(buf, dtype="<u8", count=count + 1, offset=ids_offset)
+        self._ids_base = ids_offset + (count + 1) * 8
+        code_dtype = "<f2" if self.dtype == "float16" else np.int8
+        self._codes = np.frombuffer(buf, dtype=code_dtype, count=count * dim, offset=vectors_offset).reshape(count, dim)
+        self._scales = (np.frombuffer(buf, dtype="<f4", count=count, offset=scales_offset)
+                        if self.dtype == "int8" else None)
+        self._floats = (np.frombuffer(buf, dtype="<f4", count=count * dim, offset=offset + floats_offset).reshape(count, dim)
+                        if floats_offset else None)
+        self._meta_offsets = np.frombuffer(buf, dtype="<u8", count=count + 1, offset=metadata_offset)
+        self._meta_base = metadata_offset + (count + 1) * 8
+        self._metadata_index = None
+        self._ann_index = None
+        self._projection = None
+        if projection_offset:
+            start = offset + projection_offset
+            mean = np.frombuffer(buf, dtype="<f4", count=source_dim, offset=start)
+            matrix = np.frombuffer(buf, dtype="<f4", count=source_dim * dim, offset=start + source_dim * 4)
+            self._projection = (mean, matrix.reshape(source_dim, dim))
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        # Drop the numpy views first, mmap refuses to close while buffers are exported
+        self._id_offsets = self._codes = self._scales = self._floats = self._meta_offsets = self._projection = None
+        self._ann_index = None
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_id(self, i):
+        start, end = self._id_offsets[i], self._id_offsets[i + 1]
+        return self._mmap[self._ids_base + start:self._ids_base + end].decode("utf-8")
+
+    def get_metadata(self, i):
+        start, end = self._meta_offsets[i], self._meta_offsets[i + 1]
+        return json.loads(self._mmap[self._meta_base + start:self._meta_base + end])
+
+    def get_vector(self, i):
+        if self._floats is None:
+            return self._dequantize(self._codes[i:i + 1], None if self._scales is None else self._scales[i:i + 1])[0]
+        return np.array(self._floats[i])
+
+    def _dequantize(self, codes, scales):
+        vectors = codes.astype(np.float32)
+        return vectors if scales is None else vectors * scales[:, None]
+
+    def vectors(self):
+        """
+        Read-only (count, dim) view of the float32 block (dequantized copy if the index has none).
+        """
+        if self._floats is None:
+            return self._dequantize(self._codes, self._scales)
+        return self._floats
+
+    def project_query(self, query):
+        """
+        Normalized query in the space of the stored vectors.
+        """
+        if self._projection is None:
+            return normalize(query)
+        return project(query, *self._projection)
+
+    def metadata_index(self):
+        # Built on the first filtered search, reads every metadata document once
+        if self._metadata_index is None:
+            self._metadata_index = MetadataIndex([self.get_metadata(i) for i in range(self.count)])
+        return self._metadata_index
+
+    def ann_index(self):
+        # Built on the first "ivfpq" search, trains on every stored vector once
+        if self._ann_index is None:
+            from rag_common.ann import build_index
+            self._ann_index = build_index(self.vectors())
+        return self._ann_index
+
+    def ann_candidates(self, query, n, rows=None):
+        """
+        Rows of the n best IVF-PQ candidates (within `rows`), None when fewer than n are found.
+        """
+        matches = self.ann_index().search(query, n, rescore=0, allowed=rows)
+        if len(matches) < n:
+            return None
+        return np.array(sorted(int(i) for i, _ in matches), dtype=np.int64)
+
+    def approximate_scores(self, query, rows=None):
+        """
+        Dot products against the quantized block (optionally only for `rows`).
+        """
+        codes = self._codes if rows is None else self._codes[rows]
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_BLOCK):
+            block = codes[start:start + SCAN_BLOCK].astype(np.float32)
+            scores[start:start + SCAN_BLOCK] = block @ query
+        if self._scales is not None:
+            scores *= self._scales if rows is None else self._scales[rows]
+        return scores
+
+    def search(self, query, top_k=1, rescore=10, rows=None, filter=None):
+        """
+        Returns the top_k matches as {"id", "score", "metadata"} dicts.
+        The quantized block (or, with the "ivfpq" backend, the IVF-PQ index) picks top_k * rescore
+        candidates, which are rescored against the float vectors.
+        `filter` (Pinecone syntax, see metadata_filter) restricts the scan to matching rows.
+        """
+        if self.count == 0:
+            return []
+        query = self.project_query(query)
+        if filter:
+            filtered = self.metadata_index().rows(filter)
+            rows = filtered if rows is None else np.intersect1d(rows, filtered)
+        rows = None if rows is None else np.asarray(rows, dtype=np.int64)
+        if self.backend == "ivfpq":
+            candidates = self.ann_candidates(query, min(self.count, top_k * max(1, rescore)), rows)
+            if candidates is not None:
+                rows = candidates
+        approx = self.approximate_scores(query, rows)
+        if self._floats is None:
+            rescore = 1
+        n_candidates = min(len(approx), max(top_k, top_k * rescore))
+        if n_candidates == 0:
+            return []
+        candidates = np.argpartition(-approx, n_candidates - 1)[:n_candidates]
+        if self._floats is None:
+            # No float block: the quantized scores are final
+            exact = approx[candidates]
+            candidates = candidates if rows is None else rows[candidates]
+        else:
+            if rows is not None:
+                candidates = rows[candidates]
+            candidates = np.sort(candidates)  # sequential page access on the float block
+            exact = self._floats[candidates] @ query
+        order = np.argsort(-exact)[:top_k]
+        return [
+            {"id": self.get_id(candidates[i]), "score": float(exact[i]), "metadata": self.get_metadata(candidates[i])}
+            for i in order
+        ]